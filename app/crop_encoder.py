@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+import logging
+
+import cv2
+import numpy as np
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Supported crop formats: file extension, content type and the imencode
+# parameter that quality maps to
+CROP_FORMATS = {
+    'png': ('.png', 'image/png', cv2.IMWRITE_PNG_COMPRESSION),
+    'jpeg': ('.jpg', 'image/jpeg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('.webp', 'image/webp', cv2.IMWRITE_WEBP_QUALITY)
+}
+
+# PNG is lossless, so instead of a quality it takes a compression level
+# (0-9). Level 1 is several times faster than the default and only slightly larger.
+PNG_COMPRESSION_LEVEL = 1
+
+def encode_crop(image: np.ndarray, crop_format: str = 'png', quality: int = 90) -> bytes:
+    """Encode a BGR image in memory
+    
+    Args:
+        image: BGR image, e.g. a slice of a video frame
+        crop_format: 'png', 'jpeg' or 'webp'
+        quality: 1-100 for JPEG and WebP, ignored for PNG
+    
+    Returns:
+        Encoded image bytes
+    """
+    if crop_format not in CROP_FORMATS:
+        raise ValueError(f"Unknown crop format '{crop_format}'")
+    extension, _, flag = CROP_FORMATS[crop_format]
+    value = PNG_COMPRESSION_LEVEL if crop_format == 'png' else quality
+    ok, buffer = cv2.imencode(extension, image, [flag, value])
+    if not ok:
+        raise ValueError(f"Could not encode {image.shape} crop as {crop_format}")
+    return buffer.tobytes()
+
+class CropEncoder:
+    """Thread pool that encodes crops in memory
+    
+    cv2.imencode releases the GIL, so crops are compressed in parallel with
+    each other and with decoding and inference on the request thread.
+    """
+    
+    def __init__(self, crop_format: str = 'png', quality: int = 90, max_workers: Optional[int] = None):
+        """Initialize the encoder
+        
+        Args:
+            crop_format: 'png', 'jpeg' or 'webp'
+            quality: 1-100 for JPEG and WebP, ignored for PNG
+            max_workers: Number of encoding threads (default: number of CPUs)
+        """
+        if crop_format not in CROP_FORMATS:
+            raise ValueError(f"Unknown crop format '{crop_format}'")
+        if not 1 <= quality <= 100:
+            raise ValueError("quality must be between 1 and 100")
+        self.crop_format = crop_format
+        self.quality = quality
+        self.extension, self.content_type, _ = CROP_FORMATS[crop_format]
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or os.cpu_count() or 1,
+            thread_name_prefix='crop-encode'
+        )
+        self._stats_lock = threading.Lock()
+        self._encoded = 0
+        self._busy_seconds = 0.0
+    
+    def submit(self, image: np.ndarray) -> Future:
+        """Queue a crop for encoding
+        
+        Args:
+            image: BGR image. It must not be modified until the Future is done.
+        
+        Returns:
+            Future resolving to the encoded bytes
+        """
+        return self._executor.submit(self._encode, image)
+    
+    def stats(self) -> Dict:
+        """Get the number of encoded crops and the thread time spent encoding them"""
+        with self._stats_lock:
+            return {'items': self._encoded, 'busy_seconds': round(self._busy_seconds, 3)}
+    
+    def close(self) -> None:
+        """Wait for queued crops and stop the worker threads"""
+        self._executor.shutdown(wait=True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def _encode(self, image: np.ndarray) -> bytes:
+        start = time.perf_counter()
+        try:
+            return encode_crop(image, self.crop_format, self.quality)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.STAGE_SECONDS.labels('encode').observe(elapsed)
+            with self._stats_lock:
+                self._encoded += 1
+                self._busy_seconds += elapsed
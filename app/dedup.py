@@ -0,0 +1,134 @@
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def dhash(image: np.ndarray, hash_size: int = 8) -> int:
+    """Difference hash of an image
+    
+    The image is shrunk to hash_size x hash_size + 1 grayscale pixels and
+    every bit records whether a pixel is brighter than its right neighbour.
+    Crops of the same object from nearby frames differ in only a few bits.
+    
+    Args:
+        image: BGR or grayscale image
+        hash_size: Bits per row and column (the hash has hash_size**2 bits)
+    
+    Returns:
+        Hash as an integer
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two hashes"""
+    return (a ^ b).bit_count()
+
+class BKTree:
+    """Burkhard-Keller tree of hashes for nearest-neighbour search by Hamming distance
+    
+    Lookups only descend into children whose edge distance is within
+    max_distance of the query's distance to the node (triangle
+    inequality), so they visit a small part of the tree.
+    """
+    
+    def __init__(self):
+        # Node: (hash, value, {distance: child node})
+        self._root: Optional[Tuple[int, Any, Dict]] = None
+        self.size = 0
+    
+    def add(self, hash_value: int, value: Any) -> None:
+        """Insert a hash with an associated value"""
+        self.size += 1
+        if self._root is None:
+            self._root = (hash_value, value, {})
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (hash_value, value, {})
+                return
+            node = child
+    
+    def search(self, hash_value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """Find every stored value within max_distance bits of hash_value
+        
+        Returns:
+            List of (distance, value), closest first
+        """
+        matches = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= max_distance:
+                matches.append((distance, node[1]))
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+class CropDeduplicator:
+    """Per-video index of uploaded crops, to find near-identical crops of the same category
+    
+    Crops are compared by dHash within a BK-tree per category. Crops from the
+    same frame are never duplicates of each other: they show different
+    objects, even when they look alike.
+    """
+    
+    def __init__(self, max_distance: int = 4):
+        """Initialize the index
+        
+        Args:
+            max_distance: Largest Hamming distance (of 64 bits) between duplicate crops
+        """
+        self.max_distance = max_distance
+        self._trees: Dict[str, BKTree] = {}
+        self.duplicates = 0
+    
+    def find(self, category_name: str, hash_value: int, frame_number: int) -> Optional[Dict]:
+        """Get the closest canonical crop that hash_value duplicates
+        
+        Args:
+            category_name: Category of the crop
+            hash_value: dhash of the crop
+            frame_number: Frame the crop comes from
+        
+        Returns:
+            The canonical entry passed to add(), or None if the crop is new
+        """
+        tree = self._trees.get(category_name)
+        if tree is None:
+            return None
+        for _, canonical in tree.search(hash_value, self.max_distance):
+            if canonical['frame_number'] != frame_number and not canonical.get('failed'):
+                self.duplicates += 1
+                return canonical
+        return None
+    
+    def add(self, category_name: str, hash_value: int, canonical: Dict) -> None:
+        """Register a crop as canonical
+        
+        Args:
+            category_name: Category of the crop
+            hash_value: dhash of the crop
+            canonical: Entry returned by later find() calls; must contain
+                frame_number. Set its 'failed' key to stop matching it, e.g.
+                when its upload failed.
+        """
+        self._trees.setdefault(category_name, BKTree()).add(hash_value, canonical)
+    
+    def stats(self) -> Dict:
+        """Get the number of canonical crops and of duplicates found"""
+        return {
+            'unique_crops': sum(tree.size for tree in self._trees.values()),
+            'duplicate_crops': self.duplicates
+        }
@@ -0,0 +1,564 @@
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import cv2
+import numpy as np
+from typing import Dict, Iterator, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Codecs where every frame is a keyframe, so seeking never decodes skipped frames
+INTRA_ONLY_CODECS = {
+    'mjpg', 'mjpa', 'mjpb', 'jpeg', 'png ',
+    'apch', 'apcn', 'apcs', 'apco', 'ap4h',  # ProRes
+    'avdn', 'avdh', 'dnxh',  # DNxHD
+    'ffv1', 'raw ', 'i420', 'yuy2'
+}
+
+# Containers whose OpenCV/FFmpeg frame-accurate seeking we rely on
+SEEKABLE_CONTAINERS = {'.mp4', '.mov', '.mkv', '.avi', '.webm'}
+
+SAMPLING_STRATEGIES = ('read', 'grab', 'seek')
+
+# 'opencv' decodes with cv2.VideoCapture, 'ffmpeg' with an ffmpeg subprocess (see FFmpegFrameSampler)
+DECODERS = ('opencv', 'ffmpeg')
+
+def get_fourcc(cap: cv2.VideoCapture) -> str:
+    """Get the lower-cased FOURCC code of the capture's video stream"""
+    fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+    return ''.join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4)).lower()
+
+def choose_strategy(container: Optional[str], codec: Optional[str], frame_interval: float,
+                    seekable: bool = True, keyframes: Optional[List[int]] = None) -> str:
+    """Pick how to skip the frames between two samples
+    
+    Args:
+        container: File extension of the video, e.g. '.mp4'
+        codec: FOURCC code as returned by get_fourcc
+        frame_interval: Average number of frames between samples
+        seekable: False when the input is a pipe or other forward-only stream
+        keyframes: Keyframe frame numbers, if known
+    
+    Returns:
+        'seek' to jump straight to each sampled frame, or 'grab' to step
+        over skipped frames without converting them to BGR
+    """
+    if not seekable or frame_interval <= 1:
+        return 'grab'
+    if (container or '').lower() not in SEEKABLE_CONTAINERS:
+        return 'grab'
+    
+    # Every frame is a keyframe: a seek decodes exactly the frame we want
+    if (codec or '').lower() in INTRA_ONLY_CODECS:
+        return 'seek'
+    
+    # A seek decodes from the previous keyframe, so it only pays off when
+    # samples are further apart than keyframes
+    if keyframes and len(keyframes) > 1:
+        average_gop = (keyframes[-1] - keyframes[0]) / (len(keyframes) - 1)
+        if average_gop < frame_interval:
+            return 'seek'
+    
+    return 'grab'
+
+class FrameSampler:
+    """Decode only the frames of a video that are sampled for inference
+    
+    Yields the same (frame_number, frame) pairs as reading every frame with
+    cap.read() and keeping every frame_interval-th one, but skips the work
+    for the frames in between:
+    
+    - 'grab' advances with cap.grab() and only calls cap.retrieve() for
+      sampled frames, avoiding the BGR conversion and copy of skipped ones
+    - 'seek' jumps to sampled frames with CAP_PROP_POS_FRAMES when a keyframe
+      lies between the current position and the target, and grabs otherwise
+    - 'read' is the original decode-everything loop, kept as a reference
+    
+    With sample_seconds set, frames are sampled every N seconds of video
+    (frame round(k * N * fps)) instead of every frame_interval frames.
+    
+    start_frame and end_frame restrict sampling to a range of the video
+    without changing which frames are sampled, so a video can be split into
+    ranges that are processed separately (see split_sample_ranges).
+    """
+    
+    decoder = 'opencv'
+    
+    def __init__(self, cap: cv2.VideoCapture, frame_interval: int = 20,
+                 sample_seconds: Optional[float] = None, strategy: str = 'auto',
+                 container: Optional[str] = None, seekable: bool = True,
+                 keyframes: Optional[List[int]] = None, start_frame: int = 0,
+                 end_frame: Optional[int] = None):
+        """Initialize the sampler
+        
+        Args:
+            cap: Opened video capture positioned at the first frame
+            frame_interval: Sample every Nth frame
+            sample_seconds: Sample every N seconds instead, independent of fps
+            strategy: 'auto', 'grab', 'seek' or 'read'
+            container: File extension of the video, used by 'auto'
+            seekable: False when the input is a forward-only stream
+            keyframes: Sorted keyframe frame numbers, if known
+            start_frame: First frame of the range to sample; the capture is
+                moved there with a seek
+            end_frame: Frame after the range to sample (default: end of video)
+        """
+        self.cap = cap
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.codec = get_fourcc(cap)
+        self.sample_seconds = sample_seconds
+        self.keyframes = sorted(keyframes) if keyframes else None
+        
+        if sample_seconds is not None:
+            if sample_seconds <= 0:
+                raise ValueError("sample_seconds must be positive")
+            if self.fps <= 0:
+                raise ValueError("Cannot sample by time: video FPS is unknown")
+            self.frame_interval = sample_seconds * self.fps
+        else:
+            if frame_interval < 1:
+                raise ValueError("frame_interval must be at least 1")
+            self.frame_interval = frame_interval
+        
+        if strategy == 'auto':
+            strategy = choose_strategy(container, self.codec, self.frame_interval,
+                                       seekable, self.keyframes)
+        elif strategy not in SAMPLING_STRATEGIES:
+            raise ValueError(f"Unknown sampling strategy '{strategy}'")
+        if strategy == 'seek' and not seekable:
+            raise ValueError("Seeking requires a seekable input")
+        self.strategy = strategy
+        
+        if start_frame > 0 and not seekable:
+            raise ValueError("Sampling from start_frame requires a seekable input")
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        
+        # Index of the frame the next grab()/read() returns
+        self.position = 0
+        self._expected_samples = None
+        self.stats = {
+            'frames_grabbed': 0,
+            'frames_retrieved': 0,
+            'seeks': 0
+        }
+    
+    def target_frames(self) -> Iterator[int]:
+        """Generate the (unbounded) increasing sequence of frame numbers to sample, ignoring the range"""
+        if self.sample_seconds is None:
+            frame_number = 0
+            while True:
+                yield frame_number
+                frame_number += self.frame_interval
+        
+        k = 0
+        last = -1
+        while True:
+            frame_number = int(round(k * self.sample_seconds * self.fps))
+            if frame_number > last:
+                yield frame_number
+                last = frame_number
+            k += 1
+    
+    def range_targets(self) -> Iterator[int]:
+        """Generate the frame numbers to sample within start_frame and end_frame"""
+        for target in self.target_frames():
+            if self.end_frame is not None and target >= self.end_frame:
+                return
+            if target >= self.start_frame:
+                yield target
+    
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray]]:
+        for target in self.range_targets():
+            if self.position == 0 and target > 0 and self.start_frame > 0:
+                # Jump to the start of the range
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                self.stats['seeks'] += 1
+                self.position = target
+            frame = self._advance_to(target)
+            if frame is None:
+                return
+            yield target, frame
+    
+    def samples(self) -> Iterator[Tuple[int, np.ndarray, Optional[np.ndarray]]]:
+        """Generate (frame_number, frame, model_input) triples
+        
+        model_input is the frame already shrunk for the model by the decoder,
+        or None when the decoder only produces full-resolution frames.
+        """
+        for frame_number, frame in self:
+            yield frame_number, frame, None
+    
+    def close(self) -> None:
+        """Stop decoding; the capture itself is released by its owner"""
+    
+    def expected_samples(self) -> Optional[int]:
+        """Estimate how many frames will be sampled, from the container's frame count"""
+        if self.total_frames <= 0:
+            return None
+        if self._expected_samples is None:
+            count = 0
+            for frame_number in self.range_targets():
+                if frame_number >= self.total_frames:
+                    break
+                count += 1
+            self._expected_samples = count
+        return self._expected_samples
+    
+    def describe(self) -> Dict:
+        """Get the chosen strategy and decode counters"""
+        return dict(self.stats, strategy=self.strategy, codec=self.codec.strip(), decoder=self.decoder)
+    
+    def _advance_to(self, target: int) -> Optional[np.ndarray]:
+        """Position the capture on target and decode it, or None at end of stream"""
+        if self.strategy == 'read':
+            return self._read_to(target)
+        
+        if self.strategy == 'seek' and self._should_seek(target):
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+            self.stats['seeks'] += 1
+            self.position = target
+        
+        # Step over the skipped frames without converting them
+        while self.position < target:
+            if not self.cap.grab():
+                return None
+            self.stats['frames_grabbed'] += 1
+            self.position += 1
+        
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        self.stats['frames_retrieved'] += 1
+        self.position += 1
+        return frame
+    
+    def _read_to(self, target: int) -> Optional[np.ndarray]:
+        """Original behaviour: fully decode every frame up to and including target"""
+        while True:
+            ret, frame = self.cap.read()
+            if not ret:
+                return None
+            self.stats['frames_retrieved'] += 1
+            self.position += 1
+            if self.position - 1 == target:
+                return frame
+    
+    def _should_seek(self, target: int) -> bool:
+        """Seek only if it skips decoding at least one frame"""
+        if target <= self.position:
+            return False
+        if self.codec in INTRA_ONLY_CODECS or not self.keyframes:
+            return True
+        
+        # Seeking lands on the last keyframe at or before target; it is only
+        # cheaper than grabbing if that keyframe is past the current position
+        index = np.searchsorted(self.keyframes, target, side='right') - 1
+        return index >= 0 and self.keyframes[index] > self.position
+
+def split_sample_ranges(targets: List[int], shards: int) -> List[Tuple[int, int, int]]:
+    """Split the sampled frames of a video into ranges with about the same number of samples
+    
+    Args:
+        targets: Increasing frame numbers that are sampled
+        shards: Number of ranges
+    
+    Returns:
+        List of (start_frame, end_frame, first_sample_index) for
+        FrameSampler(start_frame=..., end_frame=...); first_sample_index is
+        the position of the range's first sample in targets. The last range
+        ends at None, the end of the video.
+    """
+    shards = max(1, min(shards, len(targets)))
+    ranges = []
+    for shard in range(shards):
+        first = shard * len(targets) // shards
+        following = (shard + 1) * len(targets) // shards
+        start_frame = targets[first] if shard > 0 else 0
+        end_frame = targets[following] if shard < shards - 1 else None
+        ranges.append((start_frame, end_frame, first))
+    return ranges
+
+class AdaptiveFrameSampler(FrameSampler):
+    """Sample frames when the scene changes instead of at a fixed interval
+    
+    Each decoded frame is reduced to a small grayscale thumbnail and compared
+    with the thumbnail of the last sampled frame. A frame is sampled once the
+    mean absolute difference reaches threshold (as a fraction of the full
+    intensity range), but never less than min_gap frames after the previous
+    sample, and at the latest max_gap frames after it. Still shots are thus
+    sampled every max_gap frames and fast pans up to every min_gap frames.
+    
+    Frames are read front to back, so this works on forward-only streams.
+    """
+    
+    def __init__(self, cap: cv2.VideoCapture, min_gap: int = 5, max_gap: int = 60,
+                 threshold: float = 0.05, probe_interval: int = 1,
+                 thumbnail_size: Tuple[int, int] = (64, 36)):
+        """Initialize the sampler
+        
+        Args:
+            cap: Opened video capture positioned at the first frame
+            min_gap: Minimum number of frames between two samples
+            max_gap: Maximum number of frames between two samples
+            threshold: Mean absolute thumbnail difference (0-1) that counts as a scene change
+            probe_interval: Compare every Nth frame between min_gap and max_gap
+            thumbnail_size: (width, height) of the compared thumbnails
+        """
+        if min_gap < 1 or max_gap < min_gap:
+            raise ValueError("Gaps must satisfy 1 <= min_gap <= max_gap")
+        if probe_interval < 1:
+            raise ValueError("probe_interval must be at least 1")
+        super().__init__(cap, frame_interval=min_gap, strategy='grab', seekable=False)
+        self.strategy = 'adaptive'
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+        self.thumbnail_size = thumbnail_size
+        self.stats.update({
+            'frames_compared': 0,
+            'inferences_skipped': 0,
+            'scene_changes': 0,
+            'max_gap_samples': 0
+        })
+    
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray]]:
+        last_sample = None
+        last_thumbnail = None
+        target = 0
+        while True:
+            frame = self._advance_to(target)
+            if frame is None:
+                return
+            thumbnail = self._thumbnail(frame)
+            
+            if last_sample is not None and target - last_sample < self.max_gap:
+                self.stats['frames_compared'] += 1
+                difference = float(np.mean(cv2.absdiff(thumbnail, last_thumbnail))) / 255.0
+                if difference < self.threshold:
+                    # Too similar to the last sample: skip inference on this frame
+                    self.stats['inferences_skipped'] += 1
+                    target = min(target + self.probe_interval, last_sample + self.max_gap)
+                    continue
+                self.stats['scene_changes'] += 1
+            elif last_sample is not None:
+                self.stats['max_gap_samples'] += 1
+            
+            yield target, frame
+            last_sample = target
+            last_thumbnail = thumbnail
+            target = last_sample + self.min_gap
+    
+    def expected_samples(self) -> Optional[int]:
+        """The number of samples depends on the content, so it is not known in advance"""
+        return None
+    
+    def _thumbnail(self, frame: np.ndarray) -> np.ndarray:
+        """Downscaled grayscale version of a BGR frame"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        return cv2.resize(gray, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+
+def read_frame(pipe, frame: np.ndarray) -> bool:
+    """Fill a preallocated frame buffer from a raw video pipe, or return False at end of stream"""
+    view = memoryview(frame).cast('B')
+    filled = 0
+    while filled < len(view):
+        count = pipe.readinto(view[filled:])
+        if not count:
+            return False
+        filled += count
+    return True
+
+class FFmpegFrameSampler(FrameSampler):
+    """Decode the sampled frames of a video file in an ffmpeg subprocess
+    
+    ffmpeg's select filter picks the same frames as FrameSampler, so only
+    those are converted to BGR and leave the decoder. They arrive as raw
+    bgr24 over a pipe and are read straight into NumPy arrays allocated for
+    them. Skipped frames are still decoded, as later frames refer to them,
+    but never converted or copied. A range that starts past the beginning
+    is reached with a seek, and ffmpeg stops after the last sample of a
+    range. threads sets ffmpeg's decoding threads (0 lets ffmpeg choose).
+    
+    With input_size, ffmpeg also scales every sampled frame to that
+    (width, height) and sends it through a second pipe, so the model input
+    comes out of the decoder while crops are still cut from the
+    full-resolution frame (see samples()).
+    
+    The capture only provides the video's properties and is not read, so
+    the file must not be a pipe that can only be opened once.
+    """
+    
+    decoder = 'ffmpeg'
+    
+    def __init__(self, cap: cv2.VideoCapture, video_path: str, frame_interval: int = 20,
+                 sample_seconds: Optional[float] = None, start_frame: int = 0,
+                 end_frame: Optional[int] = None, threads: int = 0,
+                 input_size: Optional[Tuple[int, int]] = None):
+        """Initialize the sampler
+        
+        Args:
+            cap: Opened video capture of video_path
+            video_path: Local video file
+            frame_interval: Sample every Nth frame
+            sample_seconds: Sample every N seconds instead, independent of fps
+            start_frame: First frame of the range to sample
+            end_frame: Frame after the range to sample (default: end of video)
+            threads: Decoding threads, or 0 for ffmpeg's default
+            input_size: (width, height) of the model inputs to produce, or
+                None for full-resolution frames only
+        """
+        super().__init__(cap, frame_interval=frame_interval, sample_seconds=sample_seconds,
+                         strategy='grab', start_frame=start_frame, end_frame=end_frame)
+        if shutil.which('ffmpeg') is None:
+            raise RuntimeError("ffmpeg is required for the ffmpeg decoder")
+        if threads < 0:
+            raise ValueError("threads must not be negative")
+        self.width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if self.width <= 0 or self.height <= 0:
+            raise ValueError("Cannot decode with ffmpeg: frame size is unknown")
+        if start_frame > 0 and self.fps <= 0:
+            raise ValueError("Cannot seek to start_frame: video FPS is unknown")
+        self.strategy = 'ffmpeg'
+        self.video_path = video_path
+        self.threads = threads
+        self.input_size = tuple(input_size) if input_size and tuple(input_size) != (self.width, self.height) else None
+        self.process = None
+        self._closed = False
+        self.stats['frames_scaled'] = 0
+    
+    def select_expression(self) -> str:
+        """Build the select filter expression that is true for the frames target_frames() yields
+        
+        ffmpeg numbers frames from 0 after a seek, so n is offset by start_frame.
+        """
+        frame_number = f"n+{self.start_frame}"
+        if self.sample_seconds is None:
+            return f"not(mod({frame_number},{self.frame_interval}))"
+        
+        # Walk k forward like target_frames(), keeping k in variable 0 and the
+        # next target round(k * sample_seconds * fps) in variable 1. Ties are
+        # rounded to even, as Python's round() does.
+        next_target = (
+            f"st(0,ld(0)+1);st(2,ld(0)*{self.sample_seconds!r}*{self.fps!r});st(3,floor(ld(2)));"
+            f"st(1,ld(3)+gt(ld(2)-ld(3),0.5)+eq(ld(2)-ld(3),0.5)*mod(ld(3),2))"
+        )
+        return f"while(lt(ld(1),{frame_number}),{next_target});eq(ld(1),{frame_number})"
+    
+    def command(self, inputs_fd: Optional[int] = None) -> List[str]:
+        """Build the ffmpeg command line, writing frames to stdout and model inputs to inputs_fd"""
+        cmd = ['ffmpeg', '-nostdin', '-v', 'error', '-threads', str(self.threads)]
+        if self.start_frame > 0:
+            # Half a frame early, so that rounding cannot skip the first frame of the range
+            cmd += ['-ss', f"{(self.start_frame - 0.5) / self.fps:.6f}"]
+        cmd += ['-i', self.video_path]
+        
+        graph = f"[0:v]select='{self.select_expression()}'"
+        outputs = [('frames', 'pipe:1')]
+        if self.input_size is None:
+            graph += '[frames]'
+        else:
+            width, height = self.input_size
+            graph += f",split[frames][sampled];[sampled]scale={width}:{height}:flags=area[inputs]"
+            outputs.append(('inputs', f"pipe:{inputs_fd}"))
+        cmd += ['-filter_complex', graph]
+        
+        frame_limit = self.expected_range_samples()
+        for label, target in outputs:
+            # Pass the selected frames on as they are, without duplicating any to keep a constant rate
+            cmd += ['-map', f"[{label}]", '-fps_mode', 'passthrough']
+            if frame_limit is not None:
+                cmd += ['-frames:v', str(frame_limit)]
+            cmd += ['-f', 'rawvideo', '-pix_fmt', 'bgr24', target]
+        return cmd
+    
+    def expected_range_samples(self) -> Optional[int]:
+        """Count the samples of a range that ends at end_frame, or None for a range open to the end"""
+        if self.end_frame is None:
+            return None
+        return sum(1 for _ in self.range_targets())
+    
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray]]:
+        for frame_number, frame, _ in self.samples():
+            yield frame_number, frame
+    
+    def samples(self) -> Iterator[Tuple[int, np.ndarray, Optional[np.ndarray]]]:
+        inputs_read, inputs_write = os.pipe() if self.input_size is not None else (None, None)
+        with tempfile.TemporaryFile() as stderr:
+            self.process = subprocess.Popen(
+                self.command(inputs_write),
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+                bufsize=0,
+                pass_fds=(inputs_write,) if inputs_write is not None else ()
+            )
+            inputs = None
+            reader = None
+            if inputs_write is not None:
+                os.close(inputs_write)
+                # Read the model inputs on their own thread, so that neither
+                # pipe can fill up while this one waits for the other
+                inputs = queue.Queue()
+                reader = threading.Thread(
+                    target=self._read_inputs,
+                    args=(os.fdopen(inputs_read, 'rb', buffering=0), inputs),
+                    name='ffmpeg-inputs',
+                    daemon=True
+                )
+                reader.start()
+            if self.start_frame > 0:
+                self.stats['seeks'] += 1
+                self.position = self.start_frame
+            
+            try:
+                for target in self.range_targets():
+                    frame = np.empty((self.height, self.width, 3), dtype=np.uint8)
+                    if not read_frame(self.process.stdout, frame):
+                        break
+                    model_input = None
+                    if inputs is not None:
+                        model_input = inputs.get()
+                        if model_input is None:
+                            break
+                        self.stats['frames_scaled'] += 1
+                    # ffmpeg decoded the frames in between without passing them on
+                    self.stats['frames_grabbed'] += target - self.position
+                    self.stats['frames_retrieved'] += 1
+                    self.position = target + 1
+                    yield target, frame, model_input
+                
+                self.process.wait()
+                if self.process.returncode != 0 and not self._closed:
+                    stderr.seek(0)
+                    message = stderr.read().decode(errors='replace').strip()
+                    raise RuntimeError(f"ffmpeg could not decode the video: {message[-500:]}")
+            finally:
+                self.close()
+                self.process.stdout.close()
+                if reader is not None:
+                    reader.join()
+    
+    def close(self) -> None:
+        """Stop ffmpeg if it is still running"""
+        self._closed = True
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+    
+    def _read_inputs(self, pipe, inputs: queue.Queue) -> None:
+        """Queue the model inputs arriving on pipe, then None at its end"""
+        width, height = self.input_size
+        with pipe:
+            while True:
+                model_input = np.empty((height, width, 3), dtype=np.uint8)
+                if not read_frame(pipe, model_input):
+                    break
+                inputs.put(model_input)
+        inputs.put(None)
@@ -0,0 +1,280 @@
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Union
+import logging
+
+from requests.adapters import HTTPAdapter
+from google.cloud import storage
+from google.cloud.storage.retry import DEFAULT_RETRY
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Size of the HTTP connection pool shared by every GCS call in the process
+GCS_POOL_SIZE = int(os.environ.get('GCS_POOL_SIZE', 32))
+
+_client_lock = threading.Lock()
+_client: Optional[storage.Client] = None
+
+def get_storage_client() -> storage.Client:
+    """Get the process-wide GCS client
+    
+    The client is created once and its HTTP session gets a connection pool
+    large enough for the upload threads, so requests reuse TLS connections
+    instead of opening one per crop.
+    
+    Returns:
+        Shared storage.Client
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            client = storage.Client()
+            adapter = HTTPAdapter(
+                pool_connections=GCS_POOL_SIZE,
+                pool_maxsize=GCS_POOL_SIZE
+            )
+            client._http.mount('https://', adapter)
+            _client = client
+            logger.info(f"Created shared GCS client with a pool of {GCS_POOL_SIZE} connections")
+        return _client
+
+def set_storage_client(client) -> None:
+    """Replace the shared GCS client, e.g. with a local stand-in for benchmarks
+    
+    Args:
+        client: Object implementing the storage.Client methods used by the app
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+class GCSUploader:
+    """Bounded thread pool that uploads bytes to a GCS bucket in the background
+    
+    submit_bytes() returns immediately with a Future for the uploaded gs:// path,
+    so uploads overlap with decoding and inference. At most max_pending
+    uploads are queued; further calls block until one finishes,
+    which keeps the number of crops waiting in memory bounded.
+    """
+    
+    def __init__(self, bucket_name: str, max_workers: int = 8, max_pending: Optional[int] = None,
+                 client: Optional[storage.Client] = None):
+        """Initialize the uploader
+        
+        Args:
+            bucket_name: Destination bucket
+            max_workers: Number of concurrent uploads
+            max_pending: Maximum queued plus in-flight uploads (default 4 * max_workers)
+            client: GCS client to use instead of the shared one
+        """
+        self.bucket_name = bucket_name
+        self.bucket = (client or get_storage_client()).bucket(bucket_name)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gcs-upload')
+        self._slots = threading.BoundedSemaphore(max_pending or 4 * max_workers)
+        self._count_lock = threading.Lock()
+        self.uploaded_count = 0
+        self.failed_count = 0
+        self.busy_seconds = 0.0
+        self.max_pending = 0
+        self._pending = 0
+    
+    def submit_bytes(self, data: Union[bytes, Future], blob_name: str,
+                     content_type: Optional[str] = None) -> Future:
+        """Queue in-memory data for upload
+        
+        Args:
+            data: Bytes to upload, or a Future resolving to them (e.g. from
+                CropEncoder.submit); the upload fails if the Future does
+            blob_name: Destination object name within the bucket
+            content_type: MIME type stored with the object
+        
+        Returns:
+            Future resolving to the gs:// path of the uploaded object
+        """
+        def upload(blob):
+            payload = data.result() if isinstance(data, Future) else data
+            blob.upload_from_string(payload, content_type=content_type, retry=DEFAULT_RETRY)
+        
+        return self._submit(upload, blob_name)
+    
+    def _submit(self, upload: Callable, blob_name: str) -> Future:
+        self._slots.acquire()
+        with self._count_lock:
+            self._pending += 1
+            self.max_pending = max(self.max_pending, self._pending)
+        try:
+            future = self._executor.submit(self._upload, upload, blob_name)
+        except Exception:
+            with self._count_lock:
+                self._pending -= 1
+            self._slots.release()
+            raise
+        return future
+    
+    def stats(self) -> Dict:
+        """Get upload counts, thread time spent uploading and the most uploads queued at once"""
+        with self._count_lock:
+            return {
+                'items': self.uploaded_count + self.failed_count,
+                'failed': self.failed_count,
+                'busy_seconds': round(self.busy_seconds, 3),
+                'max_queue_depth': self.max_pending
+            }
+    
+    def close(self) -> None:
+        """Wait for outstanding uploads and stop the worker threads"""
+        self._executor.shutdown(wait=True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def _upload(self, upload: Callable, blob_name: str) -> str:
+        start = time.perf_counter()
+        try:
+            blob = self.bucket.blob(blob_name)
+            
+            # Uploads retry transient errors (429, 5xx, connection resets) with
+            # backoff. Object names are unique per session, so the retry is idempotent.
+            upload(blob)
+            
+            gcs_path = f"gs://{self.bucket_name}/{blob_name}"
+            with self._count_lock:
+                self.uploaded_count += 1
+            logger.info(f"Uploaded cropped image: {gcs_path}")
+            return gcs_path
+        
+        except Exception as e:
+            with self._count_lock:
+                self.failed_count += 1
+            logger.error(f"Error uploading to GCS: {e}")
+            raise
+        
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.STAGE_SECONDS.labels('upload').observe(elapsed)
+            with self._count_lock:
+                self._pending -= 1
+                self.busy_seconds += elapsed
+            self._slots.release()
+
+# Containers FFmpeg can demux from a forward-only pipe
+STREAMABLE_CONTAINERS = {'.mkv', '.webm', '.flv'}
+
+# Containers that can be streamed only if the moov atom precedes the media data
+MP4_CONTAINERS = {'.mp4', '.mov', '.m4v'}
+
+def mp4_moov_before_mdat(header: bytes) -> Optional[bool]:
+    """Check whether an MP4/MOV file is laid out for progressive playback
+    
+    Walks the top-level boxes in the first bytes of the file.
+    
+    Args:
+        header: Leading bytes of the file
+        
+    Returns:
+        True if 'moov' comes before 'mdat', False if 'mdat' comes first,
+        None if neither was found in header
+    """
+    offset = 0
+    while offset + 8 <= len(header):
+        size, box_type = struct.unpack('>I4s', header[offset:offset + 8])
+        if box_type == b'moov':
+            return True
+        if box_type == b'mdat':
+            return False
+        if size == 1:
+            # 64-bit box size follows the type
+            if offset + 16 > len(header):
+                return None
+            size = struct.unpack('>Q', header[offset + 8:offset + 16])[0]
+        if size < 8:
+            # size 0 means the box runs to the end of the file
+            return None
+        offset += size
+    return None
+
+def is_streamable(blob, extension: str, header_bytes: int = 64 * 1024) -> bool:
+    """Check whether a video can be decoded from a forward-only stream
+    
+    MP4/MOV files written with the index ('moov' atom) at the end need random
+    access and have to be downloaded in full first.
+    
+    Args:
+        blob: GCS blob of the video
+        extension: Lower-cased file extension, e.g. '.mp4'
+        header_bytes: Number of leading bytes fetched to find the 'moov' atom
+        
+    Returns:
+        True if the video can be piped into the decoder
+    """
+    if extension in STREAMABLE_CONTAINERS:
+        return True
+    if extension in MP4_CONTAINERS:
+        header = blob.download_as_bytes(start=0, end=header_bytes - 1)
+        return mp4_moov_before_mdat(header) is True
+    return False
+
+class StreamingDownload:
+    """Stream a GCS blob into a named pipe that the video decoder reads from
+    
+    A background thread writes the object into the pipe as the bytes arrive,
+    so decoding starts with the first chunk instead of after the full
+    download. The reader must open path, read it sequentially and close it
+    before close() is called.
+    """
+    
+    def __init__(self, blob, extension: str = ''):
+        """Start streaming
+        
+        Args:
+            blob: GCS blob to stream
+            extension: File extension given to the pipe, helps format probing
+        """
+        self.blob = blob
+        self.error: Optional[Exception] = None
+        self._dir = tempfile.mkdtemp(prefix='video-stream-')
+        self.path = os.path.join(self._dir, f"video{extension}")
+        os.mkfifo(self.path)
+        self._thread = threading.Thread(target=self._run, name='gcs-stream', daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        try:
+            # Opening a FIFO for writing blocks until the decoder opens it
+            with open(self.path, 'wb') as pipe:
+                start = time.perf_counter()
+                self.blob.download_to_file(pipe)
+            metrics.DOWNLOAD_SECONDS.observe(time.perf_counter() - start)
+            metrics.DOWNLOAD_BYTES.inc(self.blob.size or 0)
+        except BrokenPipeError:
+            # The decoder stopped reading early (end of sampling or an error)
+            logger.info(f"Decoder closed the stream of gs://{self.blob.bucket.name}/{self.blob.name}")
+        except Exception as e:
+            self.error = e
+            logger.error(f"Error streaming from GCS: {e}")
+    
+    def close(self, timeout: float = 30.0):
+        """Stop the writer thread and remove the pipe"""
+        deadline = time.monotonic() + timeout
+        while self._thread.is_alive() and time.monotonic() < deadline:
+            try:
+                # Briefly open the read end so a writer still waiting for the
+                # decoder gets unblocked and then fails with a broken pipe
+                fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+                os.close(fd)
+            except OSError:
+                pass
+            self._thread.join(0.1)
+        if self._thread.is_alive():
+            logger.warning(f"GCS stream writer did not stop within {timeout}s")
+        shutil.rmtree(self._dir, ignore_errors=True)
@@ -0,0 +1,259 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import closing
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+
+from google.api_core.exceptions import NotFound
+
+logger = logging.getLogger(__name__)
+
+def _now() -> str:
+    return datetime.utcnow().isoformat() + 'Z'
+
+class JobStore(ABC):
+    """Storage for analysis jobs and their results
+    
+    A job is a dictionary with job_id, status ('queued', 'running',
+    'succeeded' or 'failed'), created_at, updated_at, progress, params and,
+    once finished, result (the analyze_video response body) or error.
+    """
+    
+    def create(self, job_id: str, params: Dict) -> Dict:
+        """Store a new queued job and return it"""
+        job = {
+            'job_id': job_id,
+            'status': 'queued',
+            'created_at': _now(),
+            'updated_at': _now(),
+            'progress': {'frames_done': 0, 'frames_total': None},
+            'params': params,
+            'result': None,
+            'error': None
+        }
+        self.save(job)
+        return job
+    
+    def update(self, job_id: str, **fields) -> Optional[Dict]:
+        """Change fields of a stored job and return the updated job"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.update(fields, updated_at=_now())
+        self.save(job)
+        return job
+    
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Get a job by id, or None if it doesn't exist"""
+    
+    @abstractmethod
+    def save(self, job: Dict) -> None:
+        """Insert or replace a job"""
+
+class SQLiteJobStore(JobStore):
+    """Job store in a SQLite database, shared by all workers on the instance"""
+    
+    def __init__(self, path: str):
+        """Initialize the store
+        
+        Args:
+            path: Database file, created if missing
+        """
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, job TEXT NOT NULL)')
+    
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per call keeps the store thread-safe
+        return sqlite3.connect(self.path, timeout=30)
+    
+    def get(self, job_id: str) -> Optional[Dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT job FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def save(self, job: Dict) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute('INSERT OR REPLACE INTO jobs (job_id, job) VALUES (?, ?)',
+                         (job['job_id'], json.dumps(job)))
+
+class LocalFileJobStore(JobStore):
+    """Job store with one JSON file per job in a local directory"""
+    
+    def __init__(self, directory: str):
+        """Initialize the store
+        
+        Args:
+            directory: Directory for the job files, created if missing
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+    
+    def _path(self, job_id: str) -> str:
+        # Job ids are generated by us, but never let one escape the directory
+        return os.path.join(self.directory, f"{os.path.basename(job_id)}.json")
+    
+    def get(self, job_id: str) -> Optional[Dict]:
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+    
+    def save(self, job: Dict) -> None:
+        # Write then rename so readers never see a partial file
+        path = self._path(job['job_id'])
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(job, f)
+        os.replace(temp_path, path)
+
+class GCSJobStore(JobStore):
+    """Job store with one JSON object per job in a GCS bucket, shared by all instances"""
+    
+    # GCS allows about one write per second to the same object
+    min_progress_interval = 1.0
+    
+    def __init__(self, bucket, prefix: str = 'analysis-jobs'):
+        """Initialize the store
+        
+        Args:
+            bucket: google.cloud.storage Bucket holding the jobs
+            prefix: Object name prefix for the jobs
+        """
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+        # Time of the last write per unfinished job, to throttle progress updates
+        self._written_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+    
+    def _blob(self, job_id: str):
+        return self.bucket.blob(f"{self.prefix}/{os.path.basename(job_id)}.json")
+    
+    def update(self, job_id: str, **fields) -> Optional[Dict]:
+        if set(fields) == {'progress'}:
+            with self._lock:
+                written_at = self._written_at.get(job_id)
+            if written_at is not None and time.monotonic() - written_at < self.min_progress_interval:
+                # Skipped progress is superseded by the next update
+                return None
+        return super().update(job_id, **fields)
+    
+    def get(self, job_id: str) -> Optional[Dict]:
+        try:
+            data = self._blob(job_id).download_as_bytes()
+        except NotFound:
+            return None
+        return json.loads(data)
+    
+    def save(self, job: Dict) -> None:
+        self._blob(job['job_id']).upload_from_string(json.dumps(job), content_type='application/json')
+        with self._lock:
+            if job['status'] in ('succeeded', 'failed'):
+                self._written_at.pop(job['job_id'], None)
+            else:
+                self._written_at[job['job_id']] = time.monotonic()
+
+def create_job_store(backend: str, path: str, storage_client=None) -> JobStore:
+    """Create a job store from configuration
+    
+    Args:
+        backend: 'sqlite', 'file' or 'gcs'
+        path: Database file for 'sqlite', directory for 'file',
+            gs://bucket/prefix for 'gcs'
+        storage_client: GCS client for 'gcs'
+    
+    Returns:
+        JobStore instance
+    """
+    if backend == 'sqlite':
+        return SQLiteJobStore(path)
+    if backend == 'file':
+        return LocalFileJobStore(path)
+    if backend == 'gcs':
+        if not path.startswith('gs://'):
+            raise ValueError("GCS job store path must be a gs:// URI")
+        bucket_name, _, prefix = path[len('gs://'):].partition('/')
+        return GCSJobStore(storage_client.bucket(bucket_name), prefix or 'analysis-jobs')
+    raise ValueError(f"Unknown job store backend '{backend}'")
+
+class JobManager:
+    """Run analysis jobs on a background thread pool and record them in a JobStore"""
+    
+    def __init__(self, store: JobStore, runner: Callable[..., Tuple[Dict, int]], max_workers: int = 1):
+        """Initialize the manager
+        
+        Args:
+            store: Where jobs, progress and results are kept
+            runner: Called as runner(params, progress_callback=...) and
+                returns (response_body, status_code)
+            max_workers: Number of jobs processed concurrently
+        """
+        self.store = store
+        self.runner = runner
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis-job')
+        # Jobs of this process that have not finished yet
+        self._futures: Dict[str, Future] = {}
+        self._futures_lock = threading.Lock()
+    
+    def submit(self, params: Dict) -> Dict:
+        """Queue a job and return its initial record"""
+        job_id = uuid.uuid4().hex
+        job = self.store.create(job_id, params)
+        future = self._executor.submit(self._run, job_id, params)
+        with self._futures_lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._forget(job_id))
+        logger.info(f"Queued analysis job {job_id}")
+        return job
+    
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Get a job record by id"""
+        return self.store.get(job_id)
+    
+    def wait(self, job_ids: List[str], timeout: Optional[float] = None) -> List[Optional[Dict]]:
+        """Wait until jobs submitted by this process have finished
+        
+        Args:
+            job_ids: Jobs to wait for
+            timeout: Seconds to wait at most; unfinished jobs are then
+                returned with their current status
+        
+        Returns:
+            The job records, in the order of job_ids
+        """
+        with self._futures_lock:
+            futures = [self._futures[job_id] for job_id in job_ids if job_id in self._futures]
+        wait(futures, timeout=timeout)
+        return [self.get(job_id) for job_id in job_ids]
+    
+    def _forget(self, job_id: str):
+        with self._futures_lock:
+            self._futures.pop(job_id, None)
+    
+    def _run(self, job_id: str, params: Dict):
+        self.store.update(job_id, status='running')
+        
+        def progress_callback(frames_done: int, frames_total: Optional[int]):
+            self.store.update(job_id, progress={'frames_done': frames_done, 'frames_total': frames_total})
+        
+        try:
+            result, status_code = self.runner(params, progress_callback=progress_callback)
+            if status_code < 400:
+                self.store.update(job_id, status='succeeded', result=result)
+                logger.info(f"Analysis job {job_id} succeeded")
+            else:
+                self.store.update(job_id, status='failed', error=result, status_code=status_code)
+                logger.info(f"Analysis job {job_id} failed: {result}")
+        except Exception as e:
+            logger.error(f"Analysis job {job_id} crashed: {e}")
+            self.store.update(job_id, status='failed', error={'error': str(e)})
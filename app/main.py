@@ -1,15 +1,34 @@
 import os
 import json
-import subprocess
+import shutil
+import queue
+import threading
+import time
 import tempfile
 import uuid
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from urllib.parse import urlparse
 import cv2
-from google.cloud import storage
-from flask import Flask, request, jsonify
+import requests
+from google.api_core.exceptions import NotFound
+from flask import Flask, Response, request, jsonify, stream_with_context
 import logging
 from datetime import datetime
-from yolo_inference import YOLOInference
+from yolo_inference import YOLOInference, downscaled_size, model_registry
+from frame_sampler import (AdaptiveFrameSampler, DECODERS, FFmpegFrameSampler, FrameSampler, SAMPLING_STRATEGIES,
+                           split_sample_ranges)
+from jobs import JobManager, create_job_store
+from gcs_io import GCSUploader, StreamingDownload, get_storage_client, is_streamable
+from result_cache import create_result_cache, make_cache_key
+from crop_encoder import CropEncoder, CROP_FORMATS
+from tracking import IoUTracker
+from dedup import CropDeduplicator, dhash
+from pipeline import PipelineStage
+from video_probe import ProbeCache, probe_cache_key, probe_video
+import metrics
 from flask_cors import CORS
 
 # Configure logging
@@ -19,6 +38,64 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*", "methods": ["GET", "POST", "PUT"]}})
 
+# Detection-only model used by default, and the segmentation model loaded
+# when a request asks for object outlines (include_masks)
+MODEL_PATH = os.environ.get('YOLO_MODEL_PATH', 'yolov8n.pt')
+SEGMENTATION_MODEL_PATH = os.environ.get('YOLO_SEGMENTATION_MODEL_PATH', 'yolov8n-seg.pt')
+# Runtime the model runs on: 'torch', or an export for 'onnx' (ONNX Runtime)
+# or 'openvino', in 'fp32' or 'int8' precision
+MODEL_OPTIONS = {
+    'backend': os.environ.get('INFERENCE_BACKEND', 'torch'),
+    'precision': os.environ.get('INFERENCE_PRECISION', 'fp32'),
+    'cache_dir': os.environ.get('MODEL_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'model-cache')),
+    'calibration_data': os.environ.get('INT8_CALIBRATION_DATA')
+}
+DEFAULT_BATCH_SIZE = int(os.environ.get('YOLO_BATCH_SIZE', 8))
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 64))
+MAX_FRAME_INTERVAL = 100000
+DEFAULT_IMGSZ = int(os.environ.get('YOLO_IMGSZ', 640))
+DEFAULT_DOWNSCALE = os.environ.get('DOWNSCALE_FRAMES', 'true').lower() == 'true'
+MAX_IMGSZ = 2048
+# Decoder of sampled frames: 'opencv' or 'ffmpeg', with its threads (0: ffmpeg's default)
+DEFAULT_DECODER = os.environ.get('VIDEO_DECODER', 'opencv')
+DEFAULT_DECODE_THREADS = int(os.environ.get('DECODE_THREADS', 0))
+UPLOAD_WORKERS = int(os.environ.get('GCS_UPLOAD_WORKERS', 16))
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', 64))
+DEFAULT_CROP_FORMAT = os.environ.get('CROP_FORMAT', 'png')
+DEFAULT_CROP_QUALITY = int(os.environ.get('CROP_QUALITY', 90))
+ENCODE_WORKERS = int(os.environ.get('CROP_ENCODE_WORKERS', os.cpu_count() or 1))
+TRACK_IOU_THRESHOLD = float(os.environ.get('TRACK_IOU_THRESHOLD', 0.3))
+TRACK_MAX_AGE = int(os.environ.get('TRACK_MAX_AGE', 3))
+MAX_TRACK_ALTERNATES = 10
+DEFAULT_DEDUP_DISTANCE = int(os.environ.get('DEDUP_MAX_DISTANCE', 4))
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', 2))
+MAX_BULK_VIDEOS = int(os.environ.get('MAX_BULK_VIDEOS', 100))
+# Synchronous batches answer before gunicorn's --timeout (300 s) kills the worker
+BULK_WAIT_SECONDS = float(os.environ.get('BULK_WAIT_SECONDS', 240))
+
+# Long videos can be split into time ranges processed by up to one worker
+# process per core. Every worker loads its own copy of the model, so requests
+# stay in the request process with the preloaded model unless they ask for
+# more workers.
+AVAILABLE_CPUS = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', AVAILABLE_CPUS))
+DEFAULT_SHARD_WORKERS = min(int(os.environ.get('DEFAULT_SHARD_WORKERS', 1)), SHARD_WORKERS)
+SHARD_MIN_SAMPLES = int(os.environ.get('SHARD_MIN_SAMPLES', 32))
+
+# Coordinator mode: long videos are split into segments analyzed by peer
+# instances of this service through /analyze_segment. Peers run segments
+# synchronously, so all attempts at a segment share one deadline that ends
+# before gunicorn's --timeout (300 s) kills the peer's or this worker.
+PEER_URLS = [url.strip().rstrip('/') for url in os.environ.get('PEER_URLS', '').split(',') if url.strip()]
+SEGMENT_ATTEMPTS = int(os.environ.get('SEGMENT_ATTEMPTS', 3))
+SEGMENT_TIMEOUT = float(os.environ.get('SEGMENT_TIMEOUT', 240))
+
+# Load the model when the module is imported. Under `gunicorn --preload` this
+# happens once in the master and forked workers share the weights; without
+# --preload each worker loads it at boot instead of on its first request.
+if os.environ.get('PRELOAD_MODEL', 'true').lower() == 'true':
+    model_registry.preload(MODEL_PATH, **MODEL_OPTIONS)
+
 def require_api_key(f):
     """Decorator to require API key authentication"""
     def decorated_function(*args, **kwargs):
@@ -41,25 +118,36 @@ def validate_gcs_uri(gcs_uri):
     except Exception as e:
         return False, f"Error parsing GCS URI: {str(e)}"
 
-def download_video_from_gcs(gcs_uri):
-    """Download video from GCS to temporary file"""
+def get_video_blob(gcs_uri):
+    """Fetch the metadata (size, generation, etag) of a video in GCS
+    
+    Returns (blob, None), or (None, error message) if the file doesn't exist
+    """
+    # Parse GCS URI
+    parsed = urlparse(gcs_uri)
+    bucket_name = parsed.netloc
+    blob_name = parsed.path.lstrip('/')
+    
+    # Use the shared, connection-pooled GCS client
+    storage_client = get_storage_client()
+    bucket = storage_client.bucket(bucket_name)
+    blob = bucket.blob(blob_name)
+    
+    # Get file metadata (one request, also tells us whether the file exists)
     try:
-        # Parse GCS URI
-        parsed = urlparse(gcs_uri)
-        bucket_name = parsed.netloc
-        blob_name = parsed.path.lstrip('/')
-        
-        # Initialize GCS client
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
-        
-        # Check if file exists
-        if not blob.exists():
-            return None, "Video file not found in GCS"
-        
-        # Get file metadata
         blob.reload()
+    except NotFound:
+        return None, "Video file not found in GCS"
+    return blob, None
+
+def download_video_from_gcs(gcs_uri, blob=None):
+    """Download video from GCS to temporary file"""
+    try:
+        # Reuse the blob if its metadata was already fetched
+        if blob is None:
+            blob, error_msg = get_video_blob(gcs_uri)
+            if blob is None:
+                return None, error_msg
         file_size = blob.size
         
         # Create temporary file
@@ -68,7 +156,10 @@ def download_video_from_gcs(gcs_uri):
         temp_file.close()
         
         # Download file
+        start = time.perf_counter()
         blob.download_to_filename(temp_path)
+        metrics.DOWNLOAD_SECONDS.observe(time.perf_counter() - start)
+        metrics.DOWNLOAD_BYTES.inc(file_size or 0)
         
         return temp_path, file_size
         
@@ -76,52 +167,50 @@ def download_video_from_gcs(gcs_uri):
         logger.error(f"Error downloading from GCS: {str(e)}")
         return None, f"Error downloading file: {str(e)}"
 
-def get_video_length_ffmpeg(video_path):
-    """Get video length using FFmpeg"""
+def stream_video_from_gcs(gcs_uri, blob=None):
+    """Start streaming video from GCS into a named pipe for the decoder
+    
+    Returns (StreamingDownload, None) when the container can be decoded
+    from a forward-only stream, (None, None) when it needs random access
+    (e.g. MP4 with a trailing moov atom) and has to be downloaded in full,
+    or (None, error message) on error.
+    """
     try:
-        # Use FFmpeg to get video duration
-        cmd = [
-            'ffprobe', 
-            '-v', 'quiet', 
-            '-show_entries', 'format=duration', 
-            '-of', 'csv=p=0', 
-            video_path
-        ]
+        extension = os.path.splitext(urlparse(gcs_uri).path.lower())[1]
         
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        duration_seconds = float(result.stdout.strip())
+        # Reuse the blob if its metadata was already fetched
+        if blob is None:
+            blob, error_msg = get_video_blob(gcs_uri)
+            if blob is None:
+                return None, error_msg
         
-        return duration_seconds, None
+        if not is_streamable(blob, extension):
+            logger.info(f"{gcs_uri} needs random access, falling back to a full download")
+            return None, None
+        
+        logger.info(f"Streaming {gcs_uri} into the decoder")
+        return StreamingDownload(blob, extension), None
         
-    except subprocess.CalledProcessError as e:
-        logger.error(f"FFmpeg error: {e.stderr}")
-        return None, f"FFmpeg error: {e.stderr}"
     except Exception as e:
-        logger.error(f"Error getting video length: {str(e)}")
-        return None, f"Error getting video length: {str(e)}"
+        logger.error(f"Error streaming from GCS: {str(e)}")
+        return None, f"Error streaming file: {str(e)}"
 
-def get_video_length_opencv(video_path):
-    """Get video length using OpenCV as fallback"""
+def get_video_probe(video_path, blob):
+    """Get the properties of a downloaded video, probing each GCS generation only once
+    
+    Returns (probe, None) on success or (None, error message)
+    """
+    key = probe_cache_key(blob)
+    probe = probe_cache.get(key)
+    if probe is not None:
+        return probe, None
     try:
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            return None, "Could not open video file with OpenCV"
-        
-        # Get video properties
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        
-        if fps > 0 and frame_count > 0:
-            duration_seconds = frame_count / fps
-            cap.release()
-            return duration_seconds, None
-        else:
-            cap.release()
-            return None, "Could not determine video properties"
-            
+        probe = probe_video(video_path)
     except Exception as e:
-        logger.error(f"OpenCV error: {str(e)}")
-        return None, f"OpenCV error: {str(e)}"
+        logger.error(f"Error probing video: {str(e)}")
+        return None, f"Error probing video: {str(e)}"
+    probe_cache.put(key, probe)
+    return probe, None
 
 def format_duration(seconds):
     """Format duration in HH:MM:SS format"""
@@ -138,15 +227,106 @@ def format_file_size(size_bytes):
         size_bytes /= 1024.0
     return f"{size_bytes:.1f} TB"
 
-def extract_objects_from_video(video_path: str, yolo: YOLOInference, frame_interval: int, video_uri: str):
-    """Extract objects from video frames at specified intervals"""
+def extract_objects_from_video(video_path: str, yolo: YOLOInference, frame_interval: int, video_uri: str,
+                               batch_size: int = 1, sample_seconds: float = None,
+                               sampling_strategy: str = 'auto', seekable: bool = True,
+                               progress_callback=None, frame_callback=None, keep_frame_data: bool = True,
+                               padding: int = 20, confidence_threshold: float = 0.5,
+                               crop_format: str = 'png', crop_quality: int = 90,
+                               track_objects: bool = False, track_alternates: int = 0,
+                               adaptive_options: dict = None, dedup_crops: bool = False,
+                               dedup_distance: int = 4, workers: int = 1, start_frame: int = 0,
+                               end_frame: int = None, first_sample_index: int = 0, unique_id: str = None,
+                               peer_urls: list = None, probe: dict = None, imgsz: int = None,
+                               downscale: bool = False, include_masks: bool = False, categories: list = None,
+                               category_thresholds: dict = None, decoder: str = 'opencv', decode_threads: int = 0):
+    """Extract objects from video frames at specified intervals
+    
+    Frames are sampled every frame_interval frames, or every sample_seconds
+    seconds when given, and only the sampled frames are decoded (see
+    FrameSampler). With sampling_strategy='adaptive', frames are sampled on
+    scene changes instead (see AdaptiveFrameSampler, configured by the
+    min_gap, max_gap and threshold in adaptive_options). Sampled frames are
+    collected into batches of batch_size
+    and sent through the model in a single call. Frames of one video share a
+    shape, so the per-frame detections are identical to running them one at
+    a time.
+    
+    Pass seekable=False when video_path is a pipe that can only be read
+    front to back. progress_callback(frames_done, frames_total) is called
+    after every batch. frame_callback(frame_entry) is called, in frame
+    order, as soon as all crops of a frame are uploaded; with
+    keep_frame_data=False the entries are only passed to the callback and
+    not collected in the result.
+    
+    Crops are encoded in memory as crop_format ('png', 'jpeg' or 'webp',
+    with crop_quality for the lossy formats) on a thread pool and uploaded
+    straight from memory.
+    
+    With track_objects=True, detections are linked across sampled frames
+    (see IoUTracker) and get a track_id. Instead of one crop per detection,
+    only the best crop of each track, plus up to track_alternates other
+    crops, is uploaded once the track ends, and object_categories lists one
+    entry per track. Frame entries then point at their track's crop and are
+    emitted without waiting for it to be uploaded.
+    
+    With dedup_crops=True (and without tracking), a crop whose perceptual
+    hash is within dedup_distance bits of an earlier crop of the same
+    category is not uploaded. Its object references the earlier crop's
+    gcs_path and is marked as a duplicate, and object_categories counts it
+    on the earlier crop's entry instead of listing it again.
+    
+    With workers > 1, a seekable video with at least SHARD_MIN_SAMPLES
+    sampled frames per worker is split into time ranges that are processed
+    in parallel by worker processes (see extract_objects_sharded). Each
+    worker handles the frames from start_frame up to end_frame, numbering
+    its crops from first_sample_index, under the caller's unique_id.
+    Sharding is skipped for adaptive sampling, tracking and dedup, which
+    depend on the frames before each range.
+    
+    With at least two peer_urls, a whole video that is long enough is split
+    into segments in the same way and each segment is sent to a peer
+    instance instead (see extract_objects_distributed).
+    
+    probe is the result of probe_video for video_path, if known. Its frame
+    count and fps are used instead of the capture's estimates, and its
+    keyframes let the sampler seek only where that saves decoding.
+    
+    imgsz sets the model's input size (None for the model's default). With
+    downscale=True, frames are shrunk to imgsz before inference; detections
+    are mapped back and crops cut from the full-resolution frames either way.
+    
+    With include_masks=True, objects get the 'mask' outline found by yolo,
+    which must then be a segmentation model (see get_model).
+    
+    categories limits the result to those category names; detections of
+    other categories are dropped before they are encoded or uploaded, and
+    those above confidence_threshold are counted per category in the
+    'excluded' entry of the result's category_filter. category_thresholds
+    maps category names to their own minimum confidence, replacing
+    confidence_threshold for those categories. Detections dropped by these
+    thresholds are counted per category in category_filter's 'dropped'.
+    Other categories are held to confidence_threshold as usual, and are not
+    counted.
+    
+    With decoder='ffmpeg', the sampled frames of a seekable file are decoded
+    by an ffmpeg subprocess with decode_threads threads (see
+    FFmpegFrameSampler), which with downscale also produces the model
+    inputs. Adaptive sampling always decodes with OpenCV.
+    """
+    cap = None
+    sampler = None
+    encoder = None
+    uploader = None
+    stages = None
+    decode_stage = None
     try:
         # Parse video URI to get bucket info
         parsed = urlparse(video_uri)
         bucket_name = parsed.netloc
         
         # Generate unique ID for this video processing session
-        unique_id = str(uuid.uuid4())[:8]
+        unique_id = unique_id or str(uuid.uuid4())[:8]
         processed_dir = f"{unique_id}-processed-images"
         
         # Initialize video capture
@@ -154,51 +334,366 @@ def extract_objects_from_video(video_path: str, yolo: YOLOInference, frame_inter
         if not cap.isOpened():
             raise ValueError("Could not open video file")
         
-        # Get video properties
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        fps = cap.get(cv2.CAP_PROP_FPS)
+        # Get video properties, preferring the probe's exact frame count
+        if probe is not None:
+            total_frames = probe['frame_count']
+            fps = probe['fps']
+        else:
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            fps = cap.get(cv2.CAP_PROP_FPS)
+        keyframes = probe['keyframes'] if probe is not None else None
+        
+        # Report the size frames have when they reach the model. The decoders
+        # apply the video's rotation, which the probe's coded size doesn't.
+        frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        input_width, input_height = frame_width, frame_height
+        if downscale and imgsz and frame_width and frame_height:
+            input_width, input_height = downscaled_size(frame_width, frame_height, imgsz)
+        inference_size = {
+            'imgsz': imgsz,
+            'downscale': downscale,
+            'frame_width': frame_width,
+            'frame_height': frame_height,
+            'input_width': input_width,
+            'input_height': input_height
+        }
         
         logger.info(f"Processing video: {total_frames} frames at {fps} FPS")
-        logger.info(f"Extracting objects every {frame_interval} frames")
+        
+        # Let the model report detections down to the lowest per-category
+        # threshold; the category filters are applied to its detections
+        category_thresholds = category_thresholds or {}
+        model_confidence = min([confidence_threshold, *category_thresholds.values()])
+        category_filter = None
+        if categories or category_thresholds:
+            category_filter = {'categories': categories, 'category_thresholds': category_thresholds,
+                               'dropped': {}, 'excluded': {}}
+        
+        # Split long videos across peer instances or worker processes
+        if (seekable and sampling_strategy != 'adaptive' and not track_objects and not dedup_crops
+                and (workers > 1 or (peer_urls and start_frame == 0 and end_frame is None))):
+            targets = []
+            for target in FrameSampler(cap, frame_interval=frame_interval, sample_seconds=sample_seconds,
+                                       strategy='grab', start_frame=start_frame,
+                                       end_frame=end_frame).range_targets():
+                if target >= total_frames:
+                    break
+                targets.append(target)
+            options = {
+                'frame_interval': frame_interval,
+                'batch_size': batch_size,
+                'sample_seconds': sample_seconds,
+                'sampling_strategy': sampling_strategy,
+                'padding': padding,
+                'confidence_threshold': confidence_threshold,
+                'crop_format': crop_format,
+                'crop_quality': crop_quality,
+                'imgsz': imgsz,
+                'downscale': downscale,
+                'include_masks': include_masks,
+                'categories': categories,
+                'category_thresholds': category_thresholds,
+                'decoder': decoder,
+                'decode_threads': decode_threads
+            }
+            segments = min(len(peer_urls or []), len(targets) // SHARD_MIN_SAMPLES)
+            if segments > 1:
+                cap.release()
+                return extract_objects_distributed(
+                    peer_urls,
+                    video_uri,
+                    split_sample_ranges(targets, segments),
+                    unique_id,
+                    len(targets),
+                    progress_callback=progress_callback,
+                    frame_callback=frame_callback,
+                    keep_frame_data=keep_frame_data,
+                    options=options
+                )
+            shards = min(workers, len(targets) // SHARD_MIN_SAMPLES)
+            if shards > 1:
+                # Ranges of the whole video, moved into this call's range
+                shard_ranges = [
+                    (max(shard_start, start_frame), end_frame if shard_end is None else shard_end,
+                     first_sample_index + shard_index)
+                    for shard_start, shard_end, shard_index in split_sample_ranges(targets, shards)
+                ]
+                cap.release()
+                return extract_objects_sharded(
+                    video_path,
+                    video_uri,
+                    shard_ranges,
+                    unique_id,
+                    len(targets),
+                    progress_callback=progress_callback,
+                    frame_callback=frame_callback,
+                    keep_frame_data=keep_frame_data,
+                    # Without a thread count, each shard's decoder gets its share of the cores
+                    options=dict(options, probe=probe,
+                                 decode_threads=decode_threads or max(1, AVAILABLE_CPUS // shards))
+                )
+        
+        if sample_seconds:
+            logger.info(f"Extracting objects every {sample_seconds} seconds in batches of {batch_size}")
+        else:
+            logger.info(f"Extracting objects every {frame_interval} frames in batches of {batch_size}")
         
         frame_data = []
         object_categories = {}
-        frame_count = 0
-        processed_frame_count = 0
+        processed_frame_count = first_sample_index
+        frames_done = 0
+        totals = {'frames': 0, 'objects': 0, 'tracks': 0}
+        deduplicator = CropDeduplicator(dedup_distance) if dedup_crops else None
+        canonical_crops = {}
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # Process every Nth frame
-            if frame_count % frame_interval == 0:
-                logger.info(f"Processing frame {frame_count}/{total_frames}")
+        # Crops are encoded and uploaded in the background while later frames
+        # are decoded. Frames wait here, in order, until their uploads have finished.
+        encoder = CropEncoder(crop_format, crop_quality, max_workers=ENCODE_WORKERS)
+        uploader = GCSUploader(bucket_name, max_workers=UPLOAD_WORKERS)
+        pending_frames = deque()
+        
+        # Link detections into tracks and upload each track's best crops once
+        tracker = None
+        if track_objects:
+            tracker = IoUTracker(TRACK_IOU_THRESHOLD, TRACK_MAX_AGE, alternates=track_alternates)
+        track_frame_objects = {}
+        track_uploads = []
+        
+        def upload_tracks(tracks):
+            """Upload the kept crops of finished tracks and list each track once"""
+            for track in tracks:
+                best, alternates = track['crops'][0], track['crops'][1:]
+                blob_name = track_blob_name(processed_dir, track['category_name'], track['track_id'],
+                                            extension=encoder.extension)
+                future = uploader.submit_bytes(encoder.submit(best['cropped_image']), blob_name,
+                                               content_type=encoder.content_type)
+                alternate_uploads = []
+                for alternate_number, crop in enumerate(alternates, 1):
+                    alternate_blob_name = track_blob_name(processed_dir, track['category_name'], track['track_id'],
+                                                          alternate=alternate_number, extension=encoder.extension)
+                    alternate_uploads.append((
+                        f"gs://{bucket_name}/{alternate_blob_name}",
+                        uploader.submit_bytes(encoder.submit(crop['cropped_image']), alternate_blob_name,
+                                              content_type=encoder.content_type)
+                    ))
+                # The crops are no longer needed once they are queued
+                track['crops'] = []
+                
+                category_entry = {
+                    'track_id': track['track_id'],
+                    'frame_number': best['frame_number'],
+                    'confidence': best['confidence'],
+                    'bbox': best['bbox'],
+                    'gcs_path': f"gs://{bucket_name}/{blob_name}",
+                    'first_frame': track['first_frame'],
+                    'last_frame': track['last_frame'],
+                    'detections': track['detections'],
+                    'alternates': [gcs_path for gcs_path, _ in alternate_uploads]
+                }
+                object_categories.setdefault(track['category_name'], []).append(category_entry)
+                track_uploads.append((track, category_entry, future, alternate_uploads))
+                totals['tracks'] += 1
+        
+        def complete_tracks():
+            """Wait for the track uploads and drop the crops that failed"""
+            for track, category_entry, future, alternate_uploads in track_uploads:
+                error = future.exception()
+                if error is not None:
+                    object_categories[track['category_name']].remove(category_entry)
+                    for frame_obj in track_frame_objects.get(track['track_id'], []):
+                        frame_obj['gcs_path'] = None
+                    continue
+                for gcs_path, alternate_future in alternate_uploads:
+                    if alternate_future.exception() is not None:
+                        category_entry['alternates'].remove(gcs_path)
+        
+        def complete_frames(wait=False):
+            """Finish the frames at the head of the queue whose uploads are done"""
+            while pending_frames:
+                frame_entry, uploads = pending_frames[0]
+                if not wait and not all(future.done() for _, _, future in uploads):
+                    break
+                pending_frames.popleft()
                 
-                # Save frame to temporary file for YOLO processing
-                temp_frame_path = tempfile.mktemp(suffix='.jpg')
-                cv2.imwrite(temp_frame_path, frame)
+                # Drop objects whose crop could not be uploaded
+                for frame_obj, category_entry, future in uploads:
+                    error = future.exception()
+                    if error is not None:
+                        frame_entry['objects'].remove(frame_obj)
+                        frame_entry['error'] = str(error)
+                        object_categories[frame_obj['category_name']].remove(category_entry)
+                        
+                        # Duplicates of the crop are in later, still pending frames
+                        canonical = canonical_crops.get(frame_obj['gcs_path'])
+                        if canonical is not None:
+                            canonical['failed'] = True
+                            for duplicate_entry, duplicate_obj in canonical['duplicates']:
+                                duplicate_entry['objects'].remove(duplicate_obj)
+                                duplicate_entry['error'] = str(error)
                 
+                totals['frames'] += 1
+                totals['objects'] += len(frame_entry['objects'])
+                if keep_frame_data:
+                    frame_data.append(frame_entry)
+                if frame_callback is not None:
+                    frame_callback(frame_entry)
+        
+        def decode_batches():
+            """Decode the sampled frames and group them into batches"""
+            decoded = 0
+            
+            def record_decode(start):
+                # Frames stepped over count as decoded too: the decoder still had to process them
+                nonlocal decoded
+                total = sampler.stats['frames_grabbed'] + sampler.stats['frames_retrieved']
+                metrics.FRAMES.labels('decoded').inc(total - decoded)
+                metrics.STAGE_SECONDS.labels('decode').observe(time.perf_counter() - start)
+                decoded = total
+            
+            batch = []
+            start = time.perf_counter()
+            for frame_count, frame, model_input in sampler.samples():
+                logger.info(f"Processing frame {frame_count}/{total_frames}")
+                batch.append((frame_count, frame, model_input))
+                if len(batch) >= batch_size:
+                    record_decode(start)
+                    yield batch
+                    batch = []
+                    start = time.perf_counter()
+            
+            # Flush the last, partially filled batch
+            if batch:
+                record_decode(start)
+                yield batch
+        
+        def apply_category_filter(detections):
+            """Drop detections outside categories or below their category's threshold, counting both"""
+            kept = []
+            for detection in detections:
+                name = detection['category_name']
+                threshold = category_thresholds.get(name, confidence_threshold)
+                if categories and name not in categories:
+                    # Count only the detections that would have been kept without the allowlist
+                    if detection['confidence'] >= threshold:
+                        category_filter['excluded'][name] = category_filter['excluded'].get(name, 0) + 1
+                elif detection['confidence'] >= threshold:
+                    kept.append(detection)
+                elif name in category_thresholds:
+                    category_filter['dropped'][name] = category_filter['dropped'].get(name, 0) + 1
+                # Other categories are only reported by the model because a threshold
+                # is lower than confidence_threshold, so they are not counted as dropped
+            return kept
+        
+        def infer_batch(batch):
+            """Run YOLO on all frames of a batch of (frame_number, frame, model_input) triples in one call"""
+            try:
+                start = time.perf_counter()
+                batch_detections = yolo.detect_and_crop_frames(
+                    [frame for _, frame, _ in batch],
+                    padding=padding,
+                    confidence_threshold=model_confidence,
+                    imgsz=imgsz,
+                    downscale=downscale,
+                    inputs=[model_input for _, _, model_input in batch]
+                )
+                if category_filter is not None:
+                    batch_detections = [apply_category_filter(detections) for detections in batch_detections]
+                metrics.STAGE_SECONDS.labels('inference').observe(time.perf_counter() - start)
+                metrics.FRAMES.labels('inferred').inc(len(batch))
+                for detections in batch_detections:
+                    metrics.DETECTIONS_PER_FRAME.observe(len(detections))
+                return batch, batch_detections, None
+            except Exception as e:
+                logger.error(f"Error processing frames {batch[0][0]}-{batch[-1][0]}: {e}")
+                return batch, None, e
+        
+        def process_batch(batch, batch_detections, error):
+            """Queue the crops of an inferred batch for encoding and upload"""
+            nonlocal processed_frame_count
+            
+            if error is not None:
+                for frame_number, _, _ in batch:
+                    pending_frames.append(({
+                        'frame_number': frame_number,
+                        'timestamp_seconds': frame_number / fps if fps > 0 else 0,
+                        'objects': [],
+                        'error': str(error)
+                    }, []))
+                    processed_frame_count += 1
+                return
+            
+            for (frame_number, _, _), detections in zip(batch, batch_detections):
+                uploads = []
                 try:
-                    # Run YOLO detection on this frame
-                    detections = yolo.detect_and_crop(
-                        temp_frame_path,
-                        padding=20,
-                        confidence_threshold=0.5
-                    )
-                    
                     frame_objects = []
+                    frame_entry = {
+                        'frame_number': frame_number,
+                        'timestamp_seconds': frame_number / fps if fps > 0 else 0,
+                        'objects': frame_objects
+                    }
+                    
+                    if tracker is not None:
+                        track_ids, finished_tracks = tracker.update(frame_number, detections)
+                        upload_tracks(finished_tracks)
+                        
+                        # Objects point at their track's crop, uploaded when the track ends
+                        for detection, track_id in zip(detections, track_ids):
+                            blob_name = track_blob_name(processed_dir, detection['category_name'], track_id,
+                                                        extension=encoder.extension)
+                            frame_obj = {
+                                'object_id': detection['object_id'],
+                                'track_id': track_id,
+                                'category_name': detection['category_name'],
+                                'confidence': detection['confidence'],
+                                'bbox': detection['bbox'],
+                                'gcs_path': f"gs://{bucket_name}/{blob_name}"
+                            }
+                            if include_masks:
+                                frame_obj['mask'] = detection.get('mask')
+                            frame_objects.append(frame_obj)
+                            track_frame_objects.setdefault(track_id, []).append(frame_obj)
+                        
+                        pending_frames.append((frame_entry, uploads))
+                        processed_frame_count += 1
+                        continue
                     
                     # Process each detection
                     for detection in detections:
-                        # Upload cropped image to GCS
-                        gcs_path = upload_cropped_image_to_gcs(
-                            detection['cropped_image_path'],
-                            bucket_name,
+                        # Reference an earlier, near-identical crop instead of uploading again
+                        if deduplicator is not None:
+                            crop_hash = dhash(detection['cropped_image'])
+                            canonical = deduplicator.find(detection['category_name'], crop_hash, frame_number)
+                            if canonical is not None:
+                                frame_obj = {
+                                    'object_id': detection['object_id'],
+                                    'category_name': detection['category_name'],
+                                    'confidence': detection['confidence'],
+                                    'bbox': detection['bbox'],
+                                    'gcs_path': canonical['gcs_path'],
+                                    'duplicate': True
+                                }
+                                if include_masks:
+                                    frame_obj['mask'] = detection.get('mask')
+                                frame_objects.append(frame_obj)
+                                canonical['duplicates'].append((frame_entry, frame_obj))
+                                canonical['category_entry']['duplicates'] += 1
+                                continue
+                        
+                        # Queue the cropped image for encoding, then upload the
+                        # encoded bytes
+                        blob_name = cropped_image_blob_name(
                             processed_dir,
                             detection['category_name'],
                             processed_frame_count,
-                            detection['object_id']
+                            detection['object_id'],
+                            extension=encoder.extension
+                        )
+                        gcs_path = f"gs://{bucket_name}/{blob_name}"
+                        future = uploader.submit_bytes(
+                            encoder.submit(detection['cropped_image']),
+                            blob_name,
+                            content_type=encoder.content_type
                         )
                         
                         # Add to frame objects
@@ -209,179 +704,1136 @@ def extract_objects_from_video(video_path: str, yolo: YOLOInference, frame_inter
                             'bbox': detection['bbox'],
                             'gcs_path': gcs_path
                         }
+                        if include_masks:
+                            frame_obj['mask'] = detection.get('mask')
                         frame_objects.append(frame_obj)
                         
                         # Track object categories
                         if detection['category_name'] not in object_categories:
                             object_categories[detection['category_name']] = []
                         
-                        object_categories[detection['category_name']].append({
-                            'frame_number': frame_count,
+                        category_entry = {
+                            'frame_number': frame_number,
                             'confidence': detection['confidence'],
                             'gcs_path': gcs_path
-                        })
+                        }
+                        object_categories[detection['category_name']].append(category_entry)
+                        uploads.append((frame_obj, category_entry, future))
+                        
+                        if deduplicator is not None:
+                            category_entry['duplicates'] = 0
+                            canonical = {
+                                'frame_number': frame_number,
+                                'gcs_path': gcs_path,
+                                'category_entry': category_entry,
+                                'duplicates': []
+                            }
+                            canonical_crops[gcs_path] = canonical
+                            deduplicator.add(detection['category_name'], crop_hash, canonical)
                     
-                    # Add frame data
-                    frame_data.append({
-                        'frame_number': frame_count,
-                        'timestamp_seconds': frame_count / fps if fps > 0 else 0,
-                        'objects': frame_objects
-                    })
+                    # Add frame data once its uploads are done
+                    pending_frames.append((frame_entry, uploads))
                     
                     processed_frame_count += 1
                     
-                    # Clean up temporary files
-                    yolo.cleanup_temp_files(detections)
-                    
                 except Exception as e:
-                    logger.error(f"Error processing frame {frame_count}: {e}")
-                    frame_data.append({
-                        'frame_number': frame_count,
-                        'timestamp_seconds': frame_count / fps if fps > 0 else 0,
+                    logger.error(f"Error processing frame {frame_number}: {e}")
+                    pending_frames.append(({
+                        'frame_number': frame_number,
+                        'timestamp_seconds': frame_number / fps if fps > 0 else 0,
                         'objects': [],
                         'error': str(e)
-                    })
-                
-                finally:
-                    # Clean up temporary frame file
-                    try:
-                        os.unlink(temp_frame_path)
-                    except Exception as e:
-                        logger.warning(f"Could not delete temporary frame file: {e}")
-            
-            frame_count += 1
+                    }, []))
+                    # Crops already queued for this frame are not referenced anywhere
+                    for frame_obj, category_entry, _ in uploads:
+                        object_categories[frame_obj['category_name']].remove(category_entry)
+                        if frame_obj['gcs_path'] in canonical_crops:
+                            canonical_crops[frame_obj['gcs_path']]['failed'] = True
+                    processed_frame_count += 1
+        
+        # Decode only the sampled frames (every Nth frame, every N seconds or on scene changes)
+        if sampling_strategy == 'adaptive':
+            sampler = AdaptiveFrameSampler(cap, **(adaptive_options or {}))
+        elif decoder == 'ffmpeg':
+            if not seekable:
+                raise ValueError("The ffmpeg decoder needs a video file, not a stream")
+            # The model inputs are shrunk inside the decoder, from the size ffmpeg outputs
+            decoded_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            decoded_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            sampler = FFmpegFrameSampler(
+                cap,
+                video_path,
+                frame_interval=frame_interval,
+                sample_seconds=sample_seconds,
+                start_frame=start_frame,
+                end_frame=end_frame,
+                threads=decode_threads,
+                input_size=downscaled_size(decoded_width, decoded_height, imgsz) if downscale and imgsz else None
+            )
+        else:
+            sampler = FrameSampler(
+                cap,
+                frame_interval=frame_interval,
+                sample_seconds=sample_seconds,
+                strategy=sampling_strategy,
+                container=os.path.splitext(urlparse(video_uri).path.lower())[1],
+                seekable=seekable,
+                keyframes=keyframes,
+                start_frame=start_frame,
+                end_frame=end_frame
+            )
+        logger.info(f"Sampling frames with the '{sampler.strategy}' strategy (codec: {sampler.codec})")
+        
+        # Decoding and inference run on their own threads, linked by bounded
+        # queues, while this thread hands crops to the encode and upload pools.
+        # All stages work on different batches at the same time.
+        # The decode thread releases the capture itself once it stops reading from it
+        decode_stage = PipelineStage('decode', decode_batches(), maxsize=PIPELINE_QUEUE_SIZE, on_stop=cap.release)
+        stages = PipelineStage('infer', decode_stage, infer_batch, maxsize=PIPELINE_QUEUE_SIZE)
+        postprocess_seconds = 0.0
+        
+        for batch, batch_detections, error in stages:
+            start = time.perf_counter()
+            process_batch(batch, batch_detections, error)
+            frames_done += len(batch)
+            complete_frames()
+            postprocess_seconds += time.perf_counter() - start
+            if progress_callback is not None:
+                progress_callback(frames_done, sampler.expected_samples())
+        
+        if progress_callback is not None:
+            progress_callback(frames_done, frames_done)
         
-        cap.release()
+        # Tracks still alive at the end of the video are finished now
+        if tracker is not None:
+            upload_tracks(tracker.finish())
+        
+        # Wait for the remaining uploads before building the response
+        complete_frames(wait=True)
+        complete_tracks()
+        object_categories = {name: entries for name, entries in object_categories.items() if entries}
+        if tracker is not None:
+            for entries in object_categories.values():
+                entries.sort(key=lambda entry: entry['track_id'])
         
         return {
             'frame_data': frame_data,
             'object_categories': object_categories,
             'processed_images_bucket': f"gs://{bucket_name}/{processed_dir}",
-            'unique_id': unique_id
+            'unique_id': unique_id,
+            'sampling': sampler.describe(),
+            'fps': fps,
+            'total_frames': total_frames,
+            'inference_size': inference_size,
+            'total_frames_processed': totals['frames'],
+            'total_objects_detected': totals['objects'],
+            'total_tracks': totals['tracks'] if tracker is not None else None,
+            'dedup': deduplicator.stats() if deduplicator is not None else None,
+            'category_filter': dict(category_filter, total_dropped=sum(category_filter['dropped'].values()),
+                                    total_excluded=sum(category_filter['excluded'].values()))
+                               if category_filter is not None else None,
+            'pipeline': {
+                'decode': decode_stage.stats(),
+                'infer': stages.stats(),
+                'postprocess': {'items': frames_done, 'busy_seconds': round(postprocess_seconds, 3)},
+                'encode': encoder.stats(),
+                'upload': uploader.stats()
+            }
         }
         
     except Exception as e:
         logger.error(f"Error extracting objects from video: {e}")
         raise
+    
+    finally:
+        # Stop an ffmpeg decoder first, so that a decode thread waiting for its next frame returns
+        if sampler is not None:
+            sampler.close()
+        if stages is not None:
+            stages.close()
+        elif decode_stage is not None:
+            decode_stage.close()
+        # Once started, the decode stage releases the capture when it stops,
+        # which may be after close() gave up waiting for it
+        if cap is not None and decode_stage is None:
+            cap.release()
+        if uploader is not None:
+            uploader.close()
+        if encoder is not None:
+            encoder.close()
+
+_shard_pool = None
+_shard_pool_lock = threading.Lock()
+
+def init_shard_worker(threads: int):
+    """Give each shard worker its share of the cores instead of letting all of them use every core"""
+    import torch
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+
+def get_shard_pool() -> ProcessPoolExecutor:
+    """Get the process pool for sharded videos, started on first use
+    
+    Workers are spawned rather than forked, since forking a process that
+    already runs threads (and possibly holds their locks) is unsafe. Each
+    worker loads its own model when it imports this module.
+    """
+    global _shard_pool
+    with _shard_pool_lock:
+        if _shard_pool is None:
+            _shard_pool = ProcessPoolExecutor(
+                max_workers=SHARD_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_shard_worker,
+                initargs=(max(1, AVAILABLE_CPUS // SHARD_WORKERS),)
+            )
+            logger.info(f"Started {SHARD_WORKERS} shard worker processes")
+        return _shard_pool
+
+def get_model(include_masks: bool = False) -> YOLOInference:
+    """Get the shared model: the segmentation model if masks are wanted, else the faster detection model"""
+    return model_registry.get(SEGMENTATION_MODEL_PATH if include_masks else MODEL_PATH, **MODEL_OPTIONS)
+
+def process_video_shard(video_path: str, video_uri: str, options: dict) -> dict:
+    """Extract objects from one time range of a video, in a shard worker process"""
+    yolo = get_model(options.get('include_masks', False))
+    return extract_objects_from_video(video_path, yolo, video_uri=video_uri, **options)
+
+def merge_stage_stats(stats_list):
+    """Combine the pipeline stats of several shards into one entry per stage"""
+    merged = {}
+    for stats in stats_list:
+        for stage, counters in stats.items():
+            totals = merged.setdefault(stage, {})
+            for key, value in counters.items():
+                if key.startswith('max_'):
+                    totals[key] = max(totals.get(key, 0), value)
+                elif key.startswith('mean_'):
+                    totals[key] = round(totals.get(key, 0) + value / len(stats_list), 2)
+                else:
+                    totals[key] = round(totals.get(key, 0) + value, 3)
+    return merged
 
-def upload_cropped_image_to_gcs(local_image_path: str, bucket_name: str, processed_dir: str, 
-                               category_name: str, frame_number: int, object_id: int) -> str:
-    """Upload cropped image to GCS bucket"""
+def extract_objects_sharded(video_path: str, video_uri: str, shard_ranges, unique_id: str, expected_samples: int,
+                            progress_callback=None, frame_callback=None, keep_frame_data: bool = True,
+                            options: dict = None):
+    """Process time ranges of a video in parallel worker processes and merge the results
+    
+    Every shard samples exactly the frames the whole video would have
+    sampled in its range and names its crops by their index among all
+    samples, so frame numbers, object ids and GCS paths are the same as
+    with a single process. Shards are merged in frame order (see
+    collect_partial_results).
+    """
+    global _shard_pool
+    logger.info(f"Processing {expected_samples} sampled frames in {len(shard_ranges)} shards")
+    pool = get_shard_pool()
+    futures = [
+        pool.submit(process_video_shard, video_path, video_uri, dict(
+            options or {},
+            start_frame=start_frame,
+            end_frame=end_frame,
+            first_sample_index=first_sample_index,
+            unique_id=unique_id
+        ))
+        for start_frame, end_frame, first_sample_index in shard_ranges
+    ]
+    
     try:
-        # Initialize GCS client
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        
-        # Create blob path
-        blob_name = f"{processed_dir}/{category_name}/frame_{frame_number:06d}_object_{object_id:03d}.png"
-        blob = bucket.blob(blob_name)
-        
-        # Upload image
-        blob.upload_from_filename(local_image_path)
-        
-        # Note: With uniform bucket-level access, we don't need to make individual blobs public
-        # The bucket's IAM policy controls access. Since you mentioned the bucket is public write,
-        # the images should be accessible based on the bucket's public read policy.
-        
-        gcs_path = f"gs://{bucket_name}/{blob_name}"
-        logger.info(f"Uploaded cropped image: {gcs_path}")
-        
-        return gcs_path
-        
-    except Exception as e:
-        logger.error(f"Error uploading to GCS: {e}")
+        results = collect_partial_results(futures, expected_samples, progress_callback, frame_callback)
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); start a fresh pool for the next video
+        with _shard_pool_lock:
+            if _shard_pool is pool:
+                _shard_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    except Exception:
+        for future in futures:
+            future.cancel()
         raise
+    
+    return merge_partial_results(results, unique_id, keep_frame_data, shards=len(results))
+
+def request_segment(peer_url: str, video_uri: str, options: dict, timeout: float = SEGMENT_TIMEOUT) -> dict:
+    """Have a peer instance analyze one segment of a video through /analyze_segment"""
+    response = requests.post(
+        f"{peer_url}/analyze_segment",
+        json=dict(options, video_uri=video_uri),
+        headers={'x-api-key': os.environ.get('API_KEY', '')},
+        timeout=timeout
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"{peer_url} returned {response.status_code}: {response.text[:200]}")
+    return response.json()
+
+def extract_objects_distributed(peer_urls, video_uri: str, segment_ranges, unique_id: str, expected_samples: int,
+                                progress_callback=None, frame_callback=None, keep_frame_data: bool = True,
+                                options: dict = None):
+    """Send segments of a video to peer instances and merge their results
+    
+    Segments are assigned to the peers round-robin and all sent at once.
+    A failed segment is retried on the next peer, up to SEGMENT_ATTEMPTS
+    times within SEGMENT_TIMEOUT seconds of sending it, without repeating
+    the segments that succeeded. As with
+    extract_objects_sharded, the merged result has the same frames, object
+    ids and crop paths as processing the whole video in one place.
+    """
+    logger.info(f"Processing {expected_samples} sampled frames in {len(segment_ranges)} segments "
+                f"on {len(peer_urls)} peers")
+    
+    deadline = time.monotonic() + SEGMENT_TIMEOUT
+    
+    def run_segment(index, segment_options):
+        last_error = None
+        for attempt in range(SEGMENT_ATTEMPTS):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError(f"Segment {index} timed out after {attempt} attempts: {last_error}")
+            peer_url = peer_urls[(index + attempt) % len(peer_urls)]
+            try:
+                return request_segment(peer_url, video_uri, segment_options, timeout=remaining)
+            except Exception as e:
+                logger.warning(f"Segment {index} failed on {peer_url} (attempt {attempt + 1}/{SEGMENT_ATTEMPTS}): {e}")
+                last_error = e
+        raise RuntimeError(f"Segment {index} failed after {SEGMENT_ATTEMPTS} attempts: {last_error}")
+    
+    executor = ThreadPoolExecutor(max_workers=len(segment_ranges), thread_name_prefix='segment')
+    try:
+        futures = [
+            executor.submit(run_segment, index, dict(
+                options or {},
+                start_frame=start_frame,
+                end_frame=end_frame,
+                first_sample_index=first_sample_index,
+                unique_id=unique_id
+            ))
+            for index, (start_frame, end_frame, first_sample_index) in enumerate(segment_ranges)
+        ]
+        results = collect_partial_results(futures, expected_samples, progress_callback, frame_callback)
+    finally:
+        # Don't wait for the other segments when one has failed
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    return merge_partial_results(results, unique_id, keep_frame_data, segments=len(results))
+
+def collect_partial_results(futures, expected_samples: int, progress_callback=None, frame_callback=None):
+    """Wait for the results of consecutive ranges of a video, in order
+    
+    Frames are passed to frame_callback and progress is reported as each
+    range, in order, completes.
+    """
+    results = []
+    frames_done = 0
+    for future in futures:
+        result = future.result()
+        results.append(result)
+        frames_done += result['total_frames_processed']
+        if frame_callback is not None:
+            for frame_entry in result['frame_data']:
+                frame_callback(frame_entry)
+        if progress_callback is not None:
+            progress_callback(frames_done, expected_samples)
+    return results
+
+def merge_partial_results(results, unique_id: str, keep_frame_data: bool = True, **counts):
+    """Merge the results of consecutive ranges of a video into one result
+    
+    counts (e.g. shards=3) are added to the sampling stats.
+    """
+    object_categories = {}
+    for result in results:
+        for category_name, entries in result['object_categories'].items():
+            object_categories.setdefault(category_name, []).extend(entries)
+    sampling = {}
+    for result in results:
+        for key, value in result['sampling'].items():
+            sampling[key] = sampling.get(key, 0) + value if isinstance(value, int) else value
+    sampling.update(counts)
+    category_filter = results[0]['category_filter']
+    if category_filter is not None:
+        dropped, excluded = {}, {}
+        for result in results:
+            for category_name, count in result['category_filter']['dropped'].items():
+                dropped[category_name] = dropped.get(category_name, 0) + count
+            for category_name, count in result['category_filter']['excluded'].items():
+                excluded[category_name] = excluded.get(category_name, 0) + count
+        category_filter = dict(category_filter, dropped=dropped, total_dropped=sum(dropped.values()),
+                               excluded=excluded, total_excluded=sum(excluded.values()))
+    
+    return {
+        'frame_data': [frame for result in results for frame in result['frame_data']] if keep_frame_data else [],
+        'object_categories': object_categories,
+        'processed_images_bucket': results[0]['processed_images_bucket'],
+        'unique_id': unique_id,
+        'sampling': sampling,
+        'fps': results[0]['fps'],
+        'total_frames': results[0]['total_frames'],
+        'inference_size': results[0]['inference_size'],
+        'total_frames_processed': sum(result['total_frames_processed'] for result in results),
+        'total_objects_detected': sum(result['total_objects_detected'] for result in results),
+        'total_tracks': None,
+        'dedup': None,
+        'category_filter': category_filter,
+        'pipeline': merge_stage_stats([result['pipeline'] for result in results])
+    }
+
+def cropped_image_blob_name(processed_dir: str, category_name: str, frame_number: int, object_id: int,
+                            extension: str = '.png') -> str:
+    """Build the GCS object name for a cropped image"""
+    return f"{processed_dir}/{category_name}/frame_{frame_number:06d}_object_{object_id:03d}{extension}"
+
+def track_blob_name(processed_dir: str, category_name: str, track_id: int, alternate: int = 0,
+                    extension: str = '.png') -> str:
+    """Build the GCS object name for the best (alternate=0) or an alternate crop of a track"""
+    suffix = f"_alt_{alternate}" if alternate else ''
+    return f"{processed_dir}/{category_name}/track_{track_id:05d}{suffix}{extension}"
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'timestamp': datetime.utcnow().isoformat() + 'Z'
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'models': model_registry.stats()
     })
 
-@app.route('/analyze_video', methods=['POST'])
-@require_api_key
-def analyze_video():
-    """Main endpoint to analyze video and extract objects every 20 frames"""
+def parse_analyze_request(data):
+    """Validate an analyze_video request body
+    
+    Returns (params, None) on success or (None, (error_body, status_code))
+    """
+    if not data or 'video_uri' not in data:
+        return None, ({'error': 'Missing video_uri in request body'}, 400)
+    
+    params = {
+        'video_uri': data['video_uri'],
+        'frame_interval': data.get('frame_interval', 20),  # Extract every N frames
+        'sample_seconds': data.get('sample_seconds'),  # Or extract every N seconds
+        'sampling_strategy': data.get('sampling_strategy', 'auto'),  # How skipped frames are skipped, or 'adaptive'
+        'min_frame_gap': data.get('min_frame_gap', 5),  # Adaptive sampling: fewest frames between samples
+        'max_frame_gap': data.get('max_frame_gap', 60),  # Adaptive sampling: most frames between samples
+        'scene_threshold': data.get('scene_threshold', 0.05),  # Adaptive sampling: change that triggers a sample
+        'batch_size': data.get('batch_size', DEFAULT_BATCH_SIZE),  # Frames per YOLO call
+        'imgsz': data.get('imgsz', DEFAULT_IMGSZ),  # Longest side of the model input in pixels
+        'downscale': data.get('downscale', DEFAULT_DOWNSCALE),  # Shrink frames to imgsz before inference
+        'include_masks': data.get('include_masks', False),  # Add object outlines, using the segmentation model
+        'categories': data.get('categories'),  # Only detect these category names
+        'category_thresholds': data.get('category_thresholds'),  # Minimum confidence per category name
+        'ingest': data.get('ingest', 'download'),  # 'stream' pipes the video into the decoder
+        'decoder': data.get('decoder', DEFAULT_DECODER),  # 'opencv' or 'ffmpeg'
+        'decode_threads': data.get('decode_threads', DEFAULT_DECODE_THREADS),  # ffmpeg decoding threads, 0 for its default
+        'padding': data.get('padding', 20),  # Pixels added around each crop
+        'confidence_threshold': data.get('confidence_threshold', 0.5),  # Minimum detection confidence
+        'crop_format': data.get('crop_format', DEFAULT_CROP_FORMAT),  # 'png', 'jpeg' or 'webp'
+        'crop_quality': data.get('crop_quality', DEFAULT_CROP_QUALITY),  # 1-100 for JPEG and WebP
+        'track_objects': data.get('track_objects', False),  # Upload each tracked object once
+        'track_alternates': data.get('track_alternates', 0),  # Extra crops kept per tracked object
+        'dedup_crops': data.get('dedup_crops', False),  # Skip uploading near-identical crops
+        'dedup_distance': data.get('dedup_distance', DEFAULT_DEDUP_DISTANCE),  # Max differing hash bits of duplicates
+        'workers': data.get('workers', DEFAULT_SHARD_WORKERS),  # Processes that share a long video
+        'distribute': data.get('distribute', True),  # Split long videos across PEER_URLS
+        'include_timings': data.get('include_timings', False),  # Add time spent per stage to the response
+        'use_cache': data.get('use_cache', True)  # Return a previous result for the same video and settings
+    }
+    
+    frame_interval = params['frame_interval']
+    if not (isinstance(frame_interval, int) and not isinstance(frame_interval, bool)
+            and 1 <= frame_interval <= MAX_FRAME_INTERVAL):
+        return None, ({'error': f"frame_interval must be an integer between 1 and {MAX_FRAME_INTERVAL}"}, 400)
+    batch_size = params['batch_size']
+    if not (isinstance(batch_size, int) and not isinstance(batch_size, bool) and 1 <= batch_size <= MAX_BATCH_SIZE):
+        return None, ({'error': f"batch_size must be an integer between 1 and {MAX_BATCH_SIZE}"}, 400)
+    if params['ingest'] not in ('download', 'stream'):
+        return None, ({'error': f"Invalid ingest mode '{params['ingest']}'"}, 400)
+    if params['sampling_strategy'] not in ('auto', 'adaptive') + SAMPLING_STRATEGIES:
+        return None, ({'error': f"Invalid sampling_strategy '{params['sampling_strategy']}'"}, 400)
+    if params['decoder'] not in DECODERS:
+        return None, ({'error': f"Invalid decoder '{params['decoder']}'"}, 400)
+    if params['decoder'] == 'ffmpeg':
+        if params['ingest'] == 'stream' or params['sampling_strategy'] == 'adaptive':
+            return None, ({'error': "The ffmpeg decoder cannot be combined with stream ingest or adaptive sampling"}, 400)
+        if shutil.which('ffmpeg') is None:
+            return None, ({'error': 'The ffmpeg decoder is not available: ffmpeg is not installed'}, 400)
+    if not (isinstance(params['decode_threads'], int) and 0 <= params['decode_threads'] <= 64):
+        return None, ({'error': 'decode_threads must be an integer between 0 and 64'}, 400)
+    sample_seconds = params['sample_seconds']
+    if sample_seconds is not None and not (isinstance(sample_seconds, (int, float)) and sample_seconds > 0):
+        return None, ({'error': 'sample_seconds must be a positive number'}, 400)
+    if params['sampling_strategy'] == 'adaptive':
+        if sample_seconds is not None:
+            return None, ({'error': 'sample_seconds cannot be combined with adaptive sampling'}, 400)
+        min_frame_gap, max_frame_gap = params['min_frame_gap'], params['max_frame_gap']
+        if not (isinstance(min_frame_gap, int) and isinstance(max_frame_gap, int) and 1 <= min_frame_gap <= max_frame_gap):
+            return None, ({'error': 'min_frame_gap and max_frame_gap must be integers with 1 <= min_frame_gap <= max_frame_gap'}, 400)
+        scene_threshold = params['scene_threshold']
+        if not (isinstance(scene_threshold, (int, float)) and 0 < scene_threshold <= 1):
+            return None, ({'error': 'scene_threshold must be between 0 and 1'}, 400)
+    imgsz = params['imgsz']
+    if not (isinstance(imgsz, int) and 32 <= imgsz <= MAX_IMGSZ and imgsz % 32 == 0):
+        return None, ({'error': f"imgsz must be a multiple of 32 between 32 and {MAX_IMGSZ}"}, 400)
+    if not isinstance(params['downscale'], bool):
+        return None, ({'error': 'downscale must be true or false'}, 400)
+    if not isinstance(params['include_masks'], bool):
+        return None, ({'error': 'include_masks must be true or false'}, 400)
+    categories = params['categories']
+    if categories is not None and not (isinstance(categories, list) and categories
+                                       and all(isinstance(name, str) for name in categories)):
+        return None, ({'error': 'categories must be a non-empty list of category names'}, 400)
+    category_thresholds = params['category_thresholds']
+    if category_thresholds is not None and not (
+            isinstance(category_thresholds, dict)
+            and all(isinstance(value, (int, float)) and not isinstance(value, bool) and 0 <= value <= 1
+                    for value in category_thresholds.values())):
+        return None, ({'error': 'category_thresholds must map category names to confidences between 0 and 1'}, 400)
+    if not isinstance(params['padding'], int) or params['padding'] < 0:
+        return None, ({'error': 'padding must be a non-negative integer'}, 400)
+    confidence_threshold = params['confidence_threshold']
+    if not (isinstance(confidence_threshold, (int, float)) and 0 <= confidence_threshold <= 1):
+        return None, ({'error': 'confidence_threshold must be between 0 and 1'}, 400)
+    if params['crop_format'] not in CROP_FORMATS:
+        return None, ({'error': f"Invalid crop_format '{params['crop_format']}'"}, 400)
+    if not (isinstance(params['crop_quality'], int) and 1 <= params['crop_quality'] <= 100):
+        return None, ({'error': 'crop_quality must be an integer between 1 and 100'}, 400)
+    if not isinstance(params['track_objects'], bool):
+        return None, ({'error': 'track_objects must be true or false'}, 400)
+    track_alternates = params['track_alternates']
+    if not (isinstance(track_alternates, int) and 0 <= track_alternates <= MAX_TRACK_ALTERNATES):
+        return None, ({'error': f"track_alternates must be an integer between 0 and {MAX_TRACK_ALTERNATES}"}, 400)
+    if not isinstance(params['dedup_crops'], bool):
+        return None, ({'error': 'dedup_crops must be true or false'}, 400)
+    if not (isinstance(params['dedup_distance'], int) and 0 <= params['dedup_distance'] <= 32):
+        return None, ({'error': 'dedup_distance must be an integer between 0 and 32'}, 400)
+    if not (isinstance(params['workers'], int) and 1 <= params['workers'] <= SHARD_WORKERS):
+        return None, ({'error': f"workers must be an integer between 1 and {SHARD_WORKERS}"}, 400)
+    if not isinstance(params['distribute'], bool):
+        return None, ({'error': 'distribute must be true or false'}, 400)
+    if not isinstance(params['include_timings'], bool):
+        return None, ({'error': 'include_timings must be true or false'}, 400)
+    if not isinstance(params['use_cache'], bool):
+        return None, ({'error': 'use_cache must be true or false'}, 400)
+    
+    # Validate GCS URI
+    is_valid, error_msg = validate_gcs_uri(params['video_uri'])
+    if not is_valid:
+        return None, ({'error': 'Invalid video URI format'}, 400)
+    
+    # Check if file is actually a video file
+    file_extension = os.path.splitext(params['video_uri'].lower())[1]
+    if file_extension not in ['.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm']:
+        return None, ({
+            'error': 'File is not a supported video format',
+            'details': f"File extension '{file_extension}' is not supported. Please use MP4, AVI, MOV, MKV, WMV, FLV, or WebM files."
+        }, 400)
+    
+    return params, None
+
+def parse_segment_request(data, params):
+    """Validate the time range of an analyze_segment request
+    
+    Returns (segment, None) on success or (None, (error_body, status_code))
+    """
+    segment = {
+        'start_frame': data.get('start_frame'),  # First frame of the segment
+        'end_frame': data.get('end_frame'),  # Frame after the segment, or null for the end of the video
+        'first_sample_index': data.get('first_sample_index'),  # Index of the segment's first sample in the video
+        'unique_id': data.get('unique_id')  # Processing session of the coordinator, names the crop folder
+    }
+    
+    start_frame, end_frame = segment['start_frame'], segment['end_frame']
+    if not (isinstance(start_frame, int) and start_frame >= 0):
+        return None, ({'error': 'start_frame must be a non-negative integer'}, 400)
+    if end_frame is not None and not (isinstance(end_frame, int) and end_frame > start_frame):
+        return None, ({'error': 'end_frame must be an integer greater than start_frame, or null'}, 400)
+    if not (isinstance(segment['first_sample_index'], int) and segment['first_sample_index'] >= 0):
+        return None, ({'error': 'first_sample_index must be a non-negative integer'}, 400)
+    unique_id = segment['unique_id']
+    if not (isinstance(unique_id, str) and unique_id and all(c.isalnum() or c == '-' for c in unique_id)):
+        return None, ({'error': 'unique_id must be a non-empty string of letters, digits and dashes'}, 400)
+    if params['sampling_strategy'] == 'adaptive' or params['track_objects'] or params['dedup_crops']:
+        return None, ({'error': 'Segments cannot use adaptive sampling, track_objects or dedup_crops'}, 400)
+    
+    return segment, None
+
+def adaptive_sampling_options(params):
+    """Get the AdaptiveFrameSampler settings of a request, or None for fixed-interval sampling"""
+    if params['sampling_strategy'] != 'adaptive':
+        return None
+    return {
+        'min_gap': params['min_frame_gap'],
+        'max_gap': params['max_frame_gap'],
+        'threshold': params['scene_threshold']
+    }
+
+def check_categories(params, yolo):
+    """Check the category names of a request against the model's categories
+    
+    Returns None if they are all known, else (error_body, status_code)
+    """
     try:
-        # Parse request
-        data = request.get_json()
-        if not data or 'video_uri' not in data:
-            return jsonify({'error': 'Missing video_uri in request body'}), 400
+        yolo.class_ids(list(params['categories'] or []) + list(params['category_thresholds'] or {}))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    return None
+
+def analysis_cache_key(params, blob, yolo):
+    """Build the result cache key for a request on a video whose metadata was fetched"""
+    return make_cache_key(
+        blob.bucket.name,
+        blob.name,
+        blob.generation,
+        blob.etag,
+        yolo.model_identity,
+        {
+            'frame_interval': params['frame_interval'],
+            'sample_seconds': params['sample_seconds'],
+            'imgsz': params['imgsz'],
+            'downscale': params['downscale'],
+            'include_masks': params['include_masks'],
+            'categories': sorted(params['categories']) if params['categories'] else None,
+            'category_thresholds': params['category_thresholds'],
+            'decoder': params['decoder'],
+            'padding': params['padding'],
+            'confidence_threshold': params['confidence_threshold'],
+            'crop_format': params['crop_format'],
+            'crop_quality': params['crop_quality'],
+            'track_objects': params['track_objects'],
+            'track_alternates': params['track_alternates'],
+            'adaptive_sampling': adaptive_sampling_options(params),
+            'dedup_crops': params['dedup_crops'],
+            'dedup_distance': params['dedup_distance']
+        }
+    )
+
+def is_complete_result(response):
+    """Check that no frame of an analysis failed and every crop was uploaded"""
+    if any('error' in frame_entry for frame_entry in response['frame_data']):
+        return False
+    return response['pipeline'].get('upload', {}).get('failed', 0) == 0
+
+def run_video_analysis(params, progress_callback=None, frame_callback=None):
+    """Fetch a video from GCS and extract objects from it
+    
+    Results are cached per video generation, model and result-affecting
+    parameters. A cache hit returns the stored response, with its original
+    crop paths, without downloading or decoding the video.
+    
+    Args:
+        params: Validated request parameters from parse_analyze_request
+        progress_callback: Optional callable(frames_done, frames_total)
+        frame_callback: Optional callable(frame_entry) receiving each frame as
+            soon as its crops are uploaded. The frames are then not repeated
+            in the response's frame_data.
         
-        video_uri = data['video_uri']
-        frame_interval = data.get('frame_interval', 20)  # Extract every N frames
+    Returns:
+        (response_body, status_code)
+    """
+    try:
+        request_start = time.perf_counter()
+        video_uri = params['video_uri']
+        frame_interval = params['frame_interval']
+        sample_seconds = params['sample_seconds']
+        batch_size = params['batch_size']
         
-        # Validate GCS URI
-        is_valid, error_msg = validate_gcs_uri(video_uri)
-        if not is_valid:
-            return jsonify({'error': 'Invalid video URI format'}), 400
+        # Get the shared YOLO model (loaded once per worker)
+        yolo = get_model(params['include_masks'])
+        error = check_categories(params, yolo)
+        if error is not None:
+            return error
         
-        # Download video from GCS
-        temp_path, file_size = download_video_from_gcs(video_uri)
-        if temp_path is None:
-            return jsonify({'error': 'Video file not found'}), 404
+        # Fetch the video's generation and etag; an overwritten video misses the cache
+        blob, error_msg = get_video_blob(video_uri)
+        if blob is None:
+            return {'error': 'Video file not found'}, 404
         
-        # Check if file is actually a video file
-        file_extension = os.path.splitext(video_uri.lower())[1]
-        if file_extension not in ['.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm']:
-            return jsonify({
-                'error': 'File is not a supported video format',
-                'details': f"File extension '{file_extension}' is not supported. Please use MP4, AVI, MOV, MKV, WMV, FLV, or WebM files."
-            }), 400
+        cache_key = None
+        if result_cache is not None and params.get('use_cache', True):
+            cache_key = analysis_cache_key(params, blob, yolo)
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Returning cached result for {video_uri}")
+                if progress_callback is not None:
+                    progress_callback(cached['total_frames_processed'], cached['total_frames_processed'])
+                if frame_callback is not None:
+                    for frame_entry in cached['frame_data']:
+                        frame_callback(frame_entry)
+                    cached = dict(cached, frame_data=[])
+                if params['include_timings']:
+                    cached = dict(cached, timings={'total_seconds': round(time.perf_counter() - request_start, 3)})
+                return dict(cached, cache='hit'), 200
+        
+        # Stream the video into the decoder if requested and the container allows it
+        stream = None
+        if params['ingest'] == 'stream':
+            stream, error_msg = stream_video_from_gcs(video_uri, blob)
+            if stream is None and error_msg is not None:
+                return {'error': 'Could not stream video', 'details': error_msg}, 500
+            file_size = blob.size
+        
+        download_seconds = None
+        if stream is not None:
+            temp_path = stream.path
+        else:
+            # Download video from GCS
+            start = time.perf_counter()
+            temp_path, file_size = download_video_from_gcs(video_uri, blob)
+            if temp_path is None:
+                return {'error': 'Video file not found'}, 404
+            download_seconds = time.perf_counter() - start
         
         try:
-            # Get video duration
-            duration_seconds, error_msg = get_video_length_ffmpeg(temp_path)
-            if duration_seconds is None:
-                duration_seconds, error_msg = get_video_length_opencv(temp_path)
-                if duration_seconds is None:
-                    return jsonify({
+            # Get video duration, fps, frame count and keyframes. A pipe can
+            # only be read once, so for streamed videos the duration is
+            # taken from the decoder afterwards.
+            duration_seconds = None
+            probe = None
+            probe_seconds = None
+            if stream is None:
+                start = time.perf_counter()
+                probe, error_msg = get_video_probe(temp_path, blob)
+                if probe is None:
+                    return {
                         'error': 'Could not determine video length',
-                        'details': f"FFmpeg error: {error_msg}",
+                        'details': error_msg,
                         'file_size': format_file_size(file_size) if file_size else 'Unknown'
-                    }), 500
-            
-            # Initialize YOLO model
-            yolo = YOLOInference()
+                    }, 500
+                duration_seconds = probe['duration_seconds']
+                probe_seconds = time.perf_counter() - start
             
             # Extract objects from video frames
             extracted_objects = extract_objects_from_video(
                 temp_path, 
                 yolo, 
                 frame_interval,
-                video_uri
+                video_uri,
+                batch_size=batch_size,
+                sample_seconds=sample_seconds,
+                sampling_strategy=params['sampling_strategy'],
+                seekable=stream is None,
+                progress_callback=progress_callback,
+                frame_callback=frame_callback,
+                keep_frame_data=frame_callback is None,
+                padding=params['padding'],
+                confidence_threshold=params['confidence_threshold'],
+                crop_format=params['crop_format'],
+                crop_quality=params['crop_quality'],
+                track_objects=params['track_objects'],
+                track_alternates=params['track_alternates'],
+                adaptive_options=adaptive_sampling_options(params),
+                dedup_crops=params['dedup_crops'] and not params['track_objects'],
+                dedup_distance=params['dedup_distance'],
+                workers=params['workers'],
+                peer_urls=PEER_URLS if params['distribute'] else None,
+                probe=probe,
+                imgsz=params['imgsz'],
+                downscale=params['downscale'],
+                include_masks=params['include_masks'],
+                categories=params['categories'],
+                category_thresholds=params['category_thresholds'],
+                decoder=params['decoder'],
+                decode_threads=params['decode_threads']
             )
             
+            if stream is not None and stream.error is not None:
+                return {
+                    'error': 'Error streaming video from GCS',
+                    'details': str(stream.error)
+                }, 500
+            
+            if duration_seconds is None:
+                fps = extracted_objects['fps']
+                duration_seconds = extracted_objects['total_frames'] / fps if fps > 0 else 0
+            
             # Prepare response
             response = {
                 'video_uri': video_uri,
                 'duration': f"{round(duration_seconds, 2)} seconds",
+                'ingest': 'stream' if stream is not None else 'download',
                 'frame_interval': frame_interval,
-                'total_frames_processed': len(extracted_objects['frame_data']),
-                'total_objects_detected': sum(len(frame['objects']) for frame in extracted_objects['frame_data']),
+                'sample_seconds': sample_seconds,
+                'sampling': extracted_objects['sampling'],
+                'batch_size': batch_size,
+                'inference_size': extracted_objects['inference_size'],
+                'crop_format': params['crop_format'],
+                'total_frames_processed': extracted_objects['total_frames_processed'],
+                'total_objects_detected': extracted_objects['total_objects_detected'],
+                'total_tracks': extracted_objects['total_tracks'],
+                'dedup': extracted_objects['dedup'],
+                'category_filter': extracted_objects['category_filter'],
+                'pipeline': extracted_objects['pipeline'],
                 'object_categories': extracted_objects['object_categories'],
                 'processed_images_bucket': extracted_objects['processed_images_bucket'],
                 'frame_data': extracted_objects['frame_data']
             }
             
-            return jsonify(response), 200
+            # Streamed results don't keep frame_data, so only full responses are
+            # cached, and only complete ones, so that a transient failure is not replayed
+            if cache_key is not None and frame_callback is None:
+                if is_complete_result(response):
+                    try:
+                        result_cache.put(cache_key, response)
+                    except Exception as e:
+                        logger.warning(f"Could not cache result for {video_uri}: {e}")
+                else:
+                    logger.info(f"Not caching the result for {video_uri}: some frames or uploads failed")
+                response = dict(response, cache='miss')
+            
+            if params['include_timings']:
+                sampling = extracted_objects['sampling']
+                pipeline_stats = extracted_objects['pipeline']
+                response['timings'] = {
+                    'download_seconds': round(download_seconds, 3) if download_seconds is not None else None,
+                    'download_bytes': file_size,
+                    'probe_seconds': round(probe_seconds, 3) if probe_seconds is not None else None,
+                    'decode_seconds': pipeline_stats['decode']['busy_seconds'],
+                    'inference_seconds': pipeline_stats['infer']['busy_seconds'],
+                    'encode_seconds': pipeline_stats['encode']['busy_seconds'],
+                    'upload_seconds': pipeline_stats['upload']['busy_seconds'],
+                    'frames_decoded': sampling.get('frames_grabbed', 0) + sampling.get('frames_retrieved', 0),
+                    'frames_inferred': extracted_objects['total_frames_processed'],
+                    'total_seconds': round(time.perf_counter() - request_start, 3)
+                }
             
+            return response, 200
+            
+        finally:
+            # Clean up temporary file or pipe
+            if stream is not None:
+                stream.close()
+            else:
+                try:
+                    os.unlink(temp_path)
+                except Exception as e:
+                    logger.warning(f"Could not delete temporary file {temp_path}: {e}")
+                
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return {'error': 'Internal server error'}, 500
+
+def run_segment_analysis(params, segment):
+    """Fetch a video from GCS and extract objects from one time range of it
+    
+    Args:
+        params: Validated request parameters from parse_analyze_request
+        segment: Validated time range from parse_segment_request
+        
+    Returns:
+        (partial_result, status_code); the coordinator merges the partial
+        results of all segments
+    """
+    try:
+        video_uri = params['video_uri']
+        yolo = get_model(params['include_masks'])
+        error = check_categories(params, yolo)
+        if error is not None:
+            return error
+        
+        blob, error_msg = get_video_blob(video_uri)
+        if blob is None:
+            return {'error': 'Video file not found'}, 404
+        temp_path, file_size = download_video_from_gcs(video_uri, blob)
+        if temp_path is None:
+            return {'error': 'Video file not found'}, 404
+        
+        try:
+            probe, error_msg = get_video_probe(temp_path, blob)
+            if probe is None:
+                return {'error': 'Could not determine video length', 'details': error_msg}, 500
+            return extract_objects_from_video(
+                temp_path,
+                yolo,
+                params['frame_interval'],
+                video_uri,
+                batch_size=params['batch_size'],
+                sample_seconds=params['sample_seconds'],
+                sampling_strategy=params['sampling_strategy'],
+                padding=params['padding'],
+                confidence_threshold=params['confidence_threshold'],
+                crop_format=params['crop_format'],
+                crop_quality=params['crop_quality'],
+                workers=params['workers'],
+                probe=probe,
+                imgsz=params['imgsz'],
+                downscale=params['downscale'],
+                include_masks=params['include_masks'],
+                categories=params['categories'],
+                category_thresholds=params['category_thresholds'],
+                decoder=params['decoder'],
+                decode_threads=params['decode_threads'],
+                **segment
+            ), 200
         finally:
-            # Clean up temporary file
             try:
                 os.unlink(temp_path)
             except Exception as e:
                 logger.warning(f"Could not delete temporary file {temp_path}: {e}")
                 
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return {'error': 'Internal server error'}, 500
+
+STREAM_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream'
+}
+
+def format_stream_event(event, payload, stream_format):
+    """Serialize one streamed event as an NDJSON line or an SSE message"""
+    if stream_format == 'sse':
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps(dict(payload, event=event)) + "\n"
+
+def stream_video_analysis(params, stream_format):
+    """Run an analysis and yield each frame as soon as its crops are uploaded
+    
+    The analysis runs on a separate thread and hands frames over through a
+    bounded queue. A 'frame' event is emitted per processed frame, followed
+    by one 'summary' event with object_categories and the totals, or an
+    'error' event. If the client disconnects the analysis is cancelled.
+    """
+    events = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    cancelled = threading.Event()
+    
+    def put(event):
+        # Block while the client is slow, but give up once it has gone away
+        while not cancelled.is_set():
+            try:
+                events.put(event, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise RuntimeError("Client disconnected")
+    
+    def run():
+        try:
+            response, status_code = run_video_analysis(
+                params,
+                frame_callback=lambda frame_entry: put(('frame', frame_entry))
+            )
+            response.pop('frame_data', None)
+            put(('summary' if status_code < 400 else 'error', dict(response, status_code=status_code)))
+        except Exception as e:
+            logger.error(f"Error in streamed analysis: {e}")
+            if not cancelled.is_set():
+                try:
+                    put(('error', {'error': 'Internal server error', 'details': str(e), 'status_code': 500}))
+                except RuntimeError:
+                    pass
+        finally:
+            try:
+                put(None)
+            except RuntimeError:
+                pass
+    
+    threading.Thread(target=run, name='stream-analysis', daemon=True).start()
+    
+    try:
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            yield format_stream_event(event[0], event[1], stream_format)
+    finally:
+        cancelled.set()
+
+# Probed video properties, keyed by video generation
+probe_cache = ProbeCache(int(os.environ.get('PROBE_CACHE_SIZE', 1024)))
+
+# Previous results, keyed by video generation, model and parameters
+RESULT_CACHE_BACKEND = os.environ.get('RESULT_CACHE_BACKEND', 'disk')
+result_cache = create_result_cache(
+    RESULT_CACHE_BACKEND,
+    os.environ.get('RESULT_CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'analysis-cache')),
+    max_bytes=int(os.environ.get('RESULT_CACHE_MAX_BYTES', 100 * 1024 * 1024)),
+    storage_client=get_storage_client() if RESULT_CACHE_BACKEND == 'gcs' else None
+)
+
+# Background jobs for "async": true requests
+JOB_STORE_BACKEND = os.environ.get('JOB_STORE_BACKEND', 'sqlite')
+job_manager = JobManager(
+    create_job_store(
+        JOB_STORE_BACKEND,
+        os.environ.get('JOB_STORE_PATH', os.path.join(tempfile.gettempdir(), 'analyze_jobs.db')),
+        storage_client=get_storage_client() if JOB_STORE_BACKEND == 'gcs' else None
+    ),
+    run_video_analysis,
+    max_workers=int(os.environ.get('JOB_WORKERS', 1))
+)
+
+@app.route('/analyze_video', methods=['POST'])
+@require_api_key
+def analyze_video():
+    """Main endpoint to analyze video and extract objects every 20 frames
+    
+    With "async": true the video is processed by a background job and the
+    endpoint returns 202 with a job id to poll at /jobs/<job_id>.
+    """
+    try:
+        # Parse request
+        data = request.get_json()
+        params, error = parse_analyze_request(data)
+        if error is not None:
+            return jsonify(error[0]), error[1]
+        
+        # Stream frames as NDJSON lines or server-sent events if requested
+        stream_format = data.get('stream_results')
+        if stream_format is None:
+            accept = request.headers.get('Accept', '')
+            if 'text/event-stream' in accept:
+                stream_format = 'sse'
+            elif 'application/x-ndjson' in accept:
+                stream_format = 'ndjson'
+        if stream_format is not None:
+            if stream_format not in STREAM_MIMETYPES:
+                return jsonify({'error': f"Invalid stream_results format '{stream_format}'"}), 400
+            return Response(
+                stream_with_context(stream_video_analysis(params, stream_format)),
+                mimetype=STREAM_MIMETYPES[stream_format],
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+        
+        if data.get('async'):
+            job = job_manager.submit(params)
+            return jsonify({
+                'job_id': job['job_id'],
+                'status': job['status'],
+                'status_url': f"/jobs/{job['job_id']}"
+            }), 202
+        
+        response, status_code = run_video_analysis(params)
+        return jsonify(response), status_code
+        
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/analyze_videos', methods=['POST'])
+@require_api_key
+def analyze_videos():
+    """Analyze a batch of videos in one call
+    
+    Takes "videos", a list of video URIs or of objects with a video_uri and
+    per-video parameters. Any other analyze_video parameter applies to all
+    videos. Each video becomes a job on the shared job pool, which runs
+    JOB_WORKERS of them at a time on the shared model. By default the
+    endpoint returns 202 with a job id per video. With "async": false it
+    waits up to BULK_WAIT_SECONDS and returns every video's result, in
+    request order; videos still running by then are returned with their
+    status_url and the response is 202.
+    """
+    try:
+        data = request.get_json()
+        videos = data.get('videos') if isinstance(data, dict) else None
+        if not isinstance(videos, list) or not videos:
+            return jsonify({'error': 'videos must be a non-empty list'}), 400
+        if len(videos) > MAX_BULK_VIDEOS:
+            return jsonify({'error': f"At most {MAX_BULK_VIDEOS} videos can be analyzed in one call"}), 400
+        if data.get('stream_results') is not None:
+            return jsonify({'error': 'stream_results is not supported for batches'}), 400
+        
+        # Validate every video before queueing any of them
+        defaults = {key: value for key, value in data.items() if key not in ('videos', 'async')}
+        params_list = []
+        errors = []
+        for index, video in enumerate(videos):
+            overrides = {'video_uri': video} if isinstance(video, str) else video
+            if not isinstance(overrides, dict):
+                errors.append({'index': index, 'error': 'Each video must be a URI or an object with a video_uri'})
+                continue
+            params, error = parse_analyze_request(dict(defaults, **overrides))
+            if error is not None:
+                errors.append(dict(error[0], index=index))
+                continue
+            params_list.append(params)
+        if errors:
+            return jsonify({'error': 'Invalid videos in batch', 'videos': errors}), 400
+        
+        # Load the shared models once, before the jobs start
+        for include_masks in {params['include_masks'] for params in params_list}:
+            get_model(include_masks)
+        jobs = [job_manager.submit(params) for params in params_list]
+        logger.info(f"Queued a batch of {len(jobs)} videos")
+        
+        if data.get('async', True):
+            return jsonify({
+                'videos': [
+                    {
+                        'video_uri': params['video_uri'],
+                        'job_id': job['job_id'],
+                        'status': job['status'],
+                        'status_url': f"/jobs/{job['job_id']}"
+                    }
+                    for params, job in zip(params_list, jobs)
+                ]
+            }), 202
+        
+        results = []
+        finished = job_manager.wait([job['job_id'] for job in jobs], timeout=BULK_WAIT_SECONDS)
+        for params, job in zip(params_list, finished):
+            entry = {'video_uri': params['video_uri'], 'job_id': job['job_id'], 'status': job['status']}
+            if job['status'] == 'succeeded':
+                entry['result'] = job['result']
+            elif job['status'] == 'failed':
+                entry['error'] = job.get('error')
+                entry['status_code'] = job.get('status_code', 500)
+            else:
+                entry['status_url'] = f"/jobs/{job['job_id']}"
+            results.append(entry)
+        
+        pending = sum(1 for entry in results if entry['status'] not in ('succeeded', 'failed'))
+        return jsonify({
+            'videos': results,
+            'succeeded': sum(1 for entry in results if entry['status'] == 'succeeded'),
+            'failed': sum(1 for entry in results if entry['status'] == 'failed'),
+            'pending': pending
+        }), 202 if pending else 200
+        
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/analyze_segment', methods=['POST'])
+@require_api_key
+def analyze_segment():
+    """Analyze one time range of a video for a coordinating instance
+    
+    Takes the analyze_video parameters plus start_frame, end_frame,
+    first_sample_index and unique_id, and returns the partial result that
+    the coordinator merges with the other segments.
+    """
+    try:
+        data = request.get_json()
+        params, error = parse_analyze_request(data)
+        if error is None:
+            segment, error = parse_segment_request(data, params)
+        if error is not None:
+            return jsonify(error[0]), error[1]
+        
+        response, status_code = run_segment_analysis(params, segment)
+        return jsonify(response), status_code
+        
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Expose download, decode, inference, encode and upload metrics to Prometheus"""
+    body, content_type = metrics.render_metrics()
+    return Response(body, content_type=content_type)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@require_api_key
+def get_job(job_id):
+    """Get the status, progress and, once finished, the result of an analysis job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job), 200
+
 if __name__ == '__main__':
     # Get port from environment variable or default to 8080
     port = int(os.environ.get('PORT', 8080))
     
     # Run the app
-    app.run(host='0.0.0.0', port=port, debug=False) 
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=False) 
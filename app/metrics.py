@@ -0,0 +1,63 @@
+import os
+from typing import Tuple
+import logging
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+
+logger = logging.getLogger(__name__)
+
+# Per-item stage times, from a small crop upload to a large inference batch
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Whole-video times such as downloads
+VIDEO_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+DOWNLOAD_BYTES = Counter(
+    'video_download_bytes',
+    'Bytes of video read from GCS'
+)
+DOWNLOAD_SECONDS = Histogram(
+    'video_download_seconds',
+    'Time to download or stream one video from GCS',
+    buckets=VIDEO_BUCKETS
+)
+PROBE_SECONDS = Histogram(
+    'video_probe_seconds',
+    'Time to read the duration of one video',
+    ['method'],
+    buckets=STAGE_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    'pipeline_stage_seconds',
+    'Time spent on one item of a processing stage: a batch for decode and inference, a crop for encode and upload',
+    ['stage'],
+    buckets=STAGE_BUCKETS
+)
+FRAMES = Counter(
+    'video_frames',
+    'Video frames by what was done with them: decoded (including frames only stepped over) or inferred',
+    ['state']
+)
+DETECTIONS_PER_FRAME = Histogram(
+    'detections_per_frame',
+    'Objects detected in one sampled frame',
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100)
+)
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Serialize all metrics in the Prometheus text format
+    
+    When PROMETHEUS_MULTIPROC_DIR is set (required for it to work across
+    gunicorn workers and shard worker processes), the metrics written by
+    every process are combined.
+    
+    Returns:
+        (body, content_type)
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,162 @@
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's output
+_DONE = object()
+
+class PipelineStage:
+    """Run one stage of a processing pipeline on its own thread
+    
+    The stage pulls items from source, optionally transforms them with fn and
+    hands the results to the consumer, who iterates over the stage, through a
+    queue of at most maxsize items. A full queue blocks the stage, so a slow
+    consumer throttles it (backpressure). Stages are chained by passing one
+    stage as the source of the next.
+    
+    An exception in the stage is re-raised in the consumer. close() cancels
+    the stage, e.g. when the consumer fails, and waits for its thread.
+    Resources the source reads from can be freed with on_stop, which runs on
+    the stage's thread once it no longer uses the source, even if close()
+    gave up waiting for it.
+    """
+    
+    def __init__(self, name: str, source: Iterable, fn: Optional[Callable] = None, maxsize: int = 2,
+                 on_stop: Optional[Callable[[], None]] = None):
+        """Start the stage
+        
+        Args:
+            name: Stage name used for the thread and in stats
+            source: Items to process, e.g. a generator or an upstream PipelineStage
+            fn: Applied to every item; without fn the source items are passed on
+            maxsize: Number of finished items that may wait for the consumer
+            on_stop: Called on the stage's thread when it stops, before the
+                consumer sees the end of its output, e.g. to release a decoder
+        """
+        self.name = name
+        self._source = source
+        self._fn = fn
+        self._on_stop = on_stop
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._cancelled = threading.Event()
+        self._stats = {
+            'items': 0,
+            'busy_seconds': 0.0,
+            'blocked_seconds': 0.0,
+            'starved_seconds': 0.0,
+            'max_queue_depth': 0,
+            'queue_depth_sum': 0
+        }
+        self._thread = threading.Thread(target=self._run, name=f"pipeline-{name}", daemon=True)
+        self._thread.start()
+    
+    def __iter__(self) -> Iterator:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                # A downstream stage iterating over this one stops on cancellation
+                if self._cancelled.is_set():
+                    return
+                continue
+            finally:
+                self._stats['starved_seconds'] += time.perf_counter() - start
+            if item is _DONE:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    
+    def close(self, timeout: float = 30.0) -> None:
+        """Cancel the stage and its upstream stages if still running and wait for their threads"""
+        stage = self
+        while isinstance(stage, PipelineStage):
+            stage._cancelled.set()
+            stage = stage._source
+        
+        # Unblock a stage waiting for room in the queue
+        while self._thread.is_alive():
+            try:
+                while True:
+                    self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._thread.join(0.1)
+            timeout -= 0.1
+            if timeout <= 0:
+                logger.warning(f"Pipeline stage {self.name} did not stop")
+                break
+        if isinstance(self._source, PipelineStage):
+            self._source.close(timeout)
+    
+    def stats(self) -> Dict:
+        """Get the stage's counters
+        
+        Returns:
+            items: Number of items produced
+            busy_seconds: Time spent in fn, or producing source items when there is no fn
+            blocked_seconds: Time the stage waited for room in its queue (consumer too slow)
+            starved_seconds: Time the consumer waited for items (stage too slow)
+            max_queue_depth, mean_queue_depth: Queue length seen when adding items
+        """
+        stats = dict(self._stats)
+        queue_depth_sum = stats.pop('queue_depth_sum')
+        stats['mean_queue_depth'] = round(queue_depth_sum / stats['items'], 2) if stats['items'] else 0.0
+        for key in ('busy_seconds', 'blocked_seconds', 'starved_seconds'):
+            stats[key] = round(stats[key], 3)
+        return stats
+    
+    def _put(self, item) -> bool:
+        """Add an item to the queue unless the stage is cancelled"""
+        start = time.perf_counter()
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                self._stats['blocked_seconds'] += time.perf_counter() - start
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _run(self):
+        result = _DONE
+        try:
+            items = iter(self._source)
+            while not self._cancelled.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                if self._fn is not None:
+                    start = time.perf_counter()
+                    item = self._fn(item)
+                self._stats['busy_seconds'] += time.perf_counter() - start
+                
+                depth = self._queue.qsize()
+                self._stats['items'] += 1
+                self._stats['queue_depth_sum'] += depth
+                self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], depth)
+                if not self._put(item):
+                    break
+        except Exception as e:
+            logger.error(f"Pipeline stage {self.name} failed: {e}")
+            result = _StageError(e)
+        finally:
+            if self._on_stop is not None:
+                try:
+                    self._on_stop()
+                except Exception as e:
+                    logger.warning(f"Pipeline stage {self.name} could not clean up: {e}")
+        self._put(result)
+
+class _StageError:
+    """Carries an exception from a stage's thread to its consumer"""
+    
+    def __init__(self, error: Exception):
+        self.error = error
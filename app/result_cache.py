@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+import logging
+
+from google.api_core.exceptions import NotFound
+
+logger = logging.getLogger(__name__)
+
+def make_cache_key(bucket_name: str, blob_name: str, generation, etag: Optional[str],
+                   model_identity: str, params: Dict) -> str:
+    """Build the cache key for an analysis
+    
+    Args:
+        bucket_name: Bucket of the video
+        blob_name: Object name of the video
+        generation: GCS generation of the object, changes on every overwrite
+        etag: GCS etag of the object
+        model_identity: Identifies the model weights, see YOLOInference.model_identity
+        params: Request parameters that change the result (frame_interval,
+            sample_seconds, padding, confidence_threshold, ...)
+    
+    Returns:
+        Hex digest identifying the result
+    """
+    material = json.dumps({
+        'bucket': bucket_name,
+        'object': blob_name,
+        'generation': str(generation),
+        'etag': etag,
+        'model': model_identity,
+        'params': params
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+class ResultCache(ABC):
+    """Storage for analyze_video responses keyed by make_cache_key"""
+    
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict]:
+        """Get a cached response, or None on a miss"""
+    
+    @abstractmethod
+    def put(self, key: str, response: Dict) -> None:
+        """Store a response"""
+
+class LocalDiskLRUCache(ResultCache):
+    """Result cache on local disk, evicting least recently used entries above max_bytes"""
+    
+    def __init__(self, directory: str, max_bytes: int = 100 * 1024 * 1024):
+        """Initialize the cache
+        
+        Args:
+            directory: Directory for the cache files, created if missing
+            max_bytes: Total size the cache files are kept under
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+    
+    def get(self, key: str) -> Optional[Dict]:
+        path = self._path(key)
+        with self._lock:
+            try:
+                with open(path) as f:
+                    response = json.load(f)
+            except FileNotFoundError:
+                return None
+            except ValueError:
+                logger.warning(f"Discarding corrupt cache entry {path}")
+                os.unlink(path)
+                return None
+            # The modification time doubles as the LRU timestamp
+            os.utime(path)
+            return response
+    
+    def put(self, key: str, response: Dict) -> None:
+        path = self._path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with self._lock:
+            with open(temp_path, 'w') as f:
+                json.dump(response, f)
+            os.replace(temp_path, path)
+            self._evict()
+    
+    def _evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                # Evicted concurrently by another worker
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self.directory, name))
+                logger.info(f"Evicted cached result {name}")
+            except FileNotFoundError:
+                pass
+            total -= size
+
+class GCSManifestCache(ResultCache):
+    """Result cache stored as JSON manifests in a GCS bucket, shared by all instances"""
+    
+    def __init__(self, bucket, prefix: str = 'analysis-cache'):
+        """Initialize the cache
+        
+        Args:
+            bucket: google.cloud.storage Bucket holding the manifests
+            prefix: Object name prefix for the manifests
+        """
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+    
+    def get(self, key: str) -> Optional[Dict]:
+        try:
+            data = self.bucket.blob(f"{self.prefix}/{key}.json").download_as_bytes()
+        except NotFound:
+            return None
+        return json.loads(data)
+    
+    def put(self, key: str, response: Dict) -> None:
+        self.bucket.blob(f"{self.prefix}/{key}.json").upload_from_string(
+            json.dumps(response),
+            content_type='application/json'
+        )
+
+def create_result_cache(backend: str, location: str, max_bytes: int = 100 * 1024 * 1024,
+                        storage_client=None) -> Optional[ResultCache]:
+    """Create a result cache from configuration
+    
+    Args:
+        backend: 'disk', 'gcs' or 'none'
+        location: Directory for 'disk', gs://bucket/prefix for 'gcs'
+        max_bytes: Size cap for 'disk'
+        storage_client: GCS client for 'gcs'
+    
+    Returns:
+        ResultCache instance, or None when caching is disabled
+    """
+    if backend == 'none':
+        return None
+    if backend == 'disk':
+        return LocalDiskLRUCache(location, max_bytes)
+    if backend == 'gcs':
+        if not location.startswith('gs://'):
+            raise ValueError("GCS result cache location must be a gs:// URI")
+        bucket_name, _, prefix = location[len('gs://'):].partition('/')
+        return GCSManifestCache(storage_client.bucket(bucket_name), prefix or 'analysis-cache')
+    raise ValueError(f"Unknown result cache backend '{backend}'")
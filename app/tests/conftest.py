@@ -0,0 +1,83 @@
+import os
+import sys
+import threading
+
+# The app modules are imported as top-level modules (see Dockerfile)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.api_core.exceptions import NotFound
+
+from yolo_inference import YOLOInference
+
+
+class FakeBlob:
+    """In-memory stand-in for a GCS blob, stored in its FakeBucket's objects"""
+
+    chunk_size = 4096
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.generation = 1
+        self.etag = 'etag'
+        self.md5_hash = 'md5'
+        self.size = None
+        self.content_type = None
+        self.ranges = []
+
+    def _data(self):
+        if self.name not in self.bucket.objects:
+            raise NotFound(self.name)
+        return self.bucket.objects[self.name]
+
+    def reload(self, **kwargs):
+        self.size = len(self._data())
+
+    def download_as_bytes(self, start=None, end=None, **kwargs):
+        self.ranges.append((start, end))
+        return self._data()[start:None if end is None else end + 1]
+
+    def download_to_filename(self, path, **kwargs):
+        with open(path, 'wb') as f:
+            f.write(self._data())
+
+    def download_to_file(self, f, **kwargs):
+        data = self._data()
+        for offset in range(0, len(data), self.chunk_size):
+            f.write(data[offset:offset + self.chunk_size])
+            f.flush()
+
+    def upload_from_string(self, data, content_type=None, **kwargs):
+        with self.bucket.lock:
+            self.bucket.objects[self.name] = data.encode('utf-8') if isinstance(data, str) else bytes(data)
+            self.bucket.upload_options[self.name] = dict(kwargs, content_type=content_type)
+        self.content_type = content_type
+
+
+class FakeBucket:
+    blob_class = FakeBlob
+
+    def __init__(self, name='test-bucket'):
+        self.name = name
+        self.objects = {}
+        self.upload_options = {}
+        self.lock = threading.Lock()
+
+    def blob(self, name):
+        return self.blob_class(self, name)
+
+
+class FakeStorageClient:
+    def __init__(self):
+        self.buckets = {}
+
+    def bucket(self, name):
+        return self.buckets.setdefault(name, FakeBucket(name))
+
+
+def make_detector(model):
+    """Wrap a stand-in for an Ultralytics model in a YOLOInference without loading any weights"""
+    yolo = YOLOInference.__new__(YOLOInference)
+    yolo.model = model
+    yolo._lock = threading.Lock()
+    return yolo
@@ -0,0 +1,73 @@
+import cv2
+import numpy as np
+import pytest
+
+from crop_encoder import CROP_FORMATS, CropEncoder, encode_crop
+
+# Leading bytes of each format, by content type
+SIGNATURES = {
+    'image/png': lambda data: data[:8] == b'\x89PNG\r\n\x1a\n',
+    'image/jpeg': lambda data: data[:3] == b'\xff\xd8\xff',
+    'image/webp': lambda data: data[:4] == b'RIFF' and data[8:12] == b'WEBP'
+}
+
+
+def make_crop(width=64, height=48):
+    """A smooth BGR gradient, which lossy formats keep close to the original"""
+    x = np.linspace(0, 255, width, dtype=np.uint8)
+    y = np.linspace(0, 255, height, dtype=np.uint8)
+    crop = np.zeros((height, width, 3), dtype=np.uint8)
+    crop[:, :, 0] = x
+    crop[:, :, 1] = y[:, None]
+    crop[:, :, 2] = 128
+    return crop
+
+
+@pytest.mark.parametrize('crop_format', sorted(CROP_FORMATS))
+def test_crops_round_trip(crop_format):
+    crop = make_crop()
+    extension, content_type, _ = CROP_FORMATS[crop_format]
+
+    with CropEncoder(crop_format, quality=90, max_workers=2) as encoder:
+        data = encoder.submit(crop).result()
+
+    assert (encoder.extension, encoder.content_type) == (extension, content_type)
+    assert SIGNATURES[content_type](data)
+    decoded = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    assert decoded.shape == crop.shape
+    if crop_format == 'png':
+        assert np.array_equal(decoded, crop)
+    else:
+        assert np.abs(decoded.astype(int) - crop).mean() < 3
+    assert encoder.stats()['items'] == 1
+
+
+def test_quality_changes_the_size_of_lossy_crops():
+    crop = np.random.default_rng(0).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+
+    assert len(encode_crop(crop, 'jpeg', quality=30)) < len(encode_crop(crop, 'jpeg', quality=95))
+
+
+def test_crops_are_encoded_concurrently_in_submission_order():
+    crops = [np.full((16, 16, 3), value, dtype=np.uint8) for value in range(0, 250, 10)]
+
+    with CropEncoder('png', max_workers=4) as encoder:
+        futures = [encoder.submit(crop) for crop in crops]
+        decoded = [cv2.imdecode(np.frombuffer(future.result(), dtype=np.uint8), cv2.IMREAD_COLOR)
+                   for future in futures]
+
+    assert [int(image[0, 0, 0]) for image in decoded] == list(range(0, 250, 10))
+    assert encoder.stats()['items'] == len(crops)
+
+
+def test_unknown_formats_are_rejected():
+    with pytest.raises(ValueError, match='gif'):
+        CropEncoder('gif')
+    with pytest.raises(ValueError, match='gif'):
+        encode_crop(make_crop(), 'gif')
+
+
+@pytest.mark.parametrize('quality', [0, 101])
+def test_quality_out_of_range_is_rejected(quality):
+    with pytest.raises(ValueError):
+        CropEncoder('jpeg', quality=quality)
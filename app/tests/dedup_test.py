@@ -0,0 +1,45 @@
+import random
+
+import numpy as np
+
+from dedup import BKTree, CropDeduplicator, dhash, hamming_distance
+
+
+def test_bk_tree_search_matches_brute_force():
+    rng = random.Random(0)
+    hashes = [rng.getrandbits(64) for _ in range(500)]
+    # Add near copies so that some searches have several matches
+    hashes += [h ^ (1 << rng.randrange(64)) for h in hashes[:100]]
+    tree = BKTree()
+    for i, h in enumerate(hashes):
+        tree.add(h, i)
+
+    for query in hashes[:50] + [rng.getrandbits(64) for _ in range(50)]:
+        for max_distance in (0, 3, 12):
+            expected = sorted((hamming_distance(query, h), i) for i, h in enumerate(hashes)
+                              if hamming_distance(query, h) <= max_distance)
+            assert sorted(tree.search(query, max_distance)) == expected
+
+
+def test_dhash_tolerates_small_changes():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (120, 90, 3), dtype=np.uint8)
+    brighter = np.clip(image.astype(int) + 10, 0, 255).astype(np.uint8)
+    other = rng.integers(0, 256, (120, 90, 3), dtype=np.uint8)
+
+    assert hamming_distance(dhash(image), dhash(brighter)) <= 4
+    assert hamming_distance(dhash(image), dhash(other)) > 10
+
+
+def test_deduplicator_ignores_crops_from_the_same_frame():
+    dedup = CropDeduplicator(max_distance=2)
+    canonical = {'frame_number': 0}
+    dedup.add('chair', 0b1011, canonical)
+
+    assert dedup.find('chair', 0b1011, frame_number=0) is None
+    assert dedup.find('chair', 0b1001, frame_number=20) is canonical
+    assert dedup.find('table', 0b1011, frame_number=20) is None
+
+    canonical['failed'] = True
+    assert dedup.find('chair', 0b1011, frame_number=40) is None
+    assert dedup.stats() == {'unique_crops': 1, 'duplicate_crops': 1}
@@ -0,0 +1,258 @@
+import shutil
+import subprocess
+
+import cv2
+import numpy as np
+import pytest
+
+from frame_sampler import (AdaptiveFrameSampler, FFmpegFrameSampler, FrameSampler, choose_strategy,
+                           split_sample_ranges)
+
+
+class FakeCapture:
+    """In-memory stand-in for cv2.VideoCapture over numbered frames"""
+
+    def __init__(self, num_frames, fps=30.0, fourcc='avc1'):
+        self.num_frames = num_frames
+        self.fps = fps
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.position = 0
+        self.calls = {'read': 0, 'grab': 0, 'retrieve': 0, 'set': 0}
+
+    def get(self, prop):
+        return {
+            cv2.CAP_PROP_FPS: self.fps,
+            cv2.CAP_PROP_FRAME_COUNT: self.num_frames,
+            cv2.CAP_PROP_FOURCC: self.fourcc,
+        }[prop]
+
+    def set(self, prop, value):
+        assert prop == cv2.CAP_PROP_POS_FRAMES
+        self.calls['set'] += 1
+        self.position = int(value)
+        return True
+
+    def grab(self):
+        self.calls['grab'] += 1
+        if self.position >= self.num_frames:
+            return False
+        self.position += 1
+        return True
+
+    def retrieve(self):
+        self.calls['retrieve'] += 1
+        return True, np.full((2, 2, 3), self.position - 1, dtype=np.uint16)
+
+    def read(self):
+        self.calls['read'] += 1
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+
+def legacy_frame_indices(cap, frame_interval):
+    """The original `while True: cap.read()` loop from extract_objects_from_video"""
+    indices = []
+    frame_count = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if frame_count % frame_interval == 0:
+            assert frame[0, 0, 0] == frame_count
+            indices.append(frame_count)
+        frame_count += 1
+    return indices
+
+
+@pytest.mark.parametrize("num_frames", [0, 1, 19, 20, 21, 301])
+@pytest.mark.parametrize("frame_interval", [1, 7, 20])
+@pytest.mark.parametrize("strategy", ["read", "grab", "seek"])
+def test_sampler_matches_legacy_indices(num_frames, frame_interval, strategy):
+    expected = legacy_frame_indices(FakeCapture(num_frames), frame_interval)
+
+    sampler = FrameSampler(FakeCapture(num_frames), frame_interval=frame_interval,
+                           strategy=strategy, keyframes=list(range(0, num_frames, 12)))
+    sampled = list(sampler)
+
+    assert [n for n, _ in sampled] == expected
+    # Each yielded frame is really the frame with that index
+    assert all(frame[0, 0, 0] == n for n, frame in sampled)
+
+
+def test_grab_skips_retrieve_for_unsampled_frames():
+    cap = FakeCapture(100)
+    list(FrameSampler(cap, frame_interval=20, strategy='grab'))
+    assert cap.calls['retrieve'] == 5
+
+
+def test_seek_only_when_a_keyframe_is_skipped():
+    cap = FakeCapture(100)
+    sampler = FrameSampler(cap, frame_interval=20, strategy='seek', keyframes=[0, 50])
+    assert [n for n, _ in sampler] == [0, 20, 40, 60, 80]
+    # Only the jump from 41 to 60 passes keyframe 50
+    assert sampler.stats['seeks'] == 1
+
+
+def test_time_based_targets_are_independent_of_fps():
+    for fps in (24.0, 30.0, 59.94):
+        sampler = FrameSampler(FakeCapture(int(fps * 10), fps=fps), sample_seconds=2, strategy='grab')
+        timestamps = [n / fps for n, _ in sampler]
+        assert timestamps == pytest.approx([0, 2, 4, 6, 8], abs=0.5 / fps)
+
+
+def test_choose_strategy():
+    assert choose_strategy('.avi', 'mjpg', 20) == 'seek'
+    assert choose_strategy('.mp4', 'avc1', 20) == 'grab'
+    assert choose_strategy('.mp4', 'avc1', 20, keyframes=list(range(0, 300, 10))) == 'seek'
+    assert choose_strategy('.mp4', 'avc1', 20, keyframes=list(range(0, 300, 60))) == 'grab'
+    assert choose_strategy('.mp4', 'mjpg', 20, seekable=False) == 'grab'
+    assert choose_strategy('.flv', 'mjpg', 20) == 'grab'
+
+
+@pytest.mark.parametrize("strategy", ["grab", "seek"])
+def test_sampler_matches_legacy_frames_on_real_video(tmp_path, strategy):
+    path = str(tmp_path / "numbered.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (64, 48))
+    for i in range(50):
+        writer.write(np.full((48, 64, 3), i * 5, dtype=np.uint8))
+    writer.release()
+
+    legacy = []
+    cap = cv2.VideoCapture(path)
+    frame_count = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if frame_count % 7 == 0:
+            legacy.append((frame_count, frame))
+        frame_count += 1
+
+    sampled = list(FrameSampler(cv2.VideoCapture(path), frame_interval=7,
+                                strategy=strategy, container='.avi'))
+
+    assert [n for n, _ in sampled] == [n for n, _ in legacy]
+    for (_, expected), (_, frame) in zip(legacy, sampled):
+        assert np.array_equal(expected, frame)
+
+
+@pytest.mark.parametrize("shards", [1, 2, 3, 7])
+@pytest.mark.parametrize("strategy", ["read", "grab", "seek"])
+def test_sample_ranges_cover_every_sample_once(shards, strategy):
+    full = [n for n, _ in FrameSampler(FakeCapture(301), frame_interval=7, strategy=strategy)]
+
+    sampled = []
+    for start_frame, end_frame, first_index in split_sample_ranges(full, shards):
+        assert first_index == len(sampled)
+        sampler = FrameSampler(FakeCapture(301), frame_interval=7, strategy=strategy,
+                               start_frame=start_frame, end_frame=end_frame)
+        frames = list(sampler)
+        assert len(frames) == sampler.expected_samples()
+        assert all(frame[0, 0, 0] == n for n, frame in frames)
+        sampled += [n for n, _ in frames]
+
+    assert sampled == full
+
+
+class SceneCapture(FakeCapture):
+    """FakeCapture whose frames are flat gray, changing brightness at the given scene cuts"""
+
+    def __init__(self, num_frames, cuts=()):
+        super().__init__(num_frames)
+        self.cuts = sorted(cuts)
+
+    def retrieve(self):
+        self.calls['retrieve'] += 1
+        scene = sum(1 for cut in self.cuts if cut <= self.position - 1)
+        return True, np.full((36, 64, 3), 40 * scene, dtype=np.uint8)
+
+
+def test_adaptive_sampler_only_samples_still_video_at_max_gap():
+    sampler = AdaptiveFrameSampler(SceneCapture(200), min_gap=5, max_gap=60)
+    assert [n for n, _ in sampler] == [0, 60, 120, 180]
+    assert sampler.stats['max_gap_samples'] == 3
+    assert sampler.stats['scene_changes'] == 0
+    assert sampler.stats['inferences_skipped'] == sampler.stats['frames_compared']
+
+
+def test_adaptive_sampler_samples_scene_changes():
+    sampler = AdaptiveFrameSampler(SceneCapture(200, cuts=[33, 37, 150]), min_gap=5, max_gap=60)
+    # 37 comes too soon after 33 and is caught at the min_gap
+    assert [n for n, _ in sampler] == [0, 33, 38, 98, 150]
+    assert sampler.stats['scene_changes'] == 3
+    assert sampler.expected_samples() is None
+
+
+def test_adaptive_sampler_does_not_retrieve_frames_within_min_gap():
+    cap = SceneCapture(100)
+    list(AdaptiveFrameSampler(cap, min_gap=10, max_gap=50))
+    # Samples at 0 and 50, comparisons at 10-49 and 60-99
+    assert cap.calls['retrieve'] == 2 + 40 + 40
+
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is not installed')
+
+
+@pytest.fixture(scope='module')
+def numbered_h264(tmp_path_factory):
+    """120 flat gray frames at 25 fps whose brightness is twice the frame number, with B-frames"""
+    directory = tmp_path_factory.mktemp('videos')
+    source = str(directory / 'numbered.avi')
+    writer = cv2.VideoWriter(source, cv2.VideoWriter_fourcc(*'MJPG'), 25, (64, 48))
+    for i in range(120):
+        writer.write(np.full((48, 64, 3), 2 * i, dtype=np.uint8))
+    writer.release()
+    path = str(directory / 'numbered.mp4')
+    subprocess.run(['ffmpeg', '-v', 'error', '-i', source, '-c:v', 'libx264', '-g', '30', '-bf', '2',
+                    '-pix_fmt', 'yuv420p', path], check=True)
+    return path
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize("options", [
+    {'frame_interval': 7},
+    # 0.5 s at 25 fps lands halfway between frames, which round() breaks to even
+    {'sample_seconds': 0.5},
+    {'sample_seconds': 0.3},
+    {'frame_interval': 7, 'start_frame': 35, 'end_frame': 77},
+    {'sample_seconds': 0.5, 'start_frame': 25},
+])
+def test_ffmpeg_sampler_matches_opencv_frames(numbered_h264, options):
+    expected = list(FrameSampler(cv2.VideoCapture(numbered_h264), strategy='grab', **options))
+
+    sampler = FFmpegFrameSampler(cv2.VideoCapture(numbered_h264), numbered_h264, threads=2, **options)
+    sampled = list(sampler)
+
+    assert [n for n, _ in sampled] == [n for n, _ in expected]
+    for (_, frame), (_, expected_frame) in zip(sampled, expected):
+        assert frame.shape == expected_frame.shape
+        assert abs(float(frame.mean()) - float(expected_frame.mean())) <= 2
+    assert sampler.stats['frames_retrieved'] == len(expected)
+    assert sampler.process.returncode == 0
+
+
+@needs_ffmpeg
+def test_ffmpeg_sampler_scales_model_inputs_in_the_decoder(numbered_h264):
+    sampler = FFmpegFrameSampler(cv2.VideoCapture(numbered_h264), numbered_h264, frame_interval=30,
+                                 input_size=(32, 24))
+    samples = list(sampler.samples())
+
+    assert [n for n, _, _ in samples] == [0, 30, 60, 90]
+    for frame_number, frame, model_input in samples:
+        assert frame.shape == (48, 64, 3)
+        assert model_input.shape == (24, 32, 3)
+        assert abs(float(model_input.mean()) - 2 * frame_number) <= 2
+    assert sampler.describe()['frames_scaled'] == 4
+
+
+@needs_ffmpeg
+def test_closing_the_ffmpeg_sampler_stops_ffmpeg(numbered_h264):
+    sampler = FFmpegFrameSampler(cv2.VideoCapture(numbered_h264), numbered_h264, frame_interval=1)
+    samples = sampler.samples()
+    next(samples)
+    sampler.close()
+
+    assert sampler.process.poll() is not None
+    # The rest of the frames are cut off without an error
+    assert len(list(samples)) < 119
@@ -0,0 +1,215 @@
+import os
+import struct
+import threading
+from concurrent.futures import Future
+
+import pytest
+from google.cloud.storage.retry import DEFAULT_RETRY
+
+from conftest import FakeBlob, FakeBucket, FakeStorageClient
+from gcs_io import GCSUploader, StreamingDownload, is_streamable, mp4_moov_before_mdat
+
+
+def box(box_type, payload=b''):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+FTYP = box(b'ftyp', b'isom\x00\x00\x02\x00')
+
+
+def video_blob(data=b'', name='video.mkv'):
+    bucket = FakeBucket('videos')
+    bucket.objects[name] = data
+    blob = bucket.blob(name)
+    blob.reload()
+    return blob
+
+
+def test_moov_before_mdat_is_streamable():
+    assert mp4_moov_before_mdat(FTYP + box(b'moov', b'\x00' * 100) + box(b'mdat', b'\x00' * 1000)) is True
+
+
+def test_mdat_before_moov_is_not_streamable():
+    assert mp4_moov_before_mdat(FTYP + box(b'free') + box(b'mdat', b'\x00' * 1000) + box(b'moov')) is False
+
+
+def test_64_bit_box_sizes_are_skipped():
+    large_free = struct.pack('>I4sQ', 1, b'free', 24) + b'\x00' * 8
+
+    assert mp4_moov_before_mdat(FTYP + large_free + box(b'moov')) is True
+
+
+def test_truncated_headers_are_undecided():
+    header = FTYP + box(b'moov')
+
+    assert mp4_moov_before_mdat(b'') is None
+    assert mp4_moov_before_mdat(FTYP) is None
+    assert mp4_moov_before_mdat(header[:len(FTYP) + 6]) is None
+    # A large box whose 64-bit size is cut off
+    assert mp4_moov_before_mdat(FTYP + struct.pack('>I4s', 1, b'free')) is None
+    # The next box starts past the end of the header
+    assert mp4_moov_before_mdat(FTYP + box(b'free', b'\x00' * 100)[:50]) is None
+
+
+def test_box_sizes_below_the_header_size_are_undecided():
+    assert mp4_moov_before_mdat(FTYP + struct.pack('>I4s', 0, b'free') + box(b'moov')) is None
+
+
+def test_is_streamable():
+    moov_first = video_blob(FTYP + box(b'moov') + box(b'mdat', b'\x00' * 100), 'video.mp4')
+    mdat_first = video_blob(FTYP + box(b'mdat', b'\x00' * 100) + box(b'moov'), 'video.mov')
+
+    assert is_streamable(moov_first, '.mp4', header_bytes=64)
+    assert moov_first.ranges == [(0, 63)]
+    assert not is_streamable(mdat_first, '.mov')
+    # Containers that never need random access aren't downloaded, others always are
+    mkv = video_blob()
+    assert is_streamable(mkv, '.mkv')
+    assert mkv.ranges == []
+    assert not is_streamable(video_blob(name='video.avi'), '.avi')
+
+
+def test_streaming_download_pipes_the_blob_to_the_reader():
+    data = os.urandom(100 * 1024)
+    stream = StreamingDownload(video_blob(data), '.mkv')
+    assert stream.path.endswith('video.mkv')
+
+    with open(stream.path, 'rb') as pipe:
+        received = pipe.read()
+    stream.close()
+
+    assert received == data
+    assert stream.error is None
+    assert not os.path.exists(stream.path)
+
+
+def test_streaming_download_stops_when_the_reader_closes_early():
+    stream = StreamingDownload(video_blob(os.urandom(1024 * 1024)))
+
+    with open(stream.path, 'rb') as pipe:
+        assert len(pipe.read(1000)) == 1000
+    stream.close(timeout=5)
+
+    assert not stream._thread.is_alive()
+    assert stream.error is None
+
+
+def test_close_unblocks_a_writer_waiting_for_the_reader():
+    stream = StreamingDownload(video_blob(os.urandom(1024)))
+    # Nothing opens the pipe, so the writer is stuck opening it
+    assert stream._thread.is_alive()
+
+    stream.close(timeout=5)
+
+    assert not stream._thread.is_alive()
+    assert not os.path.exists(stream.path)
+
+
+def test_streaming_download_records_blob_errors():
+    class FailingBlob(FakeBlob):
+        def download_to_file(self, f, **kwargs):
+            f.write(b'\x00' * 10)
+            raise ConnectionError('connection reset')
+
+    blob = video_blob()
+    stream = StreamingDownload(FailingBlob(blob.bucket, blob.name))
+    with open(stream.path, 'rb') as pipe:
+        assert pipe.read() == b'\x00' * 10
+    stream.close()
+
+    assert isinstance(stream.error, ConnectionError)
+
+
+class UploadBlob(FakeBlob):
+    def upload_from_string(self, data, content_type=None, **kwargs):
+        self.bucket.release.wait(10)
+        if 'bad' in self.name:
+            raise ConnectionError(f"{self.name} was reset")
+        super().upload_from_string(data, content_type=content_type, **kwargs)
+
+
+class UploadBucket(FakeBucket):
+    """Bucket whose uploads wait for release and fail for names containing 'bad'"""
+
+    blob_class = UploadBlob
+
+    def __init__(self, name='crops'):
+        super().__init__(name)
+        self.release = threading.Event()
+        self.release.set()
+
+
+def upload_client():
+    client = FakeStorageClient()
+    client.buckets['crops'] = UploadBucket()
+    return client
+
+
+def test_uploads_retry_transient_errors():
+    client = upload_client()
+    with GCSUploader('crops', client=client) as uploader:
+        future = uploader.submit_bytes(b'png', 'session/0_chair.png', content_type='image/png')
+        assert future.result() == 'gs://crops/session/0_chair.png'
+
+    bucket = client.bucket('crops')
+    assert bucket.objects['session/0_chair.png'] == b'png'
+    assert bucket.upload_options['session/0_chair.png']['content_type'] == 'image/png'
+    assert bucket.upload_options['session/0_chair.png']['retry'] is DEFAULT_RETRY
+
+
+def test_uploads_wait_for_encoded_data():
+    client = upload_client()
+    encoded = Future()
+    with GCSUploader('crops', client=client) as uploader:
+        future = uploader.submit_bytes(encoded, 'session/0_chair.jpg')
+        encoded.set_result(b'jpeg')
+        future.result()
+
+    assert client.bucket('crops').objects['session/0_chair.jpg'] == b'jpeg'
+
+
+def test_failed_uploads_are_counted():
+    failed_encoding = Future()
+    failed_encoding.set_exception(ValueError('cannot encode'))
+    with GCSUploader('crops', max_workers=2, client=upload_client()) as uploader:
+        futures = [
+            uploader.submit_bytes(b'png', 'session/0_chair.png'),
+            uploader.submit_bytes(b'png', 'session/1_bad.png'),
+            uploader.submit_bytes(failed_encoding, 'session/2_couch.png')
+        ]
+        with pytest.raises(ConnectionError):
+            futures[1].result()
+        with pytest.raises(ValueError):
+            futures[2].result()
+        assert futures[0].result() == 'gs://crops/session/0_chair.png'
+
+    stats = uploader.stats()
+    assert (stats['items'], stats['failed']) == (3, 2)
+    assert (uploader.uploaded_count, uploader.failed_count) == (1, 2)
+
+
+def test_submissions_block_while_too_many_uploads_are_pending():
+    client = upload_client()
+    bucket = client.bucket('crops')
+    bucket.release.clear()
+    uploader = GCSUploader('crops', max_workers=2, client=client)
+    # 4 * max_workers uploads can be queued or in flight
+    futures = [uploader.submit_bytes(b'png', f"session/{index}.png") for index in range(8)]
+
+    submitted = threading.Event()
+
+    def submit_one_more():
+        futures.append(uploader.submit_bytes(b'png', 'session/8.png'))
+        submitted.set()
+
+    threading.Thread(target=submit_one_more, daemon=True).start()
+    assert not submitted.wait(0.3)
+    assert uploader.stats()['max_queue_depth'] == 8
+
+    bucket.release.set()
+    assert submitted.wait(5)
+    uploader.close()
+
+    assert all(future.result() for future in futures)
+    assert len(bucket.objects) == 9
+    assert uploader.stats()['max_queue_depth'] == 8
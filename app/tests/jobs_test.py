@@ -0,0 +1,157 @@
+import threading
+
+import pytest
+
+from conftest import FakeBucket, FakeStorageClient
+from jobs import GCSJobStore, JobManager, JobStore, LocalFileJobStore, SQLiteJobStore, create_job_store
+
+
+def make_gcs_store(tmp_path):
+    store = GCSJobStore(FakeBucket())
+    store.min_progress_interval = 0
+    return store
+
+
+STORES = {
+    'sqlite': lambda tmp_path: SQLiteJobStore(str(tmp_path / 'jobs.db')),
+    'file': lambda tmp_path: LocalFileJobStore(str(tmp_path / 'jobs')),
+    'gcs': make_gcs_store
+}
+
+
+def run_job(store, runner):
+    manager = JobManager(store, runner)
+    job = manager.submit({'video_uri': 'gs://b/video.mp4'})
+    return job, manager.wait([job['job_id']])[0]
+
+
+def test_wait_returns_finished_jobs_in_order(tmp_path):
+    release = threading.Event()
+
+    def runner(params, progress_callback=None):
+        if params['video_uri'].endswith('slow.mp4'):
+            release.wait(5)
+        if params['video_uri'].endswith('missing.mp4'):
+            return {'error': 'Video file not found'}, 404
+        return {'video_uri': params['video_uri']}, 200
+
+    manager = JobManager(SQLiteJobStore(str(tmp_path / 'jobs.db')), runner, max_workers=2)
+    uris = ['gs://b/slow.mp4', 'gs://b/missing.mp4', 'gs://b/fast.mp4']
+    jobs = [manager.submit({'video_uri': uri}) for uri in uris]
+
+    # Jobs still running are returned as they are when the timeout expires
+    unfinished = manager.wait([jobs[0]['job_id']], timeout=0.1)
+    assert unfinished[0]['status'] in ('queued', 'running')
+
+    release.set()
+    finished = manager.wait([job['job_id'] for job in jobs])
+    assert [job['status'] for job in finished] == ['succeeded', 'failed', 'succeeded']
+    assert finished[0]['result'] == {'video_uri': 'gs://b/slow.mp4'}
+    assert finished[1]['status_code'] == 404
+
+    # Finished jobs are read back from the store
+    assert manager.wait([jobs[2]['job_id']])[0]['result'] == {'video_uri': 'gs://b/fast.mp4'}
+
+
+def test_job_store_is_abstract():
+    with pytest.raises(TypeError):
+        JobStore()
+
+
+@pytest.mark.parametrize('backend', sorted(STORES))
+def test_job_reports_progress_and_succeeds(tmp_path, backend):
+    store = STORES[backend](tmp_path)
+    release = threading.Event()
+    job_ids = []
+    seen = []
+
+    def runner(params, progress_callback=None):
+        release.wait(5)
+        seen.append(store.get(job_ids[0])['status'])
+        for frames_done in range(1, 4):
+            progress_callback(frames_done, 3)
+            seen.append(store.get(job_ids[0])['progress'])
+        return {'video_uri': params['video_uri'], 'total_objects_detected': 2}, 200
+
+    manager = JobManager(store, runner)
+    job = manager.submit({'video_uri': 'gs://b/video.mp4'})
+    job_ids.append(job['job_id'])
+    assert job['status'] == 'queued'
+    assert store.get(job['job_id'])['progress'] == {'frames_done': 0, 'frames_total': None}
+
+    release.set()
+    finished = manager.wait([job['job_id']])[0]
+    assert seen == ['running'] + [{'frames_done': n, 'frames_total': 3} for n in range(1, 4)]
+    assert finished['status'] == 'succeeded'
+    assert finished['result'] == {'video_uri': 'gs://b/video.mp4', 'total_objects_detected': 2}
+    assert finished['progress'] == {'frames_done': 3, 'frames_total': 3}
+    assert finished['error'] is None
+    assert finished['updated_at'] >= finished['created_at']
+
+
+@pytest.mark.parametrize('backend', sorted(STORES))
+def test_job_fails_with_the_error_response(tmp_path, backend):
+    def runner(params, progress_callback=None):
+        return {'error': 'Video file not found'}, 404
+
+    _, finished = run_job(STORES[backend](tmp_path), runner)
+
+    assert finished['status'] == 'failed'
+    assert finished['error'] == {'error': 'Video file not found'}
+    assert finished['status_code'] == 404
+    assert finished['result'] is None
+
+
+@pytest.mark.parametrize('backend', sorted(STORES))
+def test_job_fails_when_the_runner_raises(tmp_path, backend):
+    def runner(params, progress_callback=None):
+        progress_callback(1, 10)
+        raise RuntimeError('decoder crashed')
+
+    _, finished = run_job(STORES[backend](tmp_path), runner)
+
+    assert finished['status'] == 'failed'
+    assert finished['error'] == {'error': 'decoder crashed'}
+    assert finished['progress'] == {'frames_done': 1, 'frames_total': 10}
+
+
+@pytest.mark.parametrize('backend', sorted(STORES))
+def test_unknown_jobs_are_not_found(tmp_path, backend):
+    store = STORES[backend](tmp_path)
+
+    assert store.get('missing') is None
+    assert store.update('missing', status='running') is None
+
+
+def test_gcs_store_throttles_progress_writes():
+    bucket = FakeBucket()
+    store = GCSJobStore(bucket, prefix='jobs/')
+    store.min_progress_interval = 60
+    store.create('j1', {'video_uri': 'gs://b/video.mp4'})
+
+    store.update('j1', progress={'frames_done': 1, 'frames_total': 3})
+    assert store.get('j1')['progress'] == {'frames_done': 0, 'frames_total': None}
+
+    # Status changes are always written, and so is progress after them
+    store.update('j1', status='running')
+    store.update('j1', status='succeeded', progress={'frames_done': 3, 'frames_total': 3})
+    assert store.get('j1')['progress'] == {'frames_done': 3, 'frames_total': 3}
+    assert list(bucket.objects) == ['jobs/j1.json']
+    assert store._written_at == {}
+
+
+def test_create_job_store(tmp_path):
+    assert isinstance(create_job_store('sqlite', str(tmp_path / 'jobs.db')), SQLiteJobStore)
+    assert isinstance(create_job_store('file', str(tmp_path / 'jobs')), LocalFileJobStore)
+
+    client = FakeStorageClient()
+    store = create_job_store('gcs', 'gs://jobs-bucket/analysis', storage_client=client)
+    assert isinstance(store, GCSJobStore)
+    assert store.bucket.name == 'jobs-bucket'
+    assert store.prefix == 'analysis'
+    assert create_job_store('gcs', 'gs://jobs-bucket', storage_client=client).prefix == 'analysis-jobs'
+
+    with pytest.raises(ValueError):
+        create_job_store('gcs', str(tmp_path), storage_client=client)
+    with pytest.raises(ValueError):
+        create_job_store('redis', 'localhost')
@@ -0,0 +1,565 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+import requests
+import torch
+from prometheus_client.parser import text_string_to_metric_families
+
+# Configure the app before importing it: no model download at import, no
+# result cache shared between tests and a private job database
+os.environ.setdefault('PRELOAD_MODEL', 'false')
+os.environ.setdefault('RESULT_CACHE_BACKEND', 'none')
+os.environ.setdefault('JOB_STORE_PATH', os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+
+import gcs_io
+import main
+from conftest import FakeStorageClient, make_detector
+from jobs import JobManager, SQLiteJobStore
+
+
+class ColorModel:
+    """Stand-in for an Ultralytics model that detects white squares as chairs and green ones as couches"""
+
+    names = {0: 'chair', 1: 'couch'}
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.input_shapes = set()
+
+    def __call__(self, inputs, conf=0.25, classes=None, **options):
+        self.batch_sizes.append(len(inputs))
+        self.input_shapes.update(image.shape for image in inputs)
+        results = []
+        for image in inputs:
+            h, w = image.shape[:2]
+            b, g, r = (image[:, :, channel].astype(int) for channel in range(3))
+            boxes, class_ids, confidences = [], [], []
+            for class_id, mask in ((0, (b > 200) & (g > 200) & (r > 200)), (1, (g > 150) & (b < 100) & (r < 100))):
+                ys, xs = np.nonzero(mask)
+                if len(xs) == 0:
+                    continue
+                # Objects further right are detected with more confidence
+                confidence = 0.4 + 0.5 * xs.mean() / w
+                if confidence < conf or (classes is not None and class_id not in classes):
+                    continue
+                boxes.append([xs.min(), ys.min(), xs.max() + 1, ys.max() + 1])
+                class_ids.append(class_id)
+                confidences.append(confidence)
+            results.append(SimpleNamespace(
+                boxes=SimpleNamespace(
+                    xyxy=torch.tensor(boxes, dtype=torch.float32).reshape(-1, 4),
+                    cls=torch.tensor(class_ids, dtype=torch.float32),
+                    conf=torch.tensor(confidences, dtype=torch.float32)
+                ),
+                masks=None,
+                names=self.names
+            ))
+        return results
+
+
+def write_video(path, num_frames=96, size=(160, 120)):
+    """Write a video of a white square moving right and a green square moving down"""
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 24, size)
+    for i in range(num_frames):
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        x = i * (width - 30) // num_frames
+        frame[20:50, x:x + 30] = 255
+        y = i * (height - 24) // num_frames
+        frame[y:y + 24, 100:124] = (0, 255, 0)
+        writer.write(frame)
+    writer.release()
+
+
+def make_response(frame_data, upload_failed=0):
+    return {
+        'frame_data': frame_data,
+        'pipeline': {'upload': {'items': 4, 'failed': upload_failed}}
+    }
+
+
+def test_only_complete_results_are_cacheable():
+    frames = [{'frame_number': 0, 'objects': []}, {'frame_number': 20, 'objects': []}]
+    assert main.is_complete_result(make_response(frames))
+
+    failed_frame = frames + [{'frame_number': 40, 'error': 'Inference failed: out of memory'}]
+    assert not main.is_complete_result(make_response(failed_frame))
+    assert not main.is_complete_result(make_response(frames, upload_failed=1))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv('API_KEY', 'test-key')
+    return main.app.test_client()
+
+
+@pytest.fixture
+def batch_jobs(monkeypatch, tmp_path):
+    """Run batch jobs with a stand-in for run_video_analysis that blocks on slow.mp4 until released"""
+    release = threading.Event()
+
+    def runner(params, progress_callback=None):
+        if params['video_uri'].endswith('slow.mp4'):
+            release.wait(10)
+        return {'video_uri': params['video_uri']}, 200
+
+    manager = JobManager(SQLiteJobStore(str(tmp_path / 'jobs.db')), runner, max_workers=2)
+    monkeypatch.setattr(main, 'job_manager', manager)
+    monkeypatch.setattr(main, 'get_model', lambda include_masks=False: None)
+    yield release
+    release.set()
+
+
+def test_batches_are_async_by_default(client, batch_jobs):
+    batch_jobs.set()
+    response = client.post('/analyze_videos', json={'videos': ['gs://b/a.mp4', 'gs://b/b.mp4']},
+                           headers={'x-api-key': 'test-key'})
+
+    assert response.status_code == 202
+    videos = response.get_json()['videos']
+    assert [video['video_uri'] for video in videos] == ['gs://b/a.mp4', 'gs://b/b.mp4']
+    assert all(video['status_url'] == f"/jobs/{video['job_id']}" for video in videos)
+
+
+def test_sync_batches_return_unfinished_videos_after_the_wait_limit(client, batch_jobs, monkeypatch):
+    monkeypatch.setattr(main, 'BULK_WAIT_SECONDS', 0.5)
+    response = client.post('/analyze_videos', json={'videos': ['gs://b/fast.mp4', 'gs://b/slow.mp4'],
+                                                    'async': False},
+                           headers={'x-api-key': 'test-key'})
+
+    assert response.status_code == 202
+    body = response.get_json()
+    assert (body['succeeded'], body['failed'], body['pending']) == (1, 0, 1)
+    fast, slow = body['videos']
+    assert fast['result'] == {'video_uri': 'gs://b/fast.mp4'}
+    assert slow['status'] in ('queued', 'running')
+    assert slow['status_url'] == f"/jobs/{slow['job_id']}"
+
+    batch_jobs.set()
+    main.job_manager.wait([slow['job_id']])
+    job = client.get(slow['status_url'], headers={'x-api-key': 'test-key'}).get_json()
+    assert job['status'] == 'succeeded'
+
+
+def test_sync_batches_return_every_result(client, batch_jobs):
+    batch_jobs.set()
+    response = client.post('/analyze_videos', json={'videos': ['gs://b/a.mp4', 'gs://b/b.mp4'], 'async': False},
+                           headers={'x-api-key': 'test-key'})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body['succeeded'], body['failed'], body['pending']) == (2, 0, 0)
+    assert [video['result'] for video in body['videos']] == [{'video_uri': 'gs://b/a.mp4'},
+                                                            {'video_uri': 'gs://b/b.mp4'}]
+
+
+@pytest.fixture
+def storage(monkeypatch, tmp_path):
+    """Serve a test video from a fake GCS bucket and keep uploaded crops in memory"""
+    client = FakeStorageClient()
+    path = str(tmp_path / 'room.avi')
+    write_video(path)
+    with open(path, 'rb') as f:
+        client.bucket('videos').objects['room.avi'] = f.read()
+    monkeypatch.setattr(gcs_io, '_client', client)
+    return client
+
+
+@pytest.fixture
+def detector(monkeypatch):
+    yolo = make_detector(ColorModel())
+    monkeypatch.setattr(main, 'get_model', lambda include_masks=False: yolo)
+    # Long enough videos are split in processes or across peers: keep the
+    # runs in this process and split the test video in two
+    monkeypatch.setattr(main, 'SHARD_WORKERS', 1)
+    monkeypatch.setattr(main, 'SHARD_MIN_SAMPLES', 4)
+    return yolo
+
+
+def analyze(**data):
+    params, error = main.parse_analyze_request(dict({'video_uri': 'gs://videos/room.avi', 'frame_interval': 4}, **data))
+    assert error is None
+    response, status_code = main.run_video_analysis(params)
+    assert status_code == 200, response
+    return response
+
+
+def without_session(response, storage):
+    """Replace the random processing session id in a response and in the crop paths"""
+    unique_id = response['processed_images_bucket'].split('/')[-1][:-len('-processed-images')]
+    results = json.loads(json.dumps(
+        {key: response[key] for key in ('frame_data', 'object_categories', 'total_objects_detected')}
+    ).replace(unique_id, 'session'))
+    uploads = sorted(name.replace(unique_id, 'session') for name in storage.bucket('videos').objects
+                     if unique_id in name)
+    return results, uploads
+
+
+class PeerRequests:
+    """Stand-in for requests.post that sends /analyze_segment calls to this app, failing some of them"""
+
+    def __init__(self, client, failures=None):
+        self.client = client
+        self.failures = dict(failures or {})
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        peer_url, _, path = url.rpartition('/')
+        with self.lock:
+            self.calls.append((peer_url, json['first_sample_index']))
+            if self.failures.get(peer_url, 0) > 0:
+                self.failures[peer_url] -= 1
+                raise requests.ConnectionError(f"{peer_url} is unreachable")
+        response = self.client.post(f"/{path}", json=json, headers=headers)
+        return SimpleNamespace(status_code=response.status_code, text=response.get_data(as_text=True),
+                               json=response.get_json)
+
+
+def test_coordinator_merges_segments_like_a_single_instance(client, storage, detector, monkeypatch):
+    single = analyze()
+    assert single['sampling'].get('segments') is None
+    assert single['total_objects_detected'] > 0
+
+    peers = PeerRequests(client)
+    monkeypatch.setattr(main.requests, 'post', peers.post)
+    monkeypatch.setattr(main, 'PEER_URLS', ['http://peer-a', 'http://peer-b'])
+    distributed = analyze()
+
+    assert distributed['sampling']['segments'] == 2
+    assert sorted(peer for peer, _ in peers.calls) == ['http://peer-a', 'http://peer-b']
+    assert without_session(distributed, storage) == without_session(single, storage)
+    assert distributed['total_frames_processed'] == single['total_frames_processed'] == 24
+
+
+def test_coordinator_retries_failed_segments_on_another_peer(client, storage, detector, monkeypatch):
+    single = analyze()
+
+    peers = PeerRequests(client, failures={'http://peer-b': 1})
+    monkeypatch.setattr(main.requests, 'post', peers.post)
+    monkeypatch.setattr(main, 'PEER_URLS', ['http://peer-a', 'http://peer-b'])
+    distributed = analyze()
+
+    second_segment = [peer for peer, first_sample_index in peers.calls if first_sample_index > 0]
+    assert second_segment == ['http://peer-b', 'http://peer-a']
+    assert without_session(distributed, storage) == without_session(single, storage)
+
+
+def test_coordinator_gives_up_after_segment_attempts(client, storage, detector, monkeypatch):
+    peers = PeerRequests(client, failures={'http://peer-a': 10, 'http://peer-b': 10})
+    monkeypatch.setattr(main.requests, 'post', peers.post)
+    monkeypatch.setattr(main, 'PEER_URLS', ['http://peer-a', 'http://peer-b'])
+    monkeypatch.setattr(main, 'SEGMENT_ATTEMPTS', 3)
+    params, _ = main.parse_analyze_request({'video_uri': 'gs://videos/room.avi', 'frame_interval': 4})
+
+    response, status_code = main.run_video_analysis(params)
+
+    assert status_code == 500
+    first_segment = [peer for peer, first_sample_index in peers.calls if first_sample_index == 0]
+    assert first_segment == ['http://peer-a', 'http://peer-b', 'http://peer-a']
+
+
+def test_segment_attempts_share_the_segment_timeout(client, storage, detector, monkeypatch):
+    timeouts = []
+
+    def slow_peer(url, json=None, headers=None, timeout=None):
+        timeouts.append(timeout)
+        time.sleep(0.3)
+        raise requests.Timeout(f"{url} timed out")
+
+    monkeypatch.setattr(main.requests, 'post', slow_peer)
+    monkeypatch.setattr(main, 'PEER_URLS', ['http://peer-a', 'http://peer-b'])
+    monkeypatch.setattr(main, 'SEGMENT_ATTEMPTS', 3)
+    monkeypatch.setattr(main, 'SEGMENT_TIMEOUT', 0.5)
+    params, _ = main.parse_analyze_request({'video_uri': 'gs://videos/room.avi', 'frame_interval': 4})
+
+    response, status_code = main.run_video_analysis(params)
+
+    assert status_code == 500
+    # Two segments, each tried once with the whole timeout and once with what was left of it
+    assert len(timeouts) == 4
+    assert all(0 < timeout <= 0.5 for timeout in timeouts)
+    assert sum(timeout < 0.3 for timeout in timeouts) == 2
+
+
+def test_sharded_runs_match_a_single_process(storage, detector, monkeypatch):
+    single = analyze()
+    assert single['sampling'].get('shards') is None
+    assert single['total_objects_detected'] > 0
+
+    # Threads stand in for the spawned worker processes and share the fake model
+    pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(main, 'get_shard_pool', lambda: pool)
+    monkeypatch.setattr(main, 'SHARD_WORKERS', 2)
+    try:
+        sharded = analyze(workers=2)
+    finally:
+        pool.shutdown()
+
+    assert sharded['sampling']['shards'] == 2
+    assert without_session(sharded, storage) == without_session(single, storage)
+    assert sharded['total_frames_processed'] == single['total_frames_processed'] == 24
+
+
+def test_requests_are_not_sharded_by_default(storage, detector, monkeypatch):
+    monkeypatch.setattr(main, 'get_shard_pool', lambda: pytest.fail('the video was sharded'))
+    monkeypatch.setattr(main, 'SHARD_WORKERS', 2)
+
+    assert main.parse_analyze_request({'video_uri': 'gs://videos/room.avi'})[0]['workers'] == 1
+    assert analyze()['sampling'].get('shards') is None
+
+
+def test_streaming_errors_are_server_errors(storage, detector, monkeypatch):
+    def fail(blob, extension):
+        raise ConnectionError('connection reset')
+
+    monkeypatch.setattr(main, 'is_streamable', fail)
+    params, _ = main.parse_analyze_request({'video_uri': 'gs://videos/room.avi', 'ingest': 'stream'})
+
+    response, status_code = main.run_video_analysis(params)
+
+    assert status_code == 500
+    assert response['error'] == 'Could not stream video'
+    assert 'connection reset' in response['details']
+
+
+def post_streamed(client, stream_format, **data):
+    return client.post('/analyze_video', headers={'x-api-key': 'test-key'},
+                       json=dict({'video_uri': 'gs://videos/room.avi', 'frame_interval': 4,
+                                  'stream_results': stream_format}, **data))
+
+
+def read_ndjson(response):
+    return [json.loads(line) for line in b''.join(response.iter_encoded()).decode().splitlines()]
+
+
+def read_sse(response):
+    events = []
+    for message in b''.join(response.iter_encoded()).decode().split('\n\n'):
+        if message:
+            event_line, data_line = message.split('\n')
+            assert event_line.startswith('event: ') and data_line.startswith('data: ')
+            events.append(dict(json.loads(data_line[len('data: '):]), event=event_line[len('event: '):]))
+    return events
+
+
+@pytest.mark.parametrize('stream_format, mimetype, read', [
+    ('ndjson', 'application/x-ndjson', read_ndjson),
+    ('sse', 'text/event-stream', read_sse)
+])
+def test_streamed_results_end_with_a_summary(client, storage, detector, stream_format, mimetype, read):
+    expected = analyze()
+
+    response = post_streamed(client, stream_format)
+
+    assert response.status_code == 200
+    assert response.mimetype == mimetype
+    events = read(response)
+    assert [event['event'] for event in events] == ['frame'] * 24 + ['summary']
+    frames, summary = events[:-1], events[-1]
+    assert [frame['frame_number'] for frame in frames] == [frame['frame_number'] for frame in expected['frame_data']]
+    assert sum(len(frame['objects']) for frame in frames) == expected['total_objects_detected']
+    assert summary['status_code'] == 200
+    assert 'frame_data' not in summary
+    assert summary['total_objects_detected'] == expected['total_objects_detected']
+    assert sorted(summary['object_categories']) == sorted(expected['object_categories'])
+
+
+def test_streamed_results_end_with_an_error_event(client, storage, detector):
+    response = post_streamed(client, 'ndjson', video_uri='gs://videos/missing.avi')
+
+    assert response.status_code == 200
+    assert read_ndjson(response) == [{'event': 'error', 'error': 'Video file not found', 'status_code': 404}]
+
+
+def test_streamed_analysis_failures_end_with_an_error_event(client, storage, detector, monkeypatch):
+    def fail(params, frame_callback=None):
+        frame_callback({'frame_number': 0, 'objects': []})
+        raise MemoryError('out of memory')
+
+    monkeypatch.setattr(main, 'run_video_analysis', fail)
+
+    events = read_sse(post_streamed(client, 'sse'))
+
+    assert [event['event'] for event in events] == ['frame', 'error']
+    assert events[1]['status_code'] == 500
+    assert events[1]['details'] == 'out of memory'
+
+
+def test_client_disconnects_cancel_the_streamed_analysis(client, storage, detector, monkeypatch):
+    monkeypatch.setattr(main, 'STREAM_QUEUE_SIZE', 1)
+    response = post_streamed(client, 'ndjson', batch_size=1)
+    chunks = response.iter_encoded()
+    assert json.loads(next(chunks))['event'] == 'frame'
+
+    response.close()
+
+    analysis = next(thread for thread in threading.enumerate() if thread.name == 'stream-analysis')
+    analysis.join(10)
+    assert not analysis.is_alive()
+    # The analysis stopped after the frames that were queued when the client left
+    assert len(detector.model.batch_sizes) < 24
+
+
+def scrape_metrics(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    return {(sample.name, tuple(sorted(sample.labels.items()))): sample.value
+            for family in text_string_to_metric_families(response.get_data(as_text=True))
+            for sample in family.samples}
+
+
+def test_metrics_count_the_work_of_an_analysis(client, storage, detector):
+    before = scrape_metrics(client)
+
+    response = client.post('/analyze_video', json={'video_uri': 'gs://videos/room.avi', 'frame_interval': 4},
+                           headers={'x-api-key': 'test-key'})
+    assert response.status_code == 200
+    body = response.get_json()
+    after = scrape_metrics(client)
+
+    def increase(name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        return after.get(key, 0) - before.get(key, 0)
+
+    uploads = sum(1 for frame in body['frame_data'] for detection in frame['objects'] if detection.get('gcs_path'))
+    assert uploads > 0
+    assert increase('video_frames_total', state='inferred') == 24
+    assert increase('video_frames_total', state='decoded') >= 24
+    assert increase('video_download_bytes_total') == len(storage.bucket('videos').objects['room.avi'])
+    assert increase('video_download_seconds_count') == 1
+    assert increase('detections_per_frame_count') == 24
+    assert increase('detections_per_frame_sum') == body['total_objects_detected']
+    assert increase('pipeline_stage_seconds_count', stage='inference') == len(detector.model.batch_sizes)
+    assert increase('pipeline_stage_seconds_count', stage='encode') == uploads
+    assert increase('pipeline_stage_seconds_count', stage='upload') == uploads
+
+
+def test_timings_report_the_time_spent_per_stage(storage, detector):
+    response = analyze(include_timings=True)
+
+    timings = response['timings']
+    assert set(timings) == {'download_seconds', 'download_bytes', 'probe_seconds', 'decode_seconds',
+                            'inference_seconds', 'encode_seconds', 'upload_seconds', 'frames_decoded',
+                            'frames_inferred', 'total_seconds'}
+    assert timings['download_bytes'] == len(storage.bucket('videos').objects['room.avi'])
+    assert timings['frames_inferred'] == response['total_frames_processed'] == 24
+    assert timings['frames_decoded'] >= 24
+    stage_seconds = [timings[key] for key in ('download_seconds', 'probe_seconds', 'decode_seconds',
+                                              'inference_seconds', 'encode_seconds', 'upload_seconds')]
+    assert all(seconds >= 0 for seconds in stage_seconds)
+    # The pipeline stage times are summed over their threads, only download and probe are sequential
+    assert timings['total_seconds'] >= timings['download_seconds'] + timings['probe_seconds']
+    assert 'timings' not in analyze()
+
+
+def test_only_categories_with_their_own_threshold_count_dropped_detections(storage, detector):
+    # Couches are detected with a confidence of about 0.75, chairs with 0.4 to 0.9
+    lowered = analyze(confidence_threshold=0.8, category_thresholds={'couch': 0.45})
+
+    assert lowered['category_filter']['dropped'] == {}
+    assert len(lowered['object_categories']['couch']) == 24
+    assert all(entry['confidence'] >= 0.8 for entry in lowered['object_categories']['chair'])
+
+    raised = analyze(confidence_threshold=0.5, category_thresholds={'couch': 0.76})
+
+    assert raised['category_filter']['dropped'] == {'couch': 24}
+    assert raised['category_filter']['total_dropped'] == 24
+    assert 'couch' not in raised['object_categories']
+
+
+def test_categories_outside_the_allowlist_are_counted_as_excluded(storage, detector, monkeypatch):
+    chairs = analyze(categories=['chair'])
+
+    assert list(chairs['object_categories']) == ['chair']
+    assert chairs['category_filter']['excluded'] == {'couch': 24}
+    assert chairs['category_filter']['total_excluded'] == 24
+    assert chairs['category_filter']['dropped'] == {}
+
+    # Couches below their own threshold would not have been kept anyway
+    strict = analyze(categories=['chair'], category_thresholds={'couch': 0.8})
+    assert strict['category_filter']['excluded'] == {}
+
+    pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(main, 'get_shard_pool', lambda: pool)
+    monkeypatch.setattr(main, 'SHARD_WORKERS', 2)
+    try:
+        sharded = analyze(categories=['chair'], workers=2)
+    finally:
+        pool.shutdown()
+    assert sharded['sampling']['shards'] == 2
+    assert sharded['category_filter'] == chairs['category_filter']
+
+
+@pytest.mark.parametrize('field, value', [
+    ('batch_size', 0),
+    ('batch_size', main.MAX_BATCH_SIZE + 1),
+    ('batch_size', 2.5),
+    ('batch_size', '8'),
+    ('batch_size', True),
+    ('frame_interval', 0),
+    ('frame_interval', -20),
+    ('frame_interval', main.MAX_FRAME_INTERVAL + 1),
+    ('frame_interval', None),
+    ('frame_interval', True),
+    ('frame_interval', False)
+])
+def test_batch_size_and_frame_interval_are_validated(field, value):
+    params, error = main.parse_analyze_request({'video_uri': 'gs://videos/room.avi', field: value})
+
+    assert params is None
+    assert error[1] == 400
+    assert field in error[0]['error']
+
+
+@pytest.mark.parametrize('field', ['use_cache', 'include_timings', 'distribute'])
+@pytest.mark.parametrize('value', [1, 'false', None])
+def test_flags_must_be_booleans(field, value):
+    params, error = main.parse_analyze_request({'video_uri': 'gs://videos/room.avi', field: value})
+
+    assert params is None
+    assert error == ({'error': f"{field} must be true or false"}, 400)
+
+
+def test_batched_and_unbatched_runs_find_the_same_objects(storage, detector):
+    unbatched = analyze(batch_size=1)
+    assert detector.model.batch_sizes == [1] * 24
+
+    detector.model.batch_sizes.clear()
+    batched = analyze(batch_size=5)
+    assert detector.model.batch_sizes == [5, 5, 5, 5, 4]
+
+    assert without_session(batched, storage) == without_session(unbatched, storage)
+    assert batched['total_objects_detected'] > 0
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is not installed')
+@pytest.mark.parametrize('decoder', ['opencv', 'ffmpeg'])
+def test_rotated_videos_report_the_decoded_frame_size(storage, detector, tmp_path, decoder):
+    source = str(tmp_path / 'room.avi')
+    write_video(source)
+    path = str(tmp_path / 'portrait.mp4')
+    # Stored as 160x120 and displayed rotated by 90 degrees
+    subprocess.run(['ffmpeg', '-v', 'error', '-display_rotation', '90', '-i', source, '-c', 'copy', path],
+                   check=True)
+    with open(path, 'rb') as f:
+        storage.bucket('videos').objects['portrait.mp4'] = f.read()
+
+    response = analyze(video_uri='gs://videos/portrait.mp4', imgsz=64, decoder=decoder)
+
+    assert response['inference_size'] == {'imgsz': 64, 'downscale': True, 'frame_width': 120, 'frame_height': 160,
+                                          'input_width': 48, 'input_height': 64}
+    assert detector.model.input_shapes == {(64, 48, 3)}
+    boxes = [detection['bbox'] for frame in response['frame_data'] for detection in frame['objects']]
+    assert boxes and all(box['x2'] <= 120 and box['y2'] <= 160 for box in boxes)
@@ -0,0 +1,118 @@
+import itertools
+import threading
+
+import pytest
+
+from pipeline import PipelineStage
+
+
+class Resource:
+    """Records on which thread it was released"""
+
+    def __init__(self):
+        self.released_by = None
+        self.released = threading.Event()
+
+    def release(self):
+        self.released_by = threading.current_thread().name
+        self.released.set()
+
+
+def test_stages_pass_items_in_order():
+    decode = PipelineStage('decode', iter(range(20)))
+    infer = PipelineStage('infer', decode, lambda item: item * 2)
+
+    assert list(infer) == [item * 2 for item in range(20)]
+    assert decode.stats()['items'] == infer.stats()['items'] == 20
+
+
+def test_errors_in_fn_are_raised_in_the_consumer():
+    def fail_on_three(item):
+        if item == 3:
+            raise ValueError('bad frame')
+        return item
+
+    stage = PipelineStage('infer', iter(range(10)), fail_on_three)
+    received = []
+
+    with pytest.raises(ValueError, match='bad frame'):
+        for item in stage:
+            received.append(item)
+    assert received == [0, 1, 2]
+
+
+def test_errors_in_the_source_reach_the_last_stage():
+    def frames():
+        yield 0
+        raise IOError('decoder crashed')
+
+    decode = PipelineStage('decode', frames())
+    infer = PipelineStage('infer', decode, lambda item: item)
+
+    with pytest.raises(IOError, match='decoder crashed'):
+        list(infer)
+
+
+def test_close_cancels_upstream_stages():
+    decoded = []
+
+    def frames():
+        for item in itertools.count():
+            decoded.append(item)
+            yield item
+
+    resource = Resource()
+    decode = PipelineStage('decode', frames(), maxsize=1, on_stop=resource.release)
+    infer = PipelineStage('infer', decode, lambda item: item, maxsize=1)
+    assert next(iter(infer)) == 0
+
+    infer.close()
+
+    assert not infer._thread.is_alive()
+    assert not decode._thread.is_alive()
+    assert resource.released_by == 'pipeline-decode'
+    # Only as many items as fit in the queues were decoded ahead
+    assert len(decoded) < 10
+
+
+def test_on_stop_runs_before_the_consumer_sees_the_end():
+    resource = Resource()
+    stage = PipelineStage('decode', iter(range(3)), on_stop=resource.release)
+
+    assert list(stage) == [0, 1, 2]
+    assert resource.released.is_set()
+
+
+def test_on_stop_runs_after_a_failure():
+    def frames():
+        raise IOError('unreadable')
+        yield
+
+    resource = Resource()
+    stage = PipelineStage('decode', frames(), on_stop=resource.release)
+
+    with pytest.raises(IOError):
+        list(stage)
+    assert resource.released_by == 'pipeline-decode'
+
+
+def test_on_stop_runs_when_the_stage_stops_after_close_gave_up():
+    unblock = threading.Event()
+
+    def frames():
+        yield 0
+        # A decoder stuck reading the next frame
+        unblock.wait(10)
+        yield 1
+
+    resource = Resource()
+    stage = PipelineStage('decode', frames(), on_stop=resource.release)
+    assert next(iter(stage)) == 0
+
+    stage.close(timeout=0.3)
+    assert stage._thread.is_alive()
+    assert not resource.released.is_set()
+
+    unblock.set()
+    assert resource.released.wait(5)
+    assert resource.released_by == 'pipeline-decode'
@@ -0,0 +1,130 @@
+import json
+import os
+
+import pytest
+
+from conftest import FakeBucket, FakeStorageClient
+from result_cache import GCSManifestCache, LocalDiskLRUCache, ResultCache, create_result_cache, make_cache_key
+
+
+KEY_ARGS = {
+    'bucket_name': 'videos',
+    'blob_name': 'a/video.mp4',
+    'generation': 1700000000000000,
+    'etag': 'CJ2f',
+    'model_identity': 'yolov8n.pt:3f2a',
+    'params': {'frame_interval': 20, 'confidence_threshold': 0.5, 'padding': 10}
+}
+
+
+def test_cache_key_changes_with_every_input():
+    key = make_cache_key(**KEY_ARGS)
+    assert make_cache_key(**KEY_ARGS) == key
+
+    changes = {
+        'bucket_name': 'other-videos',
+        'blob_name': 'a/other.mp4',
+        'generation': 1700000000000001,
+        'etag': 'CJ2g',
+        'model_identity': 'yolov8n.onnx:int8:3f2a'
+    }
+    for name, value in changes.items():
+        assert make_cache_key(**dict(KEY_ARGS, **{name: value})) != key, name
+
+    for name, value in (('frame_interval', 10), ('confidence_threshold', 0.4), ('padding', 0),
+                        ('include_masks', True)):
+        params = dict(KEY_ARGS['params'], **{name: value})
+        assert make_cache_key(**dict(KEY_ARGS, params=params)) != key, name
+
+
+def test_cache_key_ignores_param_order():
+    reordered = dict(reversed(list(KEY_ARGS['params'].items())))
+    assert make_cache_key(**dict(KEY_ARGS, params=reordered)) == make_cache_key(**KEY_ARGS)
+
+
+def test_result_cache_backends_must_implement_get_and_put():
+    class GetOnlyCache(ResultCache):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        ResultCache()
+    with pytest.raises(TypeError):
+        GetOnlyCache()
+
+
+def test_disk_cache_round_trip(tmp_path):
+    cache = LocalDiskLRUCache(str(tmp_path / 'cache'))
+    response = {'video_uri': 'gs://videos/a/video.mp4', 'frame_data': [{'frame_number': 0}]}
+
+    assert cache.get('k1') is None
+    cache.put('k1', response)
+    assert cache.get('k1') == response
+    assert cache.get('k2') is None
+
+
+def test_disk_cache_discards_corrupt_entries(tmp_path):
+    cache = LocalDiskLRUCache(str(tmp_path))
+    (tmp_path / 'k1.json').write_text('{"truncated": ')
+
+    assert cache.get('k1') is None
+    assert not (tmp_path / 'k1.json').exists()
+
+
+def test_disk_cache_evicts_least_recently_used_entries(tmp_path):
+    payload = {'data': 'x' * 1000}
+    entry_size = len(json.dumps(payload))
+    cache = LocalDiskLRUCache(str(tmp_path), max_bytes=3 * entry_size)
+    for age, key in enumerate(('a', 'b', 'c')):
+        cache.put(key, payload)
+        # Spread the LRU timestamps beyond the file system's mtime resolution
+        os.utime(tmp_path / f"{key}.json", (1000 + age, 1000 + age))
+
+    # Reading 'a' makes 'b' the least recently used entry
+    assert cache.get('a') == payload
+    cache.put('d', payload)
+
+    assert sorted(os.listdir(tmp_path)) == ['a.json', 'c.json', 'd.json']
+    assert cache.get('b') is None
+    total = sum(os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path))
+    assert total <= cache.max_bytes
+
+
+def test_disk_cache_drops_entries_larger_than_the_cache(tmp_path):
+    cache = LocalDiskLRUCache(str(tmp_path), max_bytes=100)
+    cache.put('big', {'data': 'x' * 1000})
+
+    assert cache.get('big') is None
+
+
+def test_gcs_cache_round_trip():
+    bucket = FakeBucket()
+    cache = GCSManifestCache(bucket, prefix='analysis-cache/')
+    response = {'video_uri': 'gs://videos/a/video.mp4', 'total_objects_detected': 3}
+
+    assert cache.get('k1') is None
+    cache.put('k1', response)
+    assert list(bucket.objects) == ['analysis-cache/k1.json']
+    assert cache.get('k1') == response
+
+
+def test_create_result_cache(tmp_path):
+    assert create_result_cache('none', '') is None
+
+    disk = create_result_cache('disk', str(tmp_path), max_bytes=1234)
+    assert isinstance(disk, LocalDiskLRUCache)
+    assert disk.max_bytes == 1234
+
+    client = FakeStorageClient()
+    gcs = create_result_cache('gcs', 'gs://cache-bucket/results', storage_client=client)
+    assert isinstance(gcs, GCSManifestCache)
+    assert gcs.bucket.name == 'cache-bucket'
+    assert gcs.prefix == 'results'
+    gcs.put('k1', {'ok': True})
+    assert client.buckets['cache-bucket'].objects['results/k1.json'] == b'{"ok": true}'
+
+    assert create_result_cache('gcs', 'gs://cache-bucket', storage_client=client).prefix == 'analysis-cache'
+    with pytest.raises(ValueError):
+        create_result_cache('gcs', '/tmp/cache', storage_client=client)
+    with pytest.raises(ValueError):
+        create_result_cache('redis', 'localhost')
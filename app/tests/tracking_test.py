@@ -0,0 +1,139 @@
+import numpy as np
+
+from tracking import IoUTracker, box_iou
+
+
+def make_detection(x1, y1, x2, y2, category_name='chair', confidence=0.9, object_id=0):
+    return {
+        'object_id': object_id,
+        'category_name': category_name,
+        'confidence': confidence,
+        'bbox': {'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2, 'width': x2 - x1, 'height': y2 - y1},
+        'cropped_image': np.full((y2 - y1, x2 - x1, 3), object_id, dtype=np.uint8)
+    }
+
+
+def test_box_iou():
+    a = {'x1': 0, 'y1': 0, 'x2': 10, 'y2': 10}
+
+    assert box_iou(a, a) == 1.0
+    assert box_iou(a, {'x1': 5, 'y1': 0, 'x2': 15, 'y2': 10}) == 50 / 150
+    assert box_iou(a, {'x1': 10, 'y1': 0, 'x2': 20, 'y2': 10}) == 0.0
+
+
+def test_overlapping_detections_of_the_same_category_continue_a_track():
+    tracker = IoUTracker(iou_threshold=0.3)
+
+    ids, _ = tracker.update(0, [make_detection(0, 0, 40, 40), make_detection(100, 0, 140, 40, 'couch')])
+    assert ids == [0, 1]
+
+    # The chair moved a little, the couch is gone and a chair appeared where the couch was
+    ids, finished = tracker.update(10, [make_detection(100, 0, 140, 40), make_detection(5, 5, 45, 45)])
+    assert ids == [2, 0]
+    assert finished == []
+
+
+def test_each_track_is_matched_to_its_best_detection_once():
+    tracker = IoUTracker(iou_threshold=0.3)
+    tracker.update(0, [make_detection(0, 0, 40, 40), make_detection(30, 0, 70, 40)])
+
+    ids, _ = tracker.update(10, [make_detection(28, 0, 68, 40), make_detection(2, 0, 42, 40)])
+
+    assert ids == [1, 0]
+
+
+def test_tracks_end_after_max_age_missed_frames():
+    tracker = IoUTracker(max_age=2)
+    tracker.update(0, [make_detection(0, 0, 40, 40)])
+
+    assert tracker.update(10, [])[1] == []
+    assert tracker.update(20, [])[1] == []
+    _, finished = tracker.update(30, [])
+    assert [track['track_id'] for track in finished] == [0]
+    assert finished[0]['first_frame'] == finished[0]['last_frame'] == 0
+
+    # The object coming back afterwards is a new track
+    ids, _ = tracker.update(40, [make_detection(0, 0, 40, 40)])
+    assert ids == [1]
+
+
+def test_tracks_survive_fewer_than_max_age_missed_frames():
+    tracker = IoUTracker(max_age=2)
+    tracker.update(0, [make_detection(0, 0, 40, 40)])
+    tracker.update(10, [])
+    tracker.update(20, [])
+
+    ids, finished = tracker.update(30, [make_detection(0, 0, 40, 40)])
+
+    assert ids == [0]
+    assert finished == []
+    track = tracker.finish()[0]
+    assert (track['first_frame'], track['last_frame'], track['detections'], track['missed']) == (0, 30, 2, 0)
+    assert tracker.finish() == []
+
+
+def test_moving_objects_are_matched_at_their_predicted_position():
+    tracker = IoUTracker(iou_threshold=0.3, max_age=3)
+    tracker.update(0, [make_detection(0, 0, 40, 40)])
+    tracker.update(10, [make_detection(20, 0, 60, 40)])
+    assert tracker._tracks[0]['velocity'] == {'x1': 2.0, 'y1': 0.0, 'x2': 2.0, 'y2': 0.0}
+
+    # After a missed frame the object no longer overlaps its last box, but it kept its speed
+    tracker.update(20, [])
+    moved = make_detection(60, 0, 100, 40)
+    assert box_iou(tracker._tracks[0]['bbox'], moved['bbox']) == 0.0
+    ids, _ = tracker.update(30, [moved])
+    assert ids == [0]
+
+    # A faster object drops out of its predicted box
+    ids, _ = tracker.update(40, [make_detection(110, 0, 150, 40)])
+    assert ids == [1]
+
+
+def test_stationary_boxes_are_not_extrapolated_before_a_second_sighting():
+    tracker = IoUTracker(iou_threshold=0.3)
+    tracker.update(0, [make_detection(0, 0, 40, 40)])
+
+    ids, _ = tracker.update(10, [make_detection(60, 0, 100, 40)])
+
+    assert ids == [1]
+
+
+def test_tracks_keep_the_best_crop():
+    tracker = IoUTracker()
+    for frame_number, confidence in ((0, 0.6), (10, 0.9), (20, 0.7)):
+        tracker.update(frame_number, [make_detection(0, 0, 40, 40, confidence=confidence, object_id=frame_number)])
+
+    crops = tracker.finish()[0]['crops']
+
+    assert [crop['frame_number'] for crop in crops] == [10]
+    assert crops[0]['confidence'] == 0.9
+    assert crops[0]['object_id'] == 10
+
+
+def test_tracks_keep_alternate_crops_by_confidence_then_size():
+    tracker = IoUTracker(alternates=2)
+    detections = [
+        make_detection(0, 0, 40, 40, confidence=0.6, object_id=1),
+        make_detection(0, 0, 40, 40, confidence=0.8, object_id=2),
+        make_detection(0, 0, 44, 44, confidence=0.8, object_id=3),
+        make_detection(0, 0, 40, 40, confidence=0.7, object_id=4),
+        make_detection(0, 0, 40, 40, confidence=0.5, object_id=5)
+    ]
+    for frame_number, detection in enumerate(detections):
+        tracker.update(frame_number * 10, [detection])
+
+    crops = tracker.finish()[0]['crops']
+
+    assert [crop['object_id'] for crop in crops] == [3, 2, 4]
+    assert [crop['cropped_image'].shape for crop in crops] == [(44, 44, 3), (40, 40, 3), (40, 40, 3)]
+
+
+def test_kept_crops_are_copies():
+    tracker = IoUTracker()
+    detection = make_detection(0, 0, 40, 40, object_id=7)
+    tracker.update(0, [detection])
+
+    detection['cropped_image'][:] = 0
+
+    assert tracker.finish()[0]['crops'][0]['cropped_image'].min() == 7
@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+import pytest
+
+import video_probe
+from video_probe import ProbeCache, probe_video
+
+
+@pytest.fixture
+def video_path(tmp_path):
+    path = str(tmp_path / 'clip.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25.0, (64, 48))
+    for i in range(50):
+        writer.write(np.full((48, 64, 3), i * 5, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def test_probe_with_pyav_finds_keyframes(video_path):
+    pytest.importorskip('av')
+    probe = probe_video(video_path)
+    assert probe['method'] == 'pyav'
+    assert probe['frame_count'] == 50
+    assert probe['fps'] == pytest.approx(25.0)
+    assert probe['duration_seconds'] == pytest.approx(2.0, abs=0.05)
+    assert (probe['width'], probe['height']) == (64, 48)
+    # MJPEG frames are all keyframes
+    assert probe['keyframes'] == list(range(50))
+
+
+def test_probe_falls_back_to_opencv(video_path, monkeypatch):
+    monkeypatch.setattr(video_probe, 'av', None)
+    probe = probe_video(video_path)
+    assert probe['method'] == 'opencv'
+    assert probe['frame_count'] == 50
+    assert probe['fps'] == pytest.approx(25.0)
+    assert probe['codec'] == 'mjpg'
+    assert probe['keyframes'] is None
+
+
+def test_probe_rejects_unreadable_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(video_probe, 'av', None)
+    path = tmp_path / 'broken.mp4'
+    path.write_bytes(b'not a video')
+    with pytest.raises(ValueError):
+        probe_video(str(path))
+
+
+def test_probe_cache_evicts_least_recently_used():
+    cache = ProbeCache(max_entries=2)
+    cache.put('a#1', {'fps': 1})
+    cache.put('b#1', {'fps': 2})
+    assert cache.get('a#1') == {'fps': 1}
+    cache.put('c#1', {'fps': 3})
+    assert cache.get('b#1') is None
+    assert cache.get('a#1') == {'fps': 1}
+    assert cache.get('c#1') == {'fps': 3}
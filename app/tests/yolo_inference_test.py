@@ -0,0 +1,282 @@
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+import torch
+
+import yolo_inference
+from conftest import make_detector
+from yolo_inference import ModelRegistry, YOLOInference, downscaled_size, export_model
+
+
+class RecordingModel:
+    """Stand-in for an Ultralytics model that finds one box in the middle of every input"""
+
+    names = {0: 'chair', 1: 'couch'}
+
+    def __init__(self, masks=False):
+        self.calls = []
+        self.masks = masks
+
+    def __call__(self, inputs, **options):
+        self.calls.append(([image.shape for image in inputs], options))
+        results = []
+        for image in inputs:
+            h, w = image.shape[:2]
+            boxes = SimpleNamespace(
+                xyxy=torch.tensor([[w / 4, h / 4, w / 2, h / 2]]),
+                cls=torch.tensor([0.0]),
+                conf=torch.tensor([0.9])
+            )
+            outline = np.array([[w / 4, h / 4], [w / 2, h / 4], [w / 2, h / 2]], dtype=np.float32)
+            masks = SimpleNamespace(xy=[outline]) if self.masks else None
+            results.append(SimpleNamespace(boxes=boxes, masks=masks, names={0: 'chair'}))
+        return results
+
+
+def test_downscaled_size_keeps_aspect_ratio():
+    assert downscaled_size(3840, 2160, 640) == (640, 360)
+    assert downscaled_size(1080, 1920, 640) == (360, 640)
+    assert downscaled_size(320, 240, 640) == (320, 240)
+
+
+def test_downscaled_frames_are_cropped_at_full_resolution():
+    yolo = make_detector(RecordingModel())
+    frame = np.random.default_rng(0).integers(0, 255, (2160, 3840, 3), dtype=np.uint8)
+
+    detections = yolo.detect_and_crop_frames([frame], padding=0, imgsz=640, downscale=True)[0]
+
+    input_shapes, options = yolo.model.calls[0]
+    assert input_shapes == [(360, 640, 3)]
+    assert options['imgsz'] == 640
+    bbox = detections[0]['bbox']
+    assert (bbox['x1'], bbox['y1'], bbox['x2'], bbox['y2']) == (960, 540, 1920, 1080)
+    assert np.array_equal(detections[0]['cropped_image'], frame[540:1080, 960:1920])
+
+
+def test_frames_are_passed_unchanged_without_downscale():
+    yolo = make_detector(RecordingModel())
+    frame = np.zeros((720, 1280, 3), dtype=np.uint8)
+
+    detections = yolo.detect_and_crop_frames([frame], padding=0, imgsz=640)[0]
+
+    assert yolo.model.calls[0][0] == [(720, 1280, 3)]
+    assert detections[0]['cropped_image_size'] == {'width': 320, 'height': 180}
+
+    assert 'mask' not in detections[0]
+
+
+def test_model_inputs_from_the_decoder_are_not_resized_again():
+    yolo = make_detector(RecordingModel())
+    frames = [np.zeros((2160, 3840, 3), dtype=np.uint8), np.zeros((2160, 3840, 3), dtype=np.uint8)]
+    decoded_input = np.zeros((360, 640, 3), dtype=np.uint8)
+
+    detections = yolo.detect_and_crop_frames(frames, padding=0, imgsz=640, downscale=True,
+                                             inputs=[decoded_input, None])
+
+    assert yolo.model.calls[0][0] == [(360, 640, 3), (360, 640, 3)]
+    for frame_detections in detections:
+        bbox = frame_detections[0]['bbox']
+        assert (bbox['x1'], bbox['y1'], bbox['x2'], bbox['y2']) == (960, 540, 1920, 1080)
+
+
+def test_mask_outlines_are_mapped_to_the_full_frame():
+    yolo = make_detector(RecordingModel(masks=True))
+    frame = np.zeros((2160, 3840, 3), dtype=np.uint8)
+
+    detections = yolo.detect_and_crop_frames([frame], imgsz=640, downscale=True)[0]
+
+    assert detections[0]['mask'] == [[960, 540], [1920, 540], [1920, 1080]]
+
+
+def test_categories_are_passed_to_the_model_as_class_ids():
+    yolo = make_detector(RecordingModel())
+    assert yolo.class_ids(['couch', 'chair']) == [1, 0]
+    with pytest.raises(ValueError, match='person'):
+        yolo.class_ids(['chair', 'person'])
+
+    yolo.detect_and_crop_frames([np.zeros((48, 64, 3), dtype=np.uint8)], classes=[1])
+    assert yolo.model.calls[0][1]['classes'] == [1]
+
+
+def synthetic_scene(seed):
+    rng = np.random.default_rng(seed)
+    frame = np.zeros((360, 640, 3), dtype=np.uint8)
+    for _ in range(12):
+        x, y = int(rng.integers(0, 600)), int(rng.integers(0, 330))
+        w, h = int(rng.integers(20, 200)), int(rng.integers(20, 150))
+        cv2.rectangle(frame, (x, y), (x + w, y + h), tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+    return frame
+
+
+@pytest.fixture(scope='module')
+def checkpoint(tmp_path_factory):
+    """An untrained YOLOv8n-seg checkpoint whose detections have distinct confidences
+
+    Untrained activations vanish before the head, so the batch norm
+    statistics are estimated on a few scenes and the class bias raised
+    until a few dozen boxes pass the threshold.
+    """
+    from ultralytics import YOLO
+    torch.manual_seed(0)
+    model = YOLO('yolov8n-seg.yaml')
+    for module in model.model.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            module.reset_running_stats()
+            module.momentum = None
+    model.model.train()
+    scenes = [cv2.resize(synthetic_scene(seed), (640, 384))[:, :, ::-1].copy() for seed in range(1, 9)]
+    with torch.no_grad():
+        model.model(torch.stack([torch.from_numpy(scene).permute(2, 0, 1).float() / 255 for scene in scenes]))
+    model.model.eval()
+    for branch in model.model.model[-1].cv3:
+        branch[-1].bias.data.add_(6.5)
+    path = str(tmp_path_factory.mktemp('weights') / 'test-seg.pt')
+    model.save(path)
+    return path
+
+
+def box_iou(a, b):
+    iw = max(0, min(a['x2'], b['x2']) - max(a['x1'], b['x1']))
+    ih = max(0, min(a['y2'], b['y2']) - max(a['y1'], b['y1']))
+    intersection = iw * ih
+    return intersection / (a['width'] * a['height'] + b['width'] * b['height'] - intersection)
+
+
+@pytest.mark.parametrize('backend,runtime', [('onnx', 'onnxruntime'), ('openvino', 'openvino')])
+def test_exported_backend_matches_torch(checkpoint, tmp_path, backend, runtime):
+    pytest.importorskip(runtime)
+    frame = synthetic_scene(0)
+    reference = YOLOInference(checkpoint).detect_and_crop_frames([frame], confidence_threshold=0.25)[0]
+    exported = YOLOInference(checkpoint, backend=backend, cache_dir=str(tmp_path))
+    detections = exported.detect_and_crop_frames([frame], confidence_threshold=0.2)[0]
+
+    strong = [detection for detection in reference if detection['confidence'] >= 0.35]
+    assert strong
+    for expected in strong:
+        matches = [
+            detection for detection in detections
+            if detection['category_id'] == expected['category_id'] and box_iou(detection['bbox'], expected['bbox']) >= 0.9
+        ]
+        assert matches, expected['bbox']
+        assert min(abs(match['confidence'] - expected['confidence']) for match in matches) <= 0.05
+    assert exported.model_identity == f"{YOLOInference(checkpoint).model_identity}:{backend}-fp32"
+
+
+@pytest.fixture
+def calibration_data(tmp_path):
+    images = tmp_path / 'calibration' / 'images'
+    images.mkdir(parents=True)
+    for seed in range(8):
+        cv2.imwrite(str(images / f'{seed}.jpg'), synthetic_scene(seed))
+    names = ''.join(f"  {i}: class{i}\n" for i in range(80))
+    path = tmp_path / 'calibration' / 'data.yaml'
+    path.write_text(f"path: {images.parent}\ntrain: images\nval: images\nnames:\n{names}")
+    return str(path)
+
+
+def test_int8_onnx_export_is_cached(checkpoint, calibration_data, tmp_path):
+    pytest.importorskip('onnxruntime')
+    cache_dir = str(tmp_path / 'models')
+    artifact, _, task = export_model(checkpoint, 'onnx', 'int8', cache_dir, calibration_data)
+    assert task == 'segment'
+    modified = os.path.getmtime(artifact)
+    assert export_model(checkpoint, 'onnx', 'int8', cache_dir, calibration_data)[0] == artifact
+    assert os.path.getmtime(artifact) == modified
+    assert os.listdir(cache_dir) == [os.path.basename(artifact)]
+
+    detections = YOLOInference(checkpoint, backend='onnx', precision='int8',
+                               cache_dir=cache_dir).detect_and_crop_frames([synthetic_scene(0)])[0]
+    assert all(detection['cropped_image'].size for detection in detections)
+
+
+def test_int8_needs_an_exported_backend():
+    with pytest.raises(ValueError):
+        YOLOInference('yolov8n-seg.pt', precision='int8')
+
+
+class SlowModel:
+    """Stand-in for YOLOInference whose loading blocks until its path is released"""
+
+    loads = []
+    released = {}
+
+    def __init__(self, model_path, **options):
+        SlowModel.loads.append(model_path)
+        SlowModel.released.setdefault(model_path, threading.Event()).wait(5)
+        self.model_path = model_path
+
+
+@pytest.fixture
+def slow_models(monkeypatch):
+    SlowModel.loads = []
+    SlowModel.released = {}
+    monkeypatch.setattr(yolo_inference, 'YOLOInference', SlowModel)
+    yield SlowModel.released
+    for event in SlowModel.released.values():
+        event.set()
+
+
+def test_registry_loads_each_model_once(slow_models):
+    registry = ModelRegistry()
+    slow_models['a.pt'] = threading.Event()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get('a.pt'))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+
+    time.sleep(0.2)
+    slow_models['a.pt'].set()
+    for thread in threads:
+        thread.join(5)
+
+    assert SlowModel.loads == ['a.pt']
+    assert len(results) == 4 and all(result is results[0] for result in results)
+    assert registry.stats()['a.pt']['reuse_count'] == 3
+
+
+def test_registry_serves_other_models_during_a_load(slow_models):
+    registry = ModelRegistry()
+    slow_models['loaded.pt'] = threading.Event()
+    slow_models['loaded.pt'].set()
+    loaded = registry.get('loaded.pt')
+    slow_models['slow.pt'] = threading.Event()
+    loading = threading.Thread(target=registry.get, args=('slow.pt',))
+    loading.start()
+    time.sleep(0.1)
+
+    # Neither a loaded model nor the load of another one waits for slow.pt
+    start = time.perf_counter()
+    assert registry.get('loaded.pt') is loaded
+    slow_models['other.pt'] = threading.Event()
+    slow_models['other.pt'].set()
+    assert registry.get('other.pt', backend='onnx').model_path == 'other.pt'
+    assert time.perf_counter() - start < 1
+    assert 'other.pt:onnx-fp32' in registry.stats()
+
+    slow_models['slow.pt'].set()
+    loading.join(5)
+    assert SlowModel.loads == ['loaded.pt', 'slow.pt', 'other.pt']
+    assert set(registry.stats()) == {'loaded.pt', 'slow.pt', 'other.pt:onnx-fp32'}
+
+
+def test_failed_loads_are_retried(monkeypatch):
+    attempts = []
+
+    def flaky_model(model_path, **options):
+        attempts.append(model_path)
+        if len(attempts) == 1:
+            raise IOError('download interrupted')
+        return SimpleNamespace(model_path=model_path)
+
+    monkeypatch.setattr(yolo_inference, 'YOLOInference', flaky_model)
+    registry = ModelRegistry()
+
+    with pytest.raises(IOError):
+        registry.get('a.pt')
+    assert registry.get('a.pt').model_path == 'a.pt'
+    assert attempts == ['a.pt', 'a.pt']
@@ -0,0 +1,156 @@
+from typing import Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+def box_iou(a: Dict, b: Dict) -> float:
+    """Intersection over union of two bboxes given as {'x1', 'y1', 'x2', 'y2'} dictionaries"""
+    width = min(a['x2'], b['x2']) - max(a['x1'], b['x1'])
+    height = min(a['y2'], b['y2']) - max(a['y1'], b['y1'])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    area_a = (a['x2'] - a['x1']) * (a['y2'] - a['y1'])
+    area_b = (b['x2'] - b['x1']) * (b['y2'] - b['y1'])
+    return intersection / float(area_a + area_b - intersection)
+
+class IoUTracker:
+    """Associate detections across sampled frames into tracks of one physical object
+    
+    Each detection is matched to the live track of the same category whose
+    predicted box overlaps it most (greedy, highest IoU first). Boxes are
+    predicted with the track's velocity between its last two sightings, so
+    objects drifting across the frame while the camera pans stay matched.
+    A track ends when it has not been matched for max_age sampled frames.
+    
+    Every track keeps its best crops (highest confidence, then largest) so
+    that only those have to be uploaded when the track ends.
+    """
+    
+    def __init__(self, iou_threshold: float = 0.3, max_age: int = 3, alternates: int = 0):
+        """Initialize the tracker
+        
+        Args:
+            iou_threshold: Minimum IoU between a detection and a track's predicted box
+            max_age: Number of consecutive sampled frames a track may go unmatched
+            alternates: Number of crops kept per track in addition to the best one
+        """
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.alternates = alternates
+        self._tracks: List[Dict] = []
+        self._next_id = 0
+    
+    def update(self, frame_number: int, detections: List[Dict]) -> Tuple[List[int], List[Dict]]:
+        """Assign the detections of the next sampled frame to tracks
+        
+        Args:
+            frame_number: Frame the detections come from, increasing between calls
+            detections: Detections from YOLOInference.detect_and_crop_frames
+        
+        Returns:
+            (track id for each detection, tracks that ended with this frame)
+        """
+        # Score every same-category (track, detection) pair and match greedily
+        candidates = []
+        for track_index, track in enumerate(self._tracks):
+            predicted = self._predict(track, frame_number)
+            for detection_index, detection in enumerate(detections):
+                if detection['category_name'] != track['category_name']:
+                    continue
+                iou = box_iou(predicted, detection['bbox'])
+                if iou >= self.iou_threshold:
+                    candidates.append((iou, track_index, detection_index))
+        
+        track_ids: List[Optional[int]] = [None] * len(detections)
+        matched_tracks = set()
+        for _, track_index, detection_index in sorted(candidates, reverse=True):
+            if track_index in matched_tracks or track_ids[detection_index] is not None:
+                continue
+            matched_tracks.add(track_index)
+            track = self._tracks[track_index]
+            self._observe(track, frame_number, detections[detection_index])
+            track_ids[detection_index] = track['track_id']
+        
+        # Unmatched detections start new tracks
+        for detection_index, detection in enumerate(detections):
+            if track_ids[detection_index] is None:
+                track = self._start(frame_number, detection)
+                track_ids[detection_index] = track['track_id']
+        
+        # Age the tracks that were not seen in this frame
+        finished = []
+        live = []
+        for track in self._tracks:
+            if track['last_frame'] != frame_number:
+                track['missed'] += 1
+            if track['missed'] > self.max_age:
+                finished.append(track)
+            else:
+                live.append(track)
+        self._tracks = live
+        
+        return track_ids, finished
+    
+    def finish(self) -> List[Dict]:
+        """End every live track, e.g. at the end of the video"""
+        finished = self._tracks
+        self._tracks = []
+        return finished
+    
+    def _start(self, frame_number: int, detection: Dict) -> Dict:
+        track = {
+            'track_id': self._next_id,
+            'category_name': detection['category_name'],
+            'first_frame': frame_number,
+            'last_frame': frame_number,
+            'bbox': detection['bbox'],
+            'velocity': None,
+            'missed': 0,
+            'detections': 0,
+            'crops': []
+        }
+        self._next_id += 1
+        self._tracks.append(track)
+        self._observe(track, frame_number, detection)
+        return track
+    
+    def _observe(self, track: Dict, frame_number: int, detection: Dict):
+        bbox = detection['bbox']
+        if track['detections'] > 0 and frame_number > track['last_frame']:
+            gap = frame_number - track['last_frame']
+            track['velocity'] = {
+                key: (bbox[key] - track['bbox'][key]) / gap
+                for key in ('x1', 'y1', 'x2', 'y2')
+            }
+        track['bbox'] = bbox
+        track['last_frame'] = frame_number
+        track['missed'] = 0
+        track['detections'] += 1
+        
+        # Keep the best crops. They are copied so the frame they were cut
+        # from can be freed.
+        bbox_area = bbox['width'] * bbox['height']
+        score = (detection['confidence'], bbox_area)
+        crops = track['crops']
+        if len(crops) <= self.alternates or score > crops[-1]['score']:
+            crops.append({
+                'score': score,
+                'frame_number': frame_number,
+                'object_id': detection['object_id'],
+                'confidence': detection['confidence'],
+                'bbox': bbox,
+                'cropped_image': detection['cropped_image'].copy()
+            })
+            crops.sort(key=lambda crop: crop['score'], reverse=True)
+            del crops[self.alternates + 1:]
+    
+    def _predict(self, track: Dict, frame_number: int) -> Dict:
+        """Extrapolate the track's box to frame_number"""
+        if track['velocity'] is None:
+            return track['bbox']
+        gap = frame_number - track['last_frame']
+        return {
+            key: track['bbox'][key] + track['velocity'][key] * gap
+            for key in ('x1', 'y1', 'x2', 'y2')
+        }
@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+import logging
+
+import cv2
+
+import metrics
+from frame_sampler import get_fourcc
+
+try:
+    import av
+except ImportError:  # PyAV is optional; without it keyframes are unknown
+    av = None
+
+logger = logging.getLogger(__name__)
+
+def probe_video(video_path: str) -> Dict:
+    """Read a video's properties, opening the file once
+    
+    With PyAV the container is demuxed without decoding, which gives the
+    exact frame count and the keyframe positions. Without PyAV, or if it
+    cannot read the file, the properties come from OpenCV and keyframes is
+    None.
+    
+    Args:
+        video_path: Local video file
+    
+    Returns:
+        Dictionary with duration_seconds, fps, frame_count, codec, width,
+        height (as coded with PyAV, i.e. before any display rotation),
+        keyframes (sorted frame numbers or None) and method ('pyav' or 'opencv')
+    """
+    start = time.perf_counter()
+    probe = None
+    if av is not None:
+        try:
+            probe = _probe_pyav(video_path)
+        except Exception as e:
+            logger.warning(f"PyAV could not probe {video_path}, falling back to OpenCV: {e}")
+    if probe is None:
+        probe = _probe_opencv(video_path)
+    metrics.PROBE_SECONDS.labels(probe['method']).observe(time.perf_counter() - start)
+    return probe
+
+def _probe_pyav(video_path: str) -> Dict:
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        fps = float(stream.average_rate or stream.guessed_rate or 0)
+        time_base = float(stream.time_base) if stream.time_base else 0.0
+        first_pts = stream.start_time or 0
+        
+        # Every packet of a video stream holds one frame; only keyframe
+        # packets need their position
+        frame_count = 0
+        keyframes = []
+        for packet in container.demux(stream):
+            if packet.size == 0:
+                continue
+            frame_count += 1
+            if packet.is_keyframe:
+                if packet.pts is not None and fps > 0 and time_base > 0:
+                    keyframes.append(round((packet.pts - first_pts) * time_base * fps))
+                else:
+                    keyframes.append(frame_count - 1)
+        
+        if stream.duration is not None and time_base > 0:
+            duration_seconds = stream.duration * time_base
+        elif container.duration is not None:
+            duration_seconds = container.duration / av.time_base
+        else:
+            duration_seconds = frame_count / fps if fps > 0 else 0.0
+        
+        return {
+            'duration_seconds': duration_seconds,
+            'fps': fps,
+            'frame_count': frame_count,
+            'codec': stream.codec_context.name,
+            'width': stream.codec_context.width,
+            'height': stream.codec_context.height,
+            'keyframes': sorted(set(keyframes)),
+            'method': 'pyav'
+        }
+
+def _probe_opencv(video_path: str) -> Dict:
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise ValueError("Could not open video file with OpenCV")
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if fps <= 0 or frame_count <= 0:
+            raise ValueError("Could not determine video properties")
+        return {
+            'duration_seconds': frame_count / fps,
+            'fps': fps,
+            'frame_count': frame_count,
+            'codec': get_fourcc(cap).strip(),
+            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'keyframes': None,
+            'method': 'opencv'
+        }
+    finally:
+        cap.release()
+
+class ProbeCache:
+    """Bounded in-memory cache of probe results per video generation
+    
+    GCS generations change whenever an object is overwritten, so an entry
+    never goes stale; the least recently used entries are dropped beyond
+    max_entries.
+    """
+    
+    def __init__(self, max_entries: int = 1024):
+        """Initialize the cache
+        
+        Args:
+            max_entries: Number of videos to remember
+        """
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """Get the probe result stored for key, or None"""
+        with self._lock:
+            probe = self._entries.get(key)
+            if probe is not None:
+                self._entries.move_to_end(key)
+            return probe
+    
+    def put(self, key: str, probe: Dict) -> None:
+        """Store a probe result"""
+        with self._lock:
+            self._entries[key] = probe
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+def probe_cache_key(blob) -> str:
+    """Identify one generation of a GCS object"""
+    return f"{blob.bucket.name}/{blob.name}#{blob.generation}"
@@ -1,25 +1,190 @@
 import cv2
+import gc
+import hashlib
 import numpy as np
-import tempfile
 import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
 from ultralytics import YOLO
 from typing import List, Dict, Tuple, Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Runtimes the model can be executed with, and the weight precisions they support
+INFERENCE_BACKENDS = ('torch', 'onnx', 'openvino')
+INFERENCE_PRECISIONS = ('fp32', 'int8')
+# Images from the calibration dataset used to choose the INT8 ONNX quantization ranges
+CALIBRATION_IMAGES = 100
+
+def file_digest(path: str) -> str:
+    """Short SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+def export_model(model_path: str, backend: str, precision: str = 'fp32', cache_dir: Optional[str] = None,
+                 calibration_data: Optional[str] = None) -> Tuple[str, str, str]:
+    """Export a PyTorch YOLO checkpoint for ONNX Runtime or OpenVINO, once
+    
+    Exports are kept in cache_dir under the checkpoint's name and content
+    hash, so every version of the weights is exported once and later loads
+    (other workers, restarts with a persistent cache_dir) reuse the file.
+    Models are exported with dynamic input shapes, so any imgsz and batch
+    size can be used. INT8 models are quantized statically, with ranges
+    calibrated on the images of calibration_data (an Ultralytics dataset
+    YAML, by default its coco8 sample, which is downloaded): by ONNX
+    Runtime's QDQ quantizer for ONNX and by NNCF for OpenVINO.
+    
+    Args:
+        model_path: PyTorch YOLO checkpoint (.pt)
+        backend: 'onnx' or 'openvino'
+        precision: 'fp32' or 'int8'
+        cache_dir: Directory for exported models
+        calibration_data: Dataset YAML for INT8 calibration
+    
+    Returns:
+        (path of the exported model, checkpoint path, model task)
+    """
+    source = YOLO(model_path)
+    checkpoint = source.ckpt_path or model_path
+    if not os.path.isfile(checkpoint):
+        raise ValueError(f"Cannot export {model_path}: no checkpoint file")
+    
+    cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'model-cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(checkpoint))[0]
+    name = f"{stem}-{file_digest(checkpoint)}-{precision}"
+    # Ultralytics recognises the format by the suffix
+    artifact = os.path.join(cache_dir, f"{name}.onnx" if backend == 'onnx' else f"{name}_openvino_model")
+    if os.path.exists(artifact):
+        logger.info(f"Using cached {backend} export {artifact}")
+        return artifact, checkpoint, source.task
+    
+    # Export next to a private copy of the weights, so that concurrent
+    # exports by other processes don't collide, then move it into place
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(dir=cache_dir) as workdir:
+        weights = os.path.join(workdir, os.path.basename(checkpoint))
+        shutil.copyfile(checkpoint, weights)
+        options = {'format': backend, 'dynamic': True}
+        if backend == 'openvino' and precision == 'int8':
+            options['int8'] = True
+            if calibration_data:
+                options['data'] = calibration_data
+        exported = YOLO(weights).export(**options)
+        
+        if backend == 'onnx' and precision == 'int8':
+            quantized = os.path.join(workdir, f"{stem}-int8.onnx")
+            quantize_onnx_int8(exported, quantized, calibration_images(calibration_data, source.task))
+            exported = quantized
+        
+        try:
+            os.replace(exported, artifact)
+        except OSError:
+            # Another process finished the same export first
+            if not os.path.exists(artifact):
+                raise
+    logger.info(f"Exported {checkpoint} to {artifact} in {time.perf_counter() - start:.1f}s")
+    return artifact, checkpoint, source.task
+
+def calibration_images(calibration_data: Optional[str], task: str, limit: int = CALIBRATION_IMAGES) -> List[str]:
+    """List the validation images of an Ultralytics dataset YAML, or of the task's default dataset"""
+    from ultralytics.cfg import TASK2DATA
+    from ultralytics.data.utils import IMG_FORMATS, check_det_dataset
+    
+    dataset = check_det_dataset(calibration_data or TASK2DATA[task])
+    sources = dataset.get('val') or dataset['train']
+    paths = []
+    for source in sources if isinstance(sources, list) else [sources]:
+        for root, _, files in os.walk(source):
+            paths.extend(os.path.join(root, name) for name in files
+                         if os.path.splitext(name)[1][1:].lower() in IMG_FORMATS)
+    if not paths:
+        raise ValueError(f"No calibration images found in {calibration_data or TASK2DATA[task]}")
+    return sorted(paths)[:limit]
+
+def quantize_onnx_int8(model_path: str, output_path: str, image_paths: List[str], imgsz: int = 640):
+    """Quantize an exported ONNX model to INT8 (QDQ), calibrated on image_paths
+    
+    Static quantization keeps activations in INT8 between layers, so ONNX
+    Runtime can use the CPU's INT8 instructions (VNNI, AMX); dynamically
+    quantized convolutions run slower than FP32.
+    """
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from ultralytics.data.augment import LetterBox
+    
+    input_name = onnx.load(model_path, load_external_data=False).graph.input[0].name
+    letterbox = LetterBox((imgsz, imgsz), auto=False)
+    
+    class ImageReader(CalibrationDataReader):
+        def __init__(self):
+            self.paths = iter(image_paths)
+        
+        def get_next(self):
+            for path in self.paths:
+                img = cv2.imread(path)
+                if img is not None:
+                    # Same preprocessing as Ultralytics: letterbox, BGR to RGB, CHW, 0-1
+                    img = letterbox(image=img)[:, :, ::-1].transpose(2, 0, 1)
+                    return {input_name: (img[None] / 255).astype(np.float32)}
+            return None
+    
+    quantize_static(model_path, output_path, ImageReader(), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+def downscaled_size(width: int, height: int, max_side: int) -> Tuple[int, int]:
+    """Size of a frame shrunk so that its longest side is at most max_side"""
+    scale = max_side / max(width, height)
+    if scale >= 1:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
 class YOLOInference:
     """YOLO model inference for object detection and image cropping"""
     
-    def __init__(self, model_path: str = 'yolov8n-seg.pt'):
+    def __init__(self, model_path: str = 'yolov8n.pt', backend: str = 'torch', precision: str = 'fp32',
+                 cache_dir: Optional[str] = None, calibration_data: Optional[str] = None):
         """Initialize YOLO model
         
+        With backend 'onnx' or 'openvino', the PyTorch checkpoint is exported
+        for that runtime (see export_model) and run through it. Ultralytics
+        does the pre- and post-processing for every backend, so detections
+        have the same format.
+        
         Args:
             model_path: Path to YOLO model file
+            backend: 'torch', 'onnx' or 'openvino'
+            precision: 'fp32', or 'int8' with the onnx and openvino backends
+            cache_dir: Directory for exported models
+            calibration_data: Dataset YAML for INT8 calibration
         """
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"Unknown inference backend '{backend}'")
+        if precision not in INFERENCE_PRECISIONS or (backend == 'torch' and precision != 'fp32'):
+            raise ValueError(f"The {backend} backend does not support {precision} precision")
+        self.model_path = model_path
+        self.backend = backend
+        self.precision = precision
+        self._checkpoint_path = None
+        # Ultralytics predictors are not thread-safe; requests and background
+        # jobs sharing this instance take turns
+        self._lock = threading.Lock()
+        self._model_identity = None
         try:
-            self.model = YOLO(model_path)
-            logger.info(f"YOLO model loaded successfully from {model_path}")
+            if backend == 'torch':
+                self.model = YOLO(model_path)
+            else:
+                artifact, self._checkpoint_path, task = export_model(model_path, backend, precision,
+                                                                     cache_dir, calibration_data)
+                self.model = YOLO(artifact, task=task)
+            logger.info(f"YOLO model loaded successfully from {model_path} ({backend}, {precision})")
         except Exception as e:
             logger.error(f"Failed to load YOLO model: {e}")
             raise
@@ -36,113 +201,210 @@ class YOLOInference:
         Returns:
             List of dictionaries containing cropped image data and metadata
         """
-        try:
-            # Load image
-            img = cv2.imread(image_path)
-            if img is None:
-                raise ValueError(f"Could not load image from {image_path}")
-            
-            h, w = img.shape[:2]
-            logger.info(f"Processing image: {w}x{h} pixels")
-            
-            # Run YOLO inference
-            results = self.model(img, conf=confidence_threshold)
-            result = results[0]  # Get first result
-            
-            # Extract detection information
-            boxes = result.boxes.xyxy.cpu().numpy()  # Bounding boxes (x1, y1, x2, y2)
-            classes = result.boxes.cls.cpu().numpy()  # Class IDs
-            confidences = result.boxes.conf.cpu().numpy()  # Confidence scores
-            class_names = result.names  # Class ID to name mapping
+        # Load image
+        img = cv2.imread(image_path)
+        if img is None:
+            logger.error(f"Error in detect_and_crop: could not load image from {image_path}")
+            raise ValueError(f"Could not load image from {image_path}")
+        
+        return self.detect_and_crop_frame(img, padding, confidence_threshold)
+    
+    def detect_and_crop_frame(self, frame: np.ndarray, padding: int = 20,
+                              confidence_threshold: float = 0.5) -> List[Dict]:
+        """Detect objects in an in-memory BGR frame
+        
+        Args:
+            frame: BGR image as returned by cv2.VideoCapture.read()
+            padding: Pixels to pad around bounding boxes
+            confidence_threshold: Minimum confidence for detections
             
-            logger.info(f"Detected {len(boxes)} objects")
+        Returns:
+            List of dictionaries containing cropped image data and metadata
+        """
+        return self.detect_and_crop_frames([frame], padding, confidence_threshold)[0]
+    
+    def detect_and_crop_frames(self, frames: List[np.ndarray], padding: int = 20,
+                               confidence_threshold: float = 0.5, imgsz: Optional[int] = None,
+                               downscale: bool = False, classes: Optional[List[int]] = None,
+                               inputs: Optional[List[Optional[np.ndarray]]] = None) -> List[List[Dict]]:
+        """Detect objects in a list of in-memory BGR frames
+        
+        With downscale=True, frames larger than imgsz are shrunk (with area
+        interpolation) before they reach the model, so its preprocessing
+        works on small images. Boxes are mapped back to the original frame
+        and crops are always cut from it at full resolution.
+        
+        Args:
+            frames: BGR images as returned by cv2.VideoCapture.read()
+            padding: Pixels to pad around bounding boxes
+            confidence_threshold: Minimum confidence for detections
+            imgsz: Longest side of the model input in pixels, or None for
+                the model's default
+            downscale: Shrink frames to imgsz before inference
+            classes: Only detect these class ids (see class_ids). Other
+                classes are dropped inside the model's NMS, before any
+                post-processing or cropping.
+            inputs: Per frame, the image to run the model on if the decoder
+                already shrank the frame, or None to derive it from the frame
             
-            # Process each detection
-            cropped_objects = []
-            for i, (box, class_id, confidence) in enumerate(zip(boxes, classes, confidences)):
-                try:
-                    x1, y1, x2, y2 = map(int, box)
-                    
-                    # Add padding, ensuring coordinates stay within image bounds
-                    x1_padded = max(0, x1 - padding)
-                    y1_padded = max(0, y1 - padding)
-                    x2_padded = min(w, x2 + padding)
-                    y2_padded = min(h, y2 + padding)
-                    
-                    # Crop the image
-                    cropped_img = img[y1_padded:y2_padded, x1_padded:x2_padded]
-                    
-                    # Get class information
-                    category_id = int(class_id)
-                    category_name = class_names[category_id]
-                    
-                    # Save cropped image to temporary file
-                    temp_file = tempfile.NamedTemporaryFile(
-                        delete=False, 
-                        suffix=f'_{category_name}_{i}.png'
-                    )
-                    temp_path = temp_file.name
-                    temp_file.close()
-                    
-                    # Save cropped image
-                    cv2.imwrite(temp_path, cropped_img)
-                    
-                    # Create metadata
-                    object_data = {
-                        'object_id': i,
-                        'category_id': category_id,
-                        'category_name': category_name,
-                        'confidence': float(confidence),
-                        'bbox': {
-                            'x1': x1,
-                            'y1': y1,
-                            'x2': x2,
-                            'y2': y2,
-                            'width': x2 - x1,
-                            'height': y2 - y1
-                        },
-                        'padded_bbox': {
-                            'x1': x1_padded,
-                            'y1': y1_padded,
-                            'x2': x2_padded,
-                            'y2': y2_padded,
-                            'width': x2_padded - x1_padded,
-                            'height': y2_padded - y1_padded
-                        },
-                        'cropped_image_path': temp_path,
-                        'cropped_image_size': {
-                            'width': cropped_img.shape[1],
-                            'height': cropped_img.shape[0]
-                        }
-                    }
-                    
-                    cropped_objects.append(object_data)
-                    logger.info(f"Processed object {i}: {category_name} (confidence: {confidence:.3f})")
-                    
-                except Exception as e:
-                    logger.error(f"Error processing object {i}: {e}")
+        Returns:
+            One list of detections per input frame, in input order. With a
+            segmentation model, each detection also has a 'mask' outline as
+            [x, y] points in frame coordinates.
+        """
+        if not frames:
+            return []
+        
+        try:
+            inputs = list(inputs) if inputs is not None else [None] * len(frames)
+            for i, frame in enumerate(frames):
+                if inputs[i] is not None:
                     continue
+                h, w = frame.shape[:2]
+                size = downscaled_size(w, h, imgsz) if downscale and imgsz else (w, h)
+                inputs[i] = frame if size == (w, h) else cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            
+            # Run YOLO inference
+            options = {'conf': confidence_threshold}
+            if imgsz:
+                options['imgsz'] = imgsz
+            if classes is not None:
+                options['classes'] = classes
+            with self._lock:
+                results = self.model(inputs, **options)
             
-            return cropped_objects
+            return [
+                self._crop_detections(frame, result, padding,
+                                      scale=(frame.shape[1] / model_input.shape[1],
+                                             frame.shape[0] / model_input.shape[0]))
+                for frame, model_input, result in zip(frames, inputs, results)
+            ]
             
         except Exception as e:
             logger.error(f"Error in detect_and_crop: {e}")
             raise
     
-    def cleanup_temp_files(self, cropped_objects: List[Dict]):
-        """Clean up temporary files created during inference
+    def _crop_detections(self, img: np.ndarray, result, padding: int,
+                         scale: Tuple[float, float] = (1.0, 1.0)) -> List[Dict]:
+        """Crop every detection in a YOLO result out of its source frame
         
-        Args:
-            cropped_objects: List of object data from detect_and_crop
+        scale is the (x, y) factor from the image the model saw to img.
         """
-        for obj in cropped_objects:
+        h, w = img.shape[:2]
+        logger.info(f"Processing image: {w}x{h} pixels")
+        
+        # Extract detection information
+        boxes = result.boxes.xyxy.cpu().numpy()  # Bounding boxes (x1, y1, x2, y2)
+        if scale != (1.0, 1.0):
+            boxes = boxes * np.array([scale[0], scale[1], scale[0], scale[1]])
+        classes = result.boxes.cls.cpu().numpy()  # Class IDs
+        confidences = result.boxes.conf.cpu().numpy()  # Confidence scores
+        class_names = result.names  # Class ID to name mapping
+        
+        # Segmentation models also give each object's outline, in the
+        # coordinates of the image the model saw
+        polygons = result.masks.xy if getattr(result, 'masks', None) is not None else None
+        
+        logger.info(f"Detected {len(boxes)} objects")
+        
+        # Process each detection
+        cropped_objects = []
+        for i, (box, class_id, confidence) in enumerate(zip(boxes, classes, confidences)):
             try:
-                temp_path = obj.get('cropped_image_path')
-                if temp_path and os.path.exists(temp_path):
-                    os.unlink(temp_path)
-                    logger.debug(f"Cleaned up temporary file: {temp_path}")
+                x1, y1, x2, y2 = map(int, box)
+                
+                # Add padding, ensuring coordinates stay within image bounds
+                x1_padded = max(0, x1 - padding)
+                y1_padded = max(0, y1 - padding)
+                x2_padded = min(w, x2 + padding)
+                y2_padded = min(h, y2 + padding)
+                
+                # Crop the image
+                cropped_img = img[y1_padded:y2_padded, x1_padded:x2_padded]
+                
+                # Get class information
+                category_id = int(class_id)
+                category_name = class_names[category_id]
+                
+                # Create metadata
+                object_data = {
+                    'object_id': i,
+                    'category_id': category_id,
+                    'category_name': category_name,
+                    'confidence': float(confidence),
+                    'bbox': {
+                        'x1': x1,
+                        'y1': y1,
+                        'x2': x2,
+                        'y2': y2,
+                        'width': x2 - x1,
+                        'height': y2 - y1
+                    },
+                    'padded_bbox': {
+                        'x1': x1_padded,
+                        'y1': y1_padded,
+                        'x2': x2_padded,
+                        'y2': y2_padded,
+                        'width': x2_padded - x1_padded,
+                        'height': y2_padded - y1_padded
+                    },
+                    'cropped_image': cropped_img,
+                    'cropped_image_size': {
+                        'width': cropped_img.shape[1],
+                        'height': cropped_img.shape[0]
+                    }
+                }
+                
+                if polygons is not None:
+                    object_data['mask'] = [
+                        [round(float(x) * scale[0]), round(float(y) * scale[1])] for x, y in polygons[i]
+                    ]
+                
+                cropped_objects.append(object_data)
+                logger.info(f"Processed object {i}: {category_name} (confidence: {confidence:.3f})")
+                
             except Exception as e:
-                logger.warning(f"Could not clean up temporary file: {e}")
+                logger.error(f"Error processing object {i}: {e}")
+                continue
+        
+        return cropped_objects
+    
+    def class_ids(self, names: List[str]) -> List[int]:
+        """Map category names to the model's class ids
+        
+        Args:
+            names: Category names, e.g. ['chair', 'couch']
+            
+        Returns:
+            Class ids in the order of names
+            
+        Raises:
+            ValueError: If the model has no category of one of the names
+        """
+        ids = {name: class_id for class_id, name in self.model.names.items()}
+        unknown = [name for name in names if name not in ids]
+        if unknown:
+            raise ValueError(f"Unknown categories: {', '.join(unknown)}")
+        return [ids[name] for name in names]
+    
+    @property
+    def model_identity(self) -> str:
+        """Identify the loaded weights, e.g. for cache keys
+        
+        Returns:
+            Model file name plus a hash of its contents when the file is
+            available, and the backend and precision unless they are the
+            PyTorch defaults
+        """
+        if self._model_identity is None:
+            ckpt_path = self._checkpoint_path or getattr(self.model, 'ckpt_path', None) or self.model_path
+            identity = os.path.basename(str(ckpt_path))
+            if os.path.isfile(ckpt_path):
+                identity = f"{identity}:{file_digest(ckpt_path)}"
+            if self.backend != 'torch':
+                identity = f"{identity}:{self.backend}-{self.precision}"
+            self._model_identity = identity
+        return self._model_identity
     
     def get_model_info(self) -> Dict:
         """Get information about the loaded YOLO model
@@ -154,14 +416,119 @@ class YOLOInference:
             return {
                 'model_path': self.model.ckpt_path if hasattr(self.model, 'ckpt_path') else 'Unknown',
                 'model_type': type(self.model).__name__,
+                'backend': self.backend,
+                'precision': self.precision,
                 'available_classes': list(self.model.names.values()) if hasattr(self.model, 'names') else []
             }
         except Exception as e:
             logger.error(f"Error getting model info: {e}")
             return {'error': str(e)}
 
+class ModelRegistry:
+    """Process-level cache of loaded YOLO models
+    
+    Models are loaded once per process and shared by every request. When the
+    registry is populated before gunicorn forks (``--preload``), the workers
+    inherit the weights copy-on-write instead of each loading their own copy.
+    """
+    
+    def __init__(self):
+        # Guards the dictionaries only; loads hold the lock of their own key
+        self._lock = threading.Lock()
+        self._models: Dict[str, YOLOInference] = {}
+        self._stats: Dict[str, Dict] = {}
+        self._load_locks: Dict[str, threading.Lock] = {}
+    
+    def get(self, model_path: str = 'yolov8n.pt', **options) -> YOLOInference:
+        """Return the shared model for model_path, loading it on first use
+        
+        Args:
+            model_path: Path to YOLO model file
+            **options: backend, precision and export settings passed to
+                YOLOInference; each backend and precision is a separate model
+            
+        Returns:
+            Shared YOLOInference instance
+        """
+        return self._get_or_load(model_path, options, count_reuse=True)
+    
+    def preload(self, model_path: str = 'yolov8n.pt', **options) -> YOLOInference:
+        """Load a model ahead of the first request
+        
+        Intended to run at import time in the gunicorn master. Objects that
+        exist at this point are moved out of the garbage collector's reach so
+        that collections in the forked workers don't touch (and copy) the
+        pages holding the weights.
+        
+        Args:
+            model_path: Path to YOLO model file
+            **options: backend, precision and export settings passed to
+                YOLOInference
+            
+        Returns:
+            Shared YOLOInference instance
+        """
+        yolo = self._get_or_load(model_path, options, count_reuse=False)
+        gc.freeze()
+        return yolo
+    
+    def _get_or_load(self, model_path: str, options: Dict, count_reuse: bool) -> YOLOInference:
+        backend = options.get('backend', 'torch')
+        key = model_path if backend == 'torch' else f"{model_path}:{backend}-{options.get('precision', 'fp32')}"
+        with self._lock:
+            yolo = self._lookup(key, count_reuse)
+            if yolo is not None:
+                return yolo
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        
+        # Loading or exporting can take minutes. Requests for the same model
+        # wait for that load; requests for loaded models are served meanwhile.
+        with load_lock:
+            with self._lock:
+                yolo = self._lookup(key, count_reuse)
+            if yolo is not None:
+                return yolo
+            
+            start = time.perf_counter()
+            yolo = YOLOInference(model_path, **options)
+            load_time = time.perf_counter() - start
+            with self._lock:
+                self._models[key] = yolo
+                self._stats[key] = {
+                    'load_time_seconds': round(load_time, 3),
+                    'loaded_at': datetime.utcnow().isoformat() + 'Z',
+                    'loaded_in_pid': os.getpid(),
+                    'reuse_count': 0
+                }
+            logger.info(f"Loaded {key} into model registry in {load_time:.2f}s")
+            return yolo
+    
+    def _lookup(self, key: str, count_reuse: bool) -> Optional[YOLOInference]:
+        """Get a loaded model, counting the reuse; the caller holds _lock"""
+        yolo = self._models.get(key)
+        if yolo is not None and count_reuse:
+            self._stats[key]['reuse_count'] += 1
+        return yolo
+    
+    def stats(self) -> Dict:
+        """Get load time and reuse counts for every loaded model
+        
+        Returns:
+            Dictionary keyed by model path (plus backend and precision for
+            exported models). Reuse counts are per process, so
+            each gunicorn worker reports its own.
+        """
+        with self._lock:
+            return {
+                model_path: dict(stats, pid=os.getpid())
+                for model_path, stats in self._stats.items()
+            }
+
+# Shared registry used by the Flask app
+model_registry = ModelRegistry()
+
 # Convenience function for quick inference
-def quick_detect(image_path: str, model_path: str = 'yolov8n-seg.pt', 
+def quick_detect(image_path: str, model_path: str = 'yolov8n.pt', 
                 padding: int = 20, confidence_threshold: float = 0.5) -> List[Dict]:
     """Quick detection function for simple use cases
     
@@ -175,8 +542,4 @@ def quick_detect(image_path: str, model_path: str = 'yolov8n-seg.pt',
         List of dictionaries containing cropped image data and metadata
     """
     yolo = YOLOInference(model_path)
-    try:
-        return yolo.detect_and_crop(image_path, padding, confidence_threshold)
-    finally:
-        # Clean up temporary files
-        yolo.cleanup_temp_files([]) 
\ No newline at end of file
+    return yolo.detect_and_crop(image_path, padding, confidence_threshold)
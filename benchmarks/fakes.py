@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+class FakeDetector:
+    """Stand-in for YOLOInference that returns made-up detections without a model
+    
+    Each frame gets objects_per_frame boxes placed pseudo-randomly from the
+    frame's pixels, so the same frame always yields the same boxes and runs
+    are reproducible. seconds_per_frame of sleep stands in for inference
+    cost; like PyTorch, sleeping releases the GIL.
+    """
+    
+    def __init__(self, objects_per_frame: int = 4, seconds_per_frame: float = 0.0,
+                 categories: Optional[List[str]] = None):
+        """Initialize the detector
+        
+        Args:
+            objects_per_frame: Number of detections per frame
+            seconds_per_frame: Simulated inference time per frame
+            categories: Category names to pick from
+        """
+        self.objects_per_frame = objects_per_frame
+        self.seconds_per_frame = seconds_per_frame
+        self.categories = categories or ['person', 'car', 'dog', 'chair']
+        self.model_identity = f"fake:{objects_per_frame}:{seconds_per_frame}"
+    
+    def detect_and_crop_frames(self, frames: List[np.ndarray], padding: int = 20,
+                               confidence_threshold: float = 0.5, imgsz: Optional[int] = None,
+                               downscale: bool = False, classes: Optional[List[int]] = None,
+                               inputs: Optional[List[Optional[np.ndarray]]] = None) -> List[List[Dict]]:
+        """Return detections in the format of YOLOInference.detect_and_crop_frames
+        
+        With downscale, frames the decoder did not already shrink (inputs)
+        are resized to imgsz like YOLOInference does, so that the cost is
+        measured; boxes are always placed on the full frame.
+        """
+        if downscale and imgsz:
+            for i, frame in enumerate(frames):
+                if inputs is None or inputs[i] is None:
+                    h, w = frame.shape[:2]
+                    scale = imgsz / max(w, h)
+                    if scale < 1:
+                        cv2.resize(frame, (max(1, round(w * scale)), max(1, round(h * scale))),
+                                   interpolation=cv2.INTER_AREA)
+        if self.seconds_per_frame:
+            time.sleep(self.seconds_per_frame * len(frames))
+        return [
+            [detection for detection in self._detect(frame, padding, confidence_threshold)
+             if classes is None or detection['category_id'] in classes]
+            for frame in frames
+        ]
+    
+    def class_ids(self, names: List[str]) -> List[int]:
+        """Map category names to ids, like YOLOInference.class_ids"""
+        unknown = [name for name in names if name not in self.categories]
+        if unknown:
+            raise ValueError(f"Unknown categories: {', '.join(unknown)}")
+        return [self.categories.index(name) for name in names]
+    
+    def _detect(self, img: np.ndarray, padding: int, confidence_threshold: float) -> List[Dict]:
+        h, w = img.shape[:2]
+        rng = np.random.default_rng(int(img[::32, ::32].sum()))
+        detections = []
+        for i in range(self.objects_per_frame):
+            confidence = float(rng.uniform(0.3, 1.0))
+            box_w = int(rng.integers(w // 16, w // 3))
+            box_h = int(rng.integers(h // 16, h // 3))
+            x1 = int(rng.integers(0, w - box_w))
+            y1 = int(rng.integers(0, h - box_h))
+            category_id = int(rng.integers(0, len(self.categories)))
+            if confidence < confidence_threshold:
+                continue
+            x2, y2 = x1 + box_w, y1 + box_h
+            x1_padded, y1_padded = max(0, x1 - padding), max(0, y1 - padding)
+            x2_padded, y2_padded = min(w, x2 + padding), min(h, y2 + padding)
+            cropped_img = img[y1_padded:y2_padded, x1_padded:x2_padded]
+            detections.append({
+                'object_id': i,
+                'category_id': category_id,
+                'category_name': self.categories[category_id],
+                'confidence': confidence,
+                'bbox': {'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2, 'width': box_w, 'height': box_h},
+                'padded_bbox': {
+                    'x1': x1_padded,
+                    'y1': y1_padded,
+                    'x2': x2_padded,
+                    'y2': y2_padded,
+                    'width': x2_padded - x1_padded,
+                    'height': y2_padded - y1_padded
+                },
+                'cropped_image': cropped_img,
+                'cropped_image_size': {'width': cropped_img.shape[1], 'height': cropped_img.shape[0]}
+            })
+        return detections
+
+class LocalStorageClient:
+    """Stand-in for storage.Client that keeps objects in memory or in a local directory
+    
+    Install it with gcs_io.set_storage_client(). Only the upload methods
+    used by GCSUploader are implemented.
+    """
+    
+    def __init__(self, root: Optional[str] = None, upload_latency: float = 0.0):
+        """Initialize the client
+        
+        Args:
+            root: Directory to write objects to (as root/bucket/object); in memory if None
+            upload_latency: Seconds every upload waits, to simulate the network
+        """
+        self.root = root
+        self.upload_latency = upload_latency
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, 'LocalBucket'] = {}
+        self.uploads = 0
+        self.uploaded_bytes = 0
+    
+    def bucket(self, bucket_name: str) -> 'LocalBucket':
+        with self._lock:
+            if bucket_name not in self._buckets:
+                self._buckets[bucket_name] = LocalBucket(self, bucket_name)
+            return self._buckets[bucket_name]
+    
+    def stats(self) -> Dict:
+        """Get the number of uploaded objects and their total size"""
+        with self._lock:
+            return {'uploads': self.uploads, 'uploaded_bytes': self.uploaded_bytes}
+    
+    def _store(self, bucket_name: str, blob_name: str, data: bytes) -> None:
+        if self.upload_latency:
+            time.sleep(self.upload_latency)
+        if self.root is not None:
+            path = os.path.join(self.root, bucket_name, blob_name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+        with self._lock:
+            if self.root is None:
+                self._buckets[bucket_name].objects[blob_name] = data
+            self.uploads += 1
+            self.uploaded_bytes += len(data)
+
+class LocalBucket:
+    """Bucket of a LocalStorageClient"""
+    
+    def __init__(self, client: LocalStorageClient, name: str):
+        self.client = client
+        self.name = name
+        self.objects: Dict[str, bytes] = {}
+    
+    def blob(self, blob_name: str) -> 'LocalBlob':
+        return LocalBlob(self, blob_name)
+
+class LocalBlob:
+    """Object of a LocalBucket"""
+    
+    def __init__(self, bucket: LocalBucket, name: str):
+        self.bucket = bucket
+        self.name = name
+    
+    def upload_from_string(self, data, content_type: Optional[str] = None, retry=None, **kwargs) -> None:
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.bucket.client._store(self.bucket.name, self.name, bytes(data))
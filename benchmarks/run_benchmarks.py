@@ -0,0 +1,273 @@
+"""Offline benchmark of extract_objects_from_video on synthesised videos
+
+Renders test videos with ffmpeg, runs them through the app's pipeline with
+a fake detector (or a real YOLO model with --model) and an in-memory or
+local-directory stand-in for GCS, and writes frames per second, per-stage
+latency, peak RSS and upload counts as JSON. Runs offline and CPU-only.
+
+Usage:
+    python benchmarks/run_benchmarks.py --suite quick --output results.json
+    python benchmarks/run_benchmarks.py --suite quick --model yolov8n.pt yolov8n-seg.pt
+    python benchmarks/run_benchmarks.py --suite quick --model yolov8n.pt --backend onnx --precision int8
+    python benchmarks/run_benchmarks.py --cases ffmpeg --decode-threads 2
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List
+import logging
+import multiprocessing
+
+from synth_videos import CODECS, synthesise_video, video_name
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), 'app')
+
+# Bump when the output format changes incompatibly
+SCHEMA_VERSION = 2
+
+def make_case(codec: str, width: int, height: int, seconds: int, fps: int = 30, gop: int = 250,
+              frame_interval: int = 20, batch_size: int = 8, crop_format: str = 'png',
+              sampling_strategy: str = 'auto', decoder: str = 'opencv', imgsz: int = None) -> Dict:
+    """Describe one benchmark run: the video to render and the extraction settings
+    
+    With imgsz, frames are shrunk to that size before inference, as the
+    service does by default.
+    """
+    video = {'codec': codec, 'width': width, 'height': height, 'fps': fps, 'seconds': seconds, 'gop': gop}
+    settings = {
+        'frame_interval': frame_interval,
+        'batch_size': batch_size,
+        'crop_format': crop_format,
+        'sampling_strategy': sampling_strategy,
+        'decoder': decoder,
+        'imgsz': imgsz
+    }
+    name = os.path.splitext(video_name(video))[0] + f"_every{frame_interval}_{sampling_strategy}_{crop_format}"
+    if decoder != 'opencv':
+        name += f"_{decoder}"
+    if imgsz:
+        name += f"_imgsz{imgsz}"
+    return {'name': name, 'video': video, 'settings': settings}
+
+SUITES = {
+    # A couple of minutes on a laptop: one case per codec plus resolution steps
+    'quick': [
+        make_case('h264', 640, 360, 10),
+        make_case('h264', 1280, 720, 10),
+        make_case('h264', 1920, 1080, 10),
+        make_case('hevc', 1280, 720, 10),
+        make_case('vp9', 1280, 720, 10),
+        make_case('mpeg4', 1280, 720, 10),
+        make_case('h264', 1280, 720, 10, frame_interval=5, crop_format='jpeg'),
+        # OpenCV against ffmpeg decoding, with the model inputs shrunk after and inside the decoder
+        make_case('h264', 1920, 1080, 10, imgsz=640),
+        make_case('h264', 1920, 1080, 10, decoder='ffmpeg'),
+        make_case('h264', 1920, 1080, 10, decoder='ffmpeg', imgsz=640)
+    ],
+    # Every codec, resolution and length, with both sampling densities and decoders
+    'full': [
+        make_case(codec, width, height, seconds, frame_interval=frame_interval, decoder=decoder)
+        for codec, (width, height), seconds, frame_interval, decoder in itertools.product(
+            CODECS, [(640, 360), (1280, 720), (1920, 1080)], [10, 60], [5, 30], ['opencv', 'ffmpeg']
+        )
+    ]
+}
+
+def run_case(case: Dict, video_path: str, options: Dict) -> Dict:
+    """Run one case in the current process and measure it
+    
+    Intended to run in a fresh process per case, so that the peak RSS is
+    that of the case alone.
+    """
+    os.environ.setdefault('PRELOAD_MODEL', 'false')
+    os.environ.setdefault('RESULT_CACHE_BACKEND', 'none')
+    os.environ.setdefault('JOB_STORE_PATH', os.path.join(tempfile.mkdtemp(prefix='benchmark-jobs-'), 'jobs.db'))
+    sys.path.insert(0, APP_DIR)
+    
+    import cv2
+    import gcs_io
+    import main as app_main
+    from fakes import FakeDetector, LocalStorageClient
+    
+    # The app logs every frame and upload at INFO
+    logging.getLogger().setLevel(logging.WARNING)
+    
+    storage_client = LocalStorageClient(options['storage_dir'], options['upload_latency_ms'] / 1000)
+    gcs_io.set_storage_client(storage_client)
+    
+    if options['model']:
+        from yolo_inference import YOLOInference
+        detector = YOLOInference(options['model'], backend=options['backend'], precision=options['precision'],
+                                 cache_dir=options['model_cache_dir'])
+        detector_name = f"{options['model']} ({options['backend']}, {options['precision']})"
+    else:
+        detector = FakeDetector(options['objects_per_frame'], options['inference_ms'] / 1000)
+        detector_name = detector.model_identity
+    
+    # Load the model's lazy parts (and, for YOLO, warm it up) outside the timed run
+    cap = cv2.VideoCapture(video_path)
+    ret, frame = cap.read()
+    cap.release()
+    if ret:
+        detector.detect_and_crop_frames([frame])
+    
+    settings = case['settings']
+    start = time.perf_counter()
+    result = app_main.extract_objects_from_video(
+        video_path,
+        detector,
+        settings['frame_interval'],
+        f"gs://benchmark/{os.path.basename(video_path)}",
+        batch_size=settings['batch_size'],
+        sampling_strategy=settings['sampling_strategy'],
+        crop_format=settings['crop_format'],
+        keep_frame_data=False,
+        imgsz=settings['imgsz'],
+        downscale=settings['imgsz'] is not None,
+        decoder=settings['decoder'],
+        decode_threads=options['decode_threads']
+    )
+    wall_seconds = time.perf_counter() - start
+    
+    stages = {}
+    for stage, stats in result['pipeline'].items():
+        stages[stage] = dict(stats, mean_ms=round(1000 * stats['busy_seconds'] / stats['items'], 3)
+                             if stats['items'] else None)
+    sampling = result['sampling']
+    uploads = storage_client.stats()
+    return {
+        'name': case['name'],
+        'video': dict(case['video'], frames=result['total_frames'], size_bytes=os.path.getsize(video_path)),
+        'settings': settings,
+        'detector': detector_name,
+        'wall_seconds': round(wall_seconds, 3),
+        'frames_sampled': result['total_frames_processed'],
+        'frames_decoded': sampling.get('frames_grabbed', 0) + sampling.get('frames_retrieved', 0),
+        'sampled_frames_per_second': round(result['total_frames_processed'] / wall_seconds, 2),
+        'video_frames_per_second': round(result['total_frames'] / wall_seconds, 2),
+        'detections': result['total_objects_detected'],
+        'sampling': sampling,
+        'stages': stages,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'uploads': {
+            'count': uploads['uploads'],
+            'bytes': uploads['uploaded_bytes'],
+            'failed': result['pipeline']['upload']['failed']
+        }
+    }
+
+def describe_environment() -> Dict:
+    """Record what the numbers were measured on"""
+    import cv2
+    import numpy as np
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=BENCHMARK_DIR, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'git_commit': commit
+    }
+
+def run_suite(cases: List[Dict], options: Dict) -> Dict:
+    """Render the videos of every case and run each case, once per model, in its own process"""
+    results = []
+    for case in cases:
+        video_path = synthesise_video(case['video'], options['video_dir'])
+        for model in options['models'] or [None]:
+            logger.info(f"Running {case['name']}" + (f" with {model}" if model else ''))
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(run_case, case, video_path, dict(options, model=model)).result()
+            logger.info(f"{case['name']} ({result['detector']}): {result['sampled_frames_per_second']} sampled frames/s, "
+                        f"{result['video_frames_per_second']} video frames/s, peak RSS {result['peak_rss_mb']} MB, "
+                        f"{result['uploads']['count']} uploads")
+            results.append(result)
+    return {
+        'schema_version': SCHEMA_VERSION,
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+        'environment': describe_environment(),
+        'options': {key: value for key, value in options.items()
+                    if key not in ('video_dir', 'storage_dir', 'model_cache_dir')},
+        'cases': results
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--suite', choices=sorted(SUITES), default='quick', help='Set of cases to run')
+    parser.add_argument('--cases', nargs='*', help='Only run cases whose name contains one of these strings')
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+    parser.add_argument('--model', nargs='+',
+                        help='Use these YOLO models (e.g. yolov8n.pt yolov8n-seg.pt) instead of the fake detector, '
+                             'running every case once per model')
+    parser.add_argument('--backend', choices=['torch', 'onnx', 'openvino'], default='torch',
+                        help='Runtime for the --model: PyTorch, or an export for ONNX Runtime or OpenVINO')
+    parser.add_argument('--precision', choices=['fp32', 'int8'], default='fp32',
+                        help='Weight precision of the exported --model')
+    parser.add_argument('--model-cache-dir', default=os.path.join(tempfile.gettempdir(), 'model-cache'),
+                        help='Where exported models are kept between runs')
+    parser.add_argument('--decode-threads', type=int, default=0,
+                        help="Decoding threads of the cases that decode with ffmpeg (0: ffmpeg's default)")
+    parser.add_argument('--objects-per-frame', type=int, default=4, help='Detections per frame of the fake detector')
+    parser.add_argument('--inference-ms', type=float, default=0.0, help='Simulated inference time per frame of the fake detector')
+    parser.add_argument('--upload-latency-ms', type=float, default=0.0, help='Simulated time per upload')
+    parser.add_argument('--storage-dir', help='Write uploads to this directory instead of keeping them in memory')
+    parser.add_argument('--video-dir', default=os.path.join(tempfile.gettempdir(), 'video-benchmarks'),
+                        help='Where synthesised videos are kept between runs')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = parse_args(argv)
+    if args.backend != 'torch' and not args.model:
+        logger.error("--backend needs a --model to export")
+        return 1
+    cases = SUITES[args.suite]
+    if args.cases:
+        cases = [case for case in cases if any(pattern in case['name'] for pattern in args.cases)]
+        if not cases:
+            logger.error(f"No case of the {args.suite} suite matches {args.cases}")
+            return 1
+    options = {
+        'models': args.model,
+        'backend': args.backend,
+        'precision': args.precision,
+        'model_cache_dir': args.model_cache_dir,
+        'decode_threads': args.decode_threads,
+        'objects_per_frame': args.objects_per_frame,
+        'inference_ms': args.inference_ms,
+        'upload_latency_ms': args.upload_latency_ms,
+        'storage_dir': args.storage_dir,
+        'video_dir': args.video_dir
+    }
+    
+    report = run_suite(cases, options)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        logger.info(f"Wrote {len(report['cases'])} results to {args.output}")
+    else:
+        print(output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+import os
+import shutil
+import subprocess
+from typing import Dict
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Codec name -> (ffmpeg encoder and options, container extension)
+CODECS = {
+    'h264': (['-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p'], '.mp4'),
+    'hevc': (['-c:v', 'libx265', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-tag:v', 'hvc1'], '.mp4'),
+    'vp9': (['-c:v', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', '8', '-pix_fmt', 'yuv420p'], '.webm'),
+    'mpeg4': (['-c:v', 'mpeg4', '-q:v', '5'], '.avi'),
+    'mjpeg': (['-c:v', 'mjpeg', '-q:v', '5', '-pix_fmt', 'yuvj420p'], '.avi')
+}
+
+def video_name(spec: Dict) -> str:
+    """File name that identifies a synthesised video by all of its parameters"""
+    _, extension = CODECS[spec['codec']]
+    return (f"{spec['codec']}_{spec['width']}x{spec['height']}_{spec['fps']}fps_"
+            f"{spec['seconds']}s_gop{spec['gop']}{extension}")
+
+def synthesise_video(spec: Dict, directory: str) -> str:
+    """Render a test video with ffmpeg, or reuse it if it was rendered before
+    
+    The video shows ffmpeg's testsrc2 pattern: moving shapes, a counter and
+    a colour gradient, so consecutive frames differ and the codecs have
+    real work to do. Rendering is deterministic, so the same spec always
+    produces the same frames.
+    
+    Args:
+        spec: codec (a key of CODECS), width, height, fps, seconds and gop
+            (frames between keyframes)
+        directory: Where rendered videos are kept
+    
+    Returns:
+        Path of the video
+    """
+    if shutil.which('ffmpeg') is None:
+        raise RuntimeError("ffmpeg is required to synthesise benchmark videos")
+    
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, video_name(spec))
+    if os.path.exists(path):
+        return path
+    
+    encoder_options, _ = CODECS[spec['codec']]
+    source = f"testsrc2=size={spec['width']}x{spec['height']}:rate={spec['fps']}:duration={spec['seconds']}"
+    partial_path = f"{path}.partial{os.path.splitext(path)[1]}"
+    cmd = [
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', source,
+        *encoder_options,
+        '-g', str(spec['gop']),
+        partial_path
+    ]
+    logger.info(f"Rendering {os.path.basename(path)}")
+    try:
+        subprocess.run(cmd, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"ffmpeg error: {e.stderr}")
+        raise
+    os.replace(partial_path, path)
+    return path